@@ -0,0 +1,244 @@
+"""
+Time the core task tree operations on synthetic trees,
+and compare the results against a stored baseline.
+
+    python -m benchmarks [--sizes 1000 10000] [--shapes wide deep ...]
+
+Exits with status 1 if any operation got slower than the baseline allows.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from io import StringIO
+from pathlib import Path
+from typing import Callable
+
+from prompt_toolkit import HTML
+from prompt_toolkit.completion import CompleteEvent
+from prompt_toolkit.document import Document
+from prompt_toolkit.formatted_text import to_formatted_text
+
+from della.cli import format_task_lines
+from della.completion import TaskCompleter
+from della.exporters import export_tasks
+from della.search_index import SearchIndex
+from della.task import Task, TaskManager, cached_slugify
+
+from .generators import SHAPES, make_manager
+
+BASELINE_PATH = Path(__file__).parent.joinpath("baseline.json")
+DEFAULT_SIZES = [1_000, 10_000]
+
+
+def _timed(func: Callable[[], object], repeat: int = 3) -> float:
+    """Best wall time of several calls, in seconds"""
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def _timed_each(func: Callable[[Task], object], tasks: list[Task]) -> float:
+    start = time.perf_counter()
+
+    for task in tasks:
+        func(task)
+
+    return (time.perf_counter() - start) / max(1, len(tasks))
+
+
+def bench_tree(shape: str, size: int, samples: int, seed: int = 0) -> dict[str, float]:
+    rng = random.Random(seed)
+    results: dict[str, float] = {}
+
+    results["bulk_insert"] = _timed(lambda: make_manager(shape, size, seed=seed))
+    manager = make_manager(shape, size, seed=seed)
+
+    tasks = list(manager.tasks_index.values())
+    picked = rng.sample(tasks, min(samples, len(tasks)))
+
+    # kept aside for moving and deleting, so adding can't give them subtasks
+    picked_set = set(picked)
+    leaves = [t for t in tasks if not t.subtasks and t not in picked_set]
+    leaves = rng.sample(leaves, min(samples, len(leaves)))
+
+    results["search"] = _timed_each(lambda t: manager.search(t.slug), picked)
+
+    results["task_from_path"] = _timed_each(
+        lambda t: manager.task_from_path(t.path_str), picked
+    )
+
+    results["task_from_path_keyword"] = _timed_each(
+        lambda t: manager.task_from_path(f"#{t.slug}"), picked
+    )
+
+    completer = TaskCompleter.from_tasks(manager.root_task)
+    event = CompleteEvent()
+
+    def complete(t: Task):
+        # the text typed so far for the deepest part of the path
+        text = f"#{t.path_str}"[:-1]
+        list(completer.get_completions(Document(text), event))
+
+    results["get_completions"] = _timed_each(complete, picked)
+
+    results["search_index_build"] = _timed(lambda: SearchIndex.build(manager))
+
+    # every word of a task's content, so each query has at least one match
+    results["grep"] = _timed_each(
+        lambda t: manager.search_index.search(t.content), picked
+    )
+
+    results["format_tasks"] = _timed(
+        lambda: [
+            to_formatted_text(HTML(line))
+            for line in format_task_lines(manager, manager.root_task, term_width=120)
+        ]
+    )
+
+    buffer = StringIO()
+
+    def serialize():
+        buffer.seek(0)
+        buffer.truncate()
+        manager.serialize(buffer)
+
+    results["serialize"] = _timed(serialize)
+
+    with open(os.devnull, "w") as devnull:
+        results["export_jsonl"] = _timed(lambda: export_tasks(manager, devnull))
+
+    def deserialize():
+        # as loaded by a fresh process, with no slugs cached yet
+        cached_slugify.cache_clear()
+        TaskManager.deserialize("tasks.toml", fp=StringIO(buffer.getvalue()))
+
+    results["deserialize"] = _timed(deserialize)
+
+    counter = iter(range(samples))
+    results["add_task"] = _timed_each(
+        lambda t: manager.add_task(f"benchmark task {next(counter)}", t), picked
+    )
+
+    # each leaf gets its own new parent, so slugs can't collide
+    targets = {
+        t: manager.add_task(f"benchmark move target {t.path_str}") for t in leaves
+    }
+    results["move_task"] = _timed_each(
+        lambda t: manager.move_task(t, targets[t]), leaves
+    )
+
+    results["delete_task"] = _timed_each(manager.delete_task, leaves)
+
+    return results
+
+
+def run_benchmarks(shapes: list[str], sizes: list[int], samples: int):
+    results: dict[str, float] = {}
+
+    for size in sizes:
+        for shape in shapes:
+            print(f"{shape} x {size}...", file=sys.stderr)
+            tree_results = bench_tree(shape, size, samples)
+
+            for op, seconds in tree_results.items():
+                results[f"{shape}/{size}/{op}"] = seconds
+
+    return results
+
+
+def compare(
+    results: dict[str, float],
+    baseline: dict[str, float],
+    tolerance: float = 0.5,
+    min_delta: float = 0.001,
+) -> list[str]:
+    """
+    Returns a description of each result slower than its baseline
+    by more than `tolerance` (a fraction), ignoring differences under
+    `min_delta` seconds, which are mostly noise.
+    """
+    regressions = []
+
+    for key, seconds in results.items():
+        if key not in baseline:
+            continue
+
+        allowed = baseline[key] * (1 + tolerance)
+
+        if seconds > allowed and seconds - baseline[key] > min_delta:
+            regressions.append(
+                f"{key}: {seconds * 1000:.2f}ms (baseline {baseline[key] * 1000:.2f}ms)"
+            )
+
+    return regressions
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--shapes", nargs="+", choices=list(SHAPES), default=list(SHAPES)
+    )
+    parser.add_argument(
+        "--samples", type=int, default=20, help="Operations timed per tree"
+    )
+    parser.add_argument("--output", type=Path, default=None, help="Write results here")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store these results as the new baseline instead of comparing",
+    )
+
+    return parser
+
+
+def main():
+    args = make_parser().parse_args()
+    results = run_benchmarks(args.shapes, args.sizes, args.samples)
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.update_baseline:
+        baseline = {}
+        if args.baseline.exists():
+            baseline = json.loads(args.baseline.read_text())
+
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        return 0
+
+    for key, seconds in results.items():
+        print(f"{key:<45} {seconds * 1000:>10.3f}ms")
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, nothing to compare", file=sys.stderr)
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    regressions = compare(results, baseline, tolerance=args.tolerance)
+
+    if regressions:
+        print("\nREGRESSIONS:", file=sys.stderr)
+        print("\n".join(regressions), file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
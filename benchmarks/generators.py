@@ -0,0 +1,108 @@
+"""Synthetic task trees for benchmarking"""
+
+from __future__ import annotations
+
+import random
+from datetime import date, timedelta
+from itertools import count
+from typing import Callable, Iterator, Optional
+
+from slugify import slugify
+
+from della.task import TaskManager
+
+Record = tuple[str, str, Optional[date]]
+
+VERBS = ["buy", "call", "email", "fix", "write", "review", "plan", "clean", "pay"]
+OBJECTS = ["milk", "report", "car", "taxes", "garden", "slides", "rent", "bike"]
+QUALIFIERS = ["today", "for alice", "for bob", "again", "before the trip", "asap"]
+
+
+def _path(parent_path: str, content: str) -> str:
+    slug = slugify(content)
+    return f"{parent_path}/{slug}" if parent_path else slug
+
+
+def wide(n: int, seed: int = 0) -> Iterator[Record]:
+    """Every task directly under the root"""
+    for i in range(n):
+        yield ("", f"task {i}", None)
+
+
+def deep(n: int, seed: int = 0, depth: int = 50) -> Iterator[Record]:
+    """Chains of nested tasks, `depth` levels each"""
+    parent_path = ""
+
+    for i in range(n):
+        if i % depth == 0:
+            parent_path = ""
+
+        content = f"step {i}"
+        yield (parent_path, content, None)
+        parent_path = _path(parent_path, content)
+
+
+def balanced(n: int, seed: int = 0, fanout: int = 10) -> Iterator[Record]:
+    """A complete tree where every task has `fanout` subtasks"""
+    # breadth first, so a parent is always yielded before its children
+    parents = [""]
+    produced = 0
+
+    for parent_path in parents:
+        for i in range(fanout):
+            if produced >= n:
+                return
+
+            content = f"node {produced}"
+            yield (parent_path, content, None)
+            parents.append(_path(parent_path, content))
+            produced += 1
+
+
+def realistic(n: int, seed: int = 0) -> Iterator[Record]:
+    """
+    Projects of very uneven size with short, often repeated task names,
+    and due dates on about a third of the tasks
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    unique = count()
+
+    # (parent path, slugs already used under it)
+    parents: list[tuple[str, set[str]]] = [("", set())]
+
+    for _ in range(n):
+        # later parents are picked more often, so some projects grow large
+        parent_path, used_slugs = parents[int(len(parents) * rng.random() ** 0.5)]
+
+        content = f"{rng.choice(VERBS)} {rng.choice(OBJECTS)}"
+        if rng.random() < 0.5:
+            content += f" {rng.choice(QUALIFIERS)}"
+
+        if slugify(content) in used_slugs:
+            content += f" {next(unique)}"
+
+        used_slugs.add(slugify(content))
+
+        due_date = None
+        if rng.random() < 0.33:
+            due_date = today + timedelta(days=rng.randint(-30, 365))
+
+        yield (parent_path, content, due_date)
+
+        if rng.random() < 0.2:
+            parents.append((_path(parent_path, content), set()))
+
+
+SHAPES: dict[str, Callable[..., Iterator[Record]]] = {
+    "wide": wide,
+    "deep": deep,
+    "balanced": balanced,
+    "realistic": realistic,
+}
+
+
+def make_manager(shape: str, n: int, seed: int = 0) -> TaskManager:
+    manager = TaskManager()
+    manager.add_tasks(SHAPES[shape](n, seed=seed))
+    return manager
@@ -0,0 +1,67 @@
+"""
+Storage for completed tasks.
+
+The archive lives next to the task file, and is only ever appended to
+when a task is completed. It's only read when looking through the history
+or restoring a task, and never synced, so however many tasks are completed
+the task file stays small.
+"""
+
+from __future__ import annotations
+
+from datetime import date as DateType
+from pathlib import Path
+from typing import Any
+
+import toml
+
+from .task import Task, TaskException
+
+
+def archive_path(task_file: Path) -> Path:
+    return task_file.with_name(f"{task_file.stem}_archive.toml")
+
+
+def archive_task(archive_file: Path, task: Task) -> dict[str, Any]:
+    entry = task._to_dict(recurse=True)
+    entry.update(
+        {
+            "parent_path": task.parent.path_str if task.parent is not None else "",
+            "done_date": DateType.today().isoformat(),
+        }
+    )
+
+    # each entry is its own [[archived]] table, so appending keeps the file valid
+    with open(archive_file, "a") as outfile:
+        outfile.write("\n" + toml.dumps({"archived": [entry]}))
+
+    return entry
+
+
+def load_archive(archive_file: Path) -> list[dict[str, Any]]:
+    """All archived tasks, most recently completed first"""
+    if not archive_file.exists():
+        return []
+
+    with open(archive_file, "r") as infile:
+        entries = toml.load(infile).get("archived", [])
+
+    return entries[::-1]
+
+
+def remove_entry(archive_file: Path, number: int) -> dict[str, Any]:
+    """
+    Remove an entry from the archive, numbered from 1 in the
+    order given by load_archive. Returns the removed entry.
+    """
+    entries = load_archive(archive_file)
+
+    if not 1 <= number <= len(entries):
+        raise TaskException(f"No archived task numbered {number}")
+
+    removed = entries.pop(number - 1)
+
+    with open(archive_file, "w") as outfile:
+        toml.dump({"archived": entries[::-1]}, outfile)
+
+    return removed
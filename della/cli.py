@@ -1,42 +1,64 @@
 import sys
+from html import escape
 from pathlib import Path
 from shutil import get_terminal_size
 from signal import SIGINT, signal
-from typing import Optional
+from typing import Iterable, Optional, TextIO
+from weakref import WeakKeyDictionary
 
 from getchoice import ChoicePrinter
 from halo import Halo
 from prompt_toolkit import HTML, PromptSession, print_formatted_text
 from prompt_toolkit.completion import FuzzyCompleter
 from prompt_toolkit.formatted_text import merge_formatted_text, to_formatted_text
-from prompt_toolkit.layout.processors import Processor
 from prompt_toolkit.styles import Style
 
 from .command_parser import CommandParser, CommandsInterface
-from .completion import CommandProcessor, DateProcessor, TaskCompleter, TaskProcessor
-from .constants import CONFIG_PATH, HELP_MESSAGE
+from .completion import InputLexer, TaskCompleter
+from .constants import CONFIG_PATH, DEFAULT_WORKSPACE, HELP_MESSAGE
 from .default_config import DEFAULT_CONFIG_TEXT
 from .init_tasks import DellaConfig
-from .task import Task, TaskException
+from .profiling import timed
+from .task import IndexSnapshot, Task, TaskException, TaskManager
+from .watcher import FileWatcher
+
+# how many ambiguous matches are offered before the rest, most used first
+CHOICES_SHOWN = 5
 
 
 def _format_tag(text: str, tag: str):
     return f"<{tag}>{text}</{tag}>"
 
 
-def make_cli_interface(styling: Style):
+def choose_path(chooser: ChoicePrinter, paths: list[str]) -> int:
+    """
+    Ask which of several task paths was meant, returning its index.
+    Only the first few are offered, unless asked to show the rest.
+    """
+    title = "Multiple matches! Which did you mean?"
+    options = [(p, i) for i, p in enumerate(paths)]
+
+    if len(options) > CHOICES_SHOWN:
+        more = (f"({len(options) - CHOICES_SHOWN} more)", -1)
+        _, chosen = chooser.getchoice(options[:CHOICES_SHOWN] + [more], title=title)
+
+        if chosen != -1:
+            return chosen
+
+    _, chosen = chooser.getchoice(options, title=title)
+    return chosen
+
+
+def make_cli_interface(styling: Style, messages: Optional[TextIO] = None):
     chooser = ChoicePrinter(style=styling)
 
     def cli_alert(message: str) -> None:
-        print_formatted_text(HTML(_format_tag(message, "alert")), style=styling)
+        print_formatted_text(
+            HTML(_format_tag(message, "alert")), style=styling, file=messages
+        )
 
     def cli_resolve_task(options: list[Task]) -> Task:
-        alert_title = "Multiple matches! Which did you mean?"
-
-        _, chosen = chooser.getchoice(
-            [(t.path_str, t) for t in options], title=alert_title
-        )
-        return chosen
+        return options[choose_path(chooser, [t.path_str for t in options])]
 
     def cli_confirm_delete(t: Task) -> bool:
         delete_message = f"Really delete '{t}?'"
@@ -59,6 +81,70 @@ def make_cli_interface(styling: Style):
     )
 
 
+def format_task_lines(
+    manager: TaskManager,
+    t: Task,
+    level: int = 0,
+    term_width: Optional[int] = None,
+    indent: str = " ",
+) -> list[str]:
+    """
+    Render the subtasks of t as a list of lines, each wrapped
+    in a prompt_toolkit HTML tag for its nesting level
+    """
+    if term_width is None:
+        term_width, _ = get_terminal_size()
+        term_width -= 5
+
+    ls = []
+
+    for index, subtask in enumerate(t.subtasks, start=1):
+        formatted_line = []
+        content, subtask_summary, display_date = manager.decompose(subtask)
+
+        # TODO properly handle line breaks
+        left_content = "".join(
+            (
+                f"{indent * level}{index}. ",
+                content,
+                f" | {subtask_summary}" if subtask_summary else " ",
+            )
+        )
+
+        right_padding = term_width - len(left_content)
+
+        formatted_line.append(left_content)
+
+        if display_date:
+            formatted_line.append(f"{display_date:>{right_padding}}")
+
+        ls.append(_format_tag("".join(formatted_line) + "\n", f"task_level_{level}"))
+
+        if subtask.subtasks:
+            ls.extend(
+                format_task_lines(manager, subtask, level + 1, term_width, indent)
+            )
+
+    return ls
+
+
+def format_result_line(
+    manager: TaskManager, t: Task, term_width: Optional[int] = None
+) -> str:
+    """A single task as one line of @find output, with its full path"""
+    if term_width is None:
+        term_width, _ = get_terminal_size()
+        term_width -= 5
+
+    _, _, display_date = manager.decompose(t)
+    path = escape(t.path_str)
+
+    if display_date:
+        path += f"{display_date:>{term_width - len(t.path_str)}}"
+
+    return _format_tag(path + "\n", "task_level_0")
+
+
 class CLI_Parser(CommandParser):
     def __init__(
         self,
@@ -67,11 +153,16 @@ class CLI_Parser(CommandParser):
         prompt_display: str = "=> ",
         prompt_color: str = "ansicyan",
         followup_prompt: str = ">> ",
+        messages: Optional[TextIO] = None,
     ) -> None:
         self.prompt_display = prompt_display
         self.prompt_color = prompt_color
         self.followup_prompt = followup_prompt
 
+        # where alerts and spinners go instead of stdout, so they can be
+        # kept out of an export
+        self.messages = messages
+
         if not Path(config_file).exists():
             with open(config_file, "w") as new_config:
                 new_config.write(DEFAULT_CONFIG_TEXT)
@@ -79,25 +170,31 @@ class CLI_Parser(CommandParser):
         self.config = DellaConfig.load(config_file)
 
         super().__init__(
-            make_cli_interface(self.config.style),
+            make_cli_interface(self.config.style, self.messages),
             self.config,
             named_days,
         )
 
-        self.processors: list[Processor] = [
-            DateProcessor(self.date_parser),
-            CommandProcessor(),
-            TaskProcessor(self.manager),
-        ]
+        # kept for each manager, so they go along with its workspace,
+        # along with what they were built from
+        self.completers: WeakKeyDictionary[
+            TaskManager, tuple[IndexSnapshot, int, FuzzyCompleter]
+        ] = WeakKeyDictionary()
+
+        # the manager is replaced when a newer task file is pulled
+        self.lexer = InputLexer(self.date_parser, lambda: self.manager)
 
         prompt_display = f"<{prompt_color}>{prompt_display}</{prompt_color}>"
         self.session = PromptSession(
             self.make_prompt_display(),
             complete_while_typing=True,
+            complete_in_thread=True,
             completer=self.update_completions(),
-            input_processors=self.processors,
+            lexer=self.lexer,
+            style=self.config.style,
         )
         self.indent = " "
+        self.watcher: Optional[FileWatcher] = None
 
     def make_prompt_display(self, followup: bool = False):
         elements = ""
@@ -106,12 +203,47 @@ class CLI_Parser(CommandParser):
         if self.task_env != self.manager.root_task:
             elements = "/".join(t.slug for t in self.task_env.full_path[-3:]) + "|"
 
+        if self.workspace != DEFAULT_WORKSPACE:
+            elements = f"{escape(self.workspace)}:{elements}"
+
         return HTML(f"<{self.prompt_color}>{elements}{display}</{self.prompt_color}>")
 
     def update_completions(self):
-        task_completer = TaskCompleter.from_tasks(self.manager.root_task)
-        self.completer = FuzzyCompleter(task_completer, WORD=False)
-        return self.completer
+        # only paths into shards read so far are completed, since reading
+        # every one would undo lazy loading. Top level tasks always are
+        snapshot = self.manager.snapshot()
+
+        built_from = self.completers.get(self.manager)
+
+        # only rebuilt when the tasks, or which are used most,
+        # have changed since the last prompt
+        if (
+            built_from is None
+            or built_from[0] is not snapshot
+            or built_from[1] != self.frecency.version
+        ):
+            task_completer = TaskCompleter.from_snapshot(
+                snapshot, word_source=self.complete_word, rank=self.frecency.score
+            )
+            built_from = (
+                snapshot,
+                self.frecency.version,
+                FuzzyCompleter(task_completer, WORD=False),
+            )
+            self.completers[self.manager] = built_from
+
+        return built_from[2]
+
+    def complete_word(self, prefix: str) -> list[str]:
+        # called from the completion thread, so like snapshot() it gives up
+        # rather than waiting on, or reading halfway through, a change
+        if not self.manager.write_lock.acquire(blocking=False):
+            return []
+
+        try:
+            return self.manager.search_index.complete(prefix, limit=50)
+        finally:
+            self.manager.write_lock.release()
 
     def format_subtasks(
         self,
@@ -119,47 +251,12 @@ class CLI_Parser(CommandParser):
         level=0,
         term_width: Optional[int] = None,
     ):
-        if term_width is None:
-            term_width, _ = get_terminal_size()
-            term_width -= 5
-
-        ls = []
-
-        for index, subtask in enumerate(t.subtasks, start=1):
-            formatted_line = []
-            content, subtask_summary, display_date = subtask.decompose()
-
-            # TODO properly handle line breaks
-            left_content = "".join(
-                (
-                    f"{self.indent * level}{index}. ",
-                    content,
-                    f" | {subtask_summary}" if subtask_summary else " ",
-                )
-            )
-
-            right_padding = term_width - len(left_content)
-
-            formatted_line.append(left_content)
-
-            if display_date:
-                formatted_line.append(f"{display_date:>{right_padding}}")
-
-            line_str = _format_tag(
-                "".join(formatted_line) + "\n", f"task_level_{level}"
+        return [
+            to_formatted_text(HTML(line))
+            for line in format_task_lines(
+                self.manager, t, level, term_width, indent=self.indent
             )
-
-            line_formatted = to_formatted_text(HTML(line_str))
-            ls.append(line_formatted)
-
-            if subtask.subtasks:
-                recurse_args = {
-                    "term_width": term_width,
-                    "level": level + 1,
-                }
-                ls.extend(self.format_subtasks(subtask, **recurse_args))
-
-        return ls
+        ]
 
     def format_tasks(
         self,
@@ -173,19 +270,83 @@ class CLI_Parser(CommandParser):
 
         return self.format_subtasks(root_task)
 
+    @timed("list")
     def list(self, root_task: Task | None = None):
         formatted = merge_formatted_text(self.format_tasks(root_task=root_task))
         print_formatted_text(formatted, style=self.config.style)
 
+    @timed("list")
+    def list_results(self, results: Iterable[Task]):
+        for t in results:
+            print_formatted_text(
+                HTML(format_result_line(self.manager, t)),
+                style=self.config.style,
+                end="",
+            )
+
     def query(self, followup: bool = False) -> str:
         return self.session.prompt(
             self.make_prompt_display(followup=followup),
             completer=self.update_completions(),
-            input_processors=self.processors,
+            lexer=self.lexer,
         )
 
     def prompt(self):
-        self.from_prompt(self.query())
+        self.apply_external_changes()
+        user_input = self.query()
+
+        # the file may have changed while the prompt was open
+        self.apply_external_changes()
+        self.from_prompt(user_input)
+
+        # written straight away, so other processes see it too,
+        # and a later reload from disk can't lose it
+        if self.watcher is not None and self.manager.dirty:
+            self.save()
+
+    def watch(self):
+        """Start picking up changes other processes make to the task file"""
+        if self.watcher is None:
+            self.watcher = FileWatcher(self.filepath)
+            self.watcher.start()
+
+    def switch_workspace(self, name: str):
+        watching = self.watcher is not None
+
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+        try:
+            super().switch_workspace(name)
+        finally:
+            # the new workspace's file, or the same one if switching failed
+            if watching:
+                self.watch()
+
+    def apply_external_changes(self):
+        if self.watcher is None or not self.watcher.changed.is_set():
+            return
+
+        self.watcher.changed.clear()
+        self.merge_from_disk()
+        self.watcher.ignore_current()
+
+    def alert_in_background(self, message: str):
+        """Show an alert from another thread, above the prompt if it's open"""
+        app = self.session.app
+
+        if app.is_running and app.context is not None:
+            # within the prompt's context, printing redraws the prompt below
+            app.context.copy().run(self.interface.alert, message)
+        else:
+            self.interface.alert(message)
+
+    def save(self):
+        super().save()
+
+        if self.watcher is not None:
+            self.watcher.ignore_current()
 
     def __enter__(self, *args, **kwargs):
         signal(SIGINT, self._sigint_handler)
@@ -194,14 +355,27 @@ class CLI_Parser(CommandParser):
             super().__enter__()
             return self
 
-        with Halo(text="Loading from remote", spinner="bouncingBar"):
+        with Halo(
+            text="Loading from remote",
+            spinner="bouncingBar",
+            stream=self.messages or sys.stdout,
+        ):
             return super().__enter__()
 
     def __exit__(self, *args, **kwargs):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
         if not self.config.use_remote or not self.config.sync_config:
             super().__exit__()
+            return
 
-        with Halo(text="Syncing with remote", spinner="bouncingBar"):
+        with Halo(
+            text="Syncing with remote",
+            spinner="bouncingBar",
+            stream=self.messages or sys.stdout,
+        ):
             super().__exit__()
 
     def _sigint_handler(self, signal_received, frame):
@@ -211,6 +385,12 @@ class CLI_Parser(CommandParser):
 
 def start_cli_prompt(*args, **kwargs):
     with CLI_Parser() as cli_prompt:
+        if cli_prompt.config.watch_task_file:
+            cli_prompt.watch()
+
+        if cli_prompt.config.reminders:
+            cli_prompt.start_reminders(cli_prompt.alert_in_background)
+
         if cli_prompt.config.start_message:
             print_formatted_text(HTML(cli_prompt.config.start_message))
         while True:
@@ -3,17 +3,31 @@ from __future__ import annotations
 import abc
 import logging
 import os
+import shlex
 import sys
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import date
+from itertools import chain
 from pathlib import Path
-from typing import Callable, NamedTuple, Optional
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, TextIO
 
 from dateparse import DateParser
 from dateparse.parseutil import DateResult
 
-from .constants import COMMAND_ALIASES
-from .init_tasks import DellaConfig, SyncManager
+from . import profiling
+from .archive import archive_path, archive_task, load_archive, remove_entry
+from .constants import COMMAND_ALIASES, DEFAULT_WORKSPACE, TEXT_COMMANDS
+from .exporters import EXPORTERS, export_tasks
+from .frecency import Frecency, frecency_path
+from .importers import IMPORTERS
+from .init_tasks import DellaConfig, SyncGroup
+from .profiling import span, timed
+from .query import find_tasks, parse_query
+from .reminders import ReminderScheduler
+from .storage import load_manager, save_manager
 from .task import Task, TaskException, TaskManager
+from .watcher import file_signature
 
 
 class ParseResult(NamedTuple):
@@ -33,6 +47,21 @@ class CommandsInterface(NamedTuple):
     query_input: Optional[Callable[[], str]] = None
 
 
+@dataclass
+class Workspace:
+    """What's kept of a workspace while another one is in use"""
+
+    name: str
+    filepath: Path
+    manager: TaskManager
+    frecency: Frecency
+    task_env: Task
+
+    # the task file as it was last read or written, to tell
+    # whether another process has changed it since
+    signature: Optional[tuple[int, int, int]]
+
+
 def resolve_alias(input_command: str):
     for command, aliases in COMMAND_ALIASES.items():
         if input_command.lower() in aliases:
@@ -54,38 +83,267 @@ class CommandParser(metaclass=abc.ABCMeta):
 
         self.config = config
 
-        self.sync_manager: Optional[SyncManager] = None
+        self.sync_manager: Optional[SyncGroup] = None
+
+        self.reminders: Optional[ReminderScheduler] = None
 
-        if self.config.use_remote and self.config.sync_config is not None:
-            self.sync_manager = SyncManager(self.config)
+        # the numbered lines of the batch being run, if any. Nobody is
+        # asked anything then, and follow-ups are read from the next line
+        self.batch: Optional[Iterator[tuple[int, str]]] = None
 
-        self.filepath = Path(self.config.task_file_local).expanduser().resolve()
+        if self.config.use_remote and self.config.sync_configs:
+            self.sync_manager = SyncGroup(self.config)
 
-        if not self.filepath.exists():
-            os.makedirs(self.filepath.parent, exist_ok=True)
-            self.filepath.touch(exist_ok=True)
+        self.workspace = DEFAULT_WORKSPACE
 
-        self.manager = TaskManager.deserialize(self.filepath)
+        # recently used workspaces other than the current one, least recent
+        # first. With the current one, there are at most workspace_cache
+        self.inactive_workspaces: OrderedDict[str, Workspace] = OrderedDict()
+
+        self.filepath = self.open_task_file(self.config.task_file_local)
+
+        self.manager: TaskManager = self.load_manager()
+
+        # puts the tasks used most first when there's a choice
+        self.frecency = Frecency.load(frecency_path(self.filepath))
 
         self.task_env: Task = self.manager.root_task
 
+        # the synced task file as it was after the last pull, so it's
+        # only pushed again if something was written to it since
+        self.synced_signature = file_signature(self.config.task_file_local)
+
+    @staticmethod
+    def open_task_file(task_file: str | Path) -> Path:
+        filepath = Path(task_file).expanduser().resolve()
+
+        if not filepath.exists():
+            os.makedirs(filepath.parent, exist_ok=True)
+            filepath.touch(exist_ok=True)
+
+        return filepath
+
+    def load_manager(self) -> TaskManager:
+        # taken first, so changes made while reading are picked up later
+        self.file_signature = file_signature(self.filepath)
+
+        return load_manager(
+            self.filepath,
+            saved_index=self.config.persist_search_index,
+            undo_limit=self.config.undo_limit,
+            show_ids=self.config.show_ids,
+        )
+
     def list(self, root_task: Optional[Task] = None):
         raise NotImplementedError
 
+    def list_results(self, results: Iterable[Task]):
+        raise NotImplementedError
+
     def prompt(self, *args, **kwargs):
         raise NotImplementedError
 
     def __enter__(self, *args, **kwargs):
         if self.config.use_remote and self.sync_manager is not None:
-            self.sync_manager.pull_and_update()
+            if self.sync_manager.pull_and_update():
+                # the tasks loaded at startup are out of date now
+                self.manager = self.load_manager()
+                self.task_env = self.manager.root_task
+                self.synced_signature = file_signature(self.config.task_file_local)
+
+            self.alert_sync_failures()
         return self
 
     def __exit__(self, *args, **kwargs):
-        with open(self.manager.save_file_path, "w") as taskfile:
-            self.manager.serialize(taskfile)
+        if self.reminders is not None:
+            self.reminders.stop()
+            self.reminders = None
 
-        if self.config.use_remote and self.sync_manager is not None:
-            self.sync_manager.push_and_update()
+        # a session that only read, like an export, leaves the file be
+        if self.manager.dirty:
+            self.save()
+        else:
+            self.frecency.save()
+
+        for workspace in self.inactive_workspaces.values():
+            self.save_workspace(workspace)
+
+        self.push_changes()
+
+    def start_reminders(self, alert: Optional[Callable[[str], None]] = None):
+        """
+        Alert about upcoming due dates until the parser exits.
+        Alerts come from a background thread, so pass a thread safe
+        alternative to interface.alert if it isn't one.
+        """
+        if self.reminders is not None:
+            return
+
+        self.reminders = ReminderScheduler(
+            alert or self.interface.alert,
+            self.config.reminder_lead_days,
+            self.config.reminder_time,
+        )
+        self.reminders.watch(self.manager)
+        self.reminders.start()
+
+    def alert_sync_failures(self):
+        assert self.sync_manager is not None
+
+        for failure in self.sync_manager.failures():
+            self.interface.alert(f"Could not sync with {failure}")
+
+    def save(self):
+        save_manager(
+            self.manager,
+            self.config.storage,
+            saved_index=self.config.persist_search_index,
+        )
+        self.file_signature = file_signature(self.filepath)
+        self.frecency.save()
+
+    def save_workspace(self, workspace: Workspace):
+        """Write out a workspace that isn't the current one, if it's changed"""
+        if workspace.manager.dirty:
+            save_manager(
+                workspace.manager,
+                self.config.storage,
+                saved_index=self.config.persist_search_index,
+            )
+            workspace.signature = file_signature(workspace.filepath)
+
+        workspace.frecency.save()
+
+    def merge_from_disk(self):
+        """Bring in the changes another process made to the task file"""
+        changed = self.manager.merge(load_manager(self.filepath))
+        self.file_signature = file_signature(self.filepath)
+
+        if not changed:
+            return
+
+        # the current context may have been removed
+        env_path = self.task_env.path_str
+        if self.manager.tasks_index.get(env_path) is not self.task_env:
+            self.task_env = self.manager.root_task
+
+        self.interface.alert(f"Reloaded {len(changed)} changed tasks from disk")
+
+    def merge_if_changed(self):
+        """
+        Bring in the task file if another process wrote it since it was last
+        read or saved here. Any changes here that weren't saved yet lose out
+        to the ones on disk
+        """
+        if file_signature(self.filepath) == self.file_signature:
+            return
+
+        if self.manager.dirty:
+            self.interface.alert(
+                "The task file was changed by another process, "
+                "replacing the changes that weren't saved yet"
+            )
+
+        self.merge_from_disk()
+
+    def push_changes(self):
+        """Send the synced task file to the remote, if it was written since"""
+        if not self.config.use_remote or self.sync_manager is None:
+            return
+
+        signature = file_signature(self.config.task_file_local)
+
+        if signature == self.synced_signature:
+            return
+
+        self.sync_manager.push_and_update()
+        self.synced_signature = signature
+        self.alert_sync_failures()
+
+    def switch_workspace(self, name: str):
+        if name not in self.config.workspaces:
+            raise TaskException(f"No workspace named '{name}'")
+
+        if name == self.workspace:
+            return
+
+        current = Workspace(
+            self.workspace,
+            self.filepath,
+            self.manager,
+            self.frecency,
+            self.task_env,
+            self.file_signature,
+        )
+        # written now, so it can be checked against the file when switched back to
+        self.save_workspace(current)
+
+        self.inactive_workspaces[self.workspace] = current
+        cached = self.inactive_workspaces.pop(name, None)
+
+        if cached is not None:
+            self.filepath, self.manager = cached.filepath, cached.manager
+            self.frecency, self.task_env = cached.frecency, cached.task_env
+            self.file_signature = cached.signature
+
+            # changed by another process while it wasn't in use
+            if file_signature(self.filepath) != self.file_signature:
+                self.merge_from_disk()
+
+        else:
+            self.filepath = self.open_task_file(self.config.workspaces[name])
+            self.manager = self.load_manager()
+            self.frecency = Frecency.load(frecency_path(self.filepath))
+            self.task_env = self.manager.root_task
+
+        self.workspace = name
+
+        while len(self.inactive_workspaces) >= self.config.workspace_cache:
+            _, evicted = self.inactive_workspaces.popitem(last=False)
+            self.save_workspace(evicted)
+
+        if self.reminders is not None:
+            self.reminders.watch(self.manager)
+
+    def show_workspaces(self):
+        lines = []
+
+        for name, task_file in self.config.workspaces.items():
+            if name == self.workspace:
+                state = "current"
+            elif name in self.inactive_workspaces:
+                state = "loaded"
+            else:
+                state = ""
+
+            lines.append(f"{name:<16}{state:<10}{task_file}")
+
+        self.interface.alert("\n".join(lines))
+
+    def resolve_task(self, options: list[Task]) -> Task:
+        ranked = self.frecency.rank(options)
+
+        if self.batch is not None:
+            paths = ", ".join(t.path_str for t in ranked)
+            raise TaskException(f"Ambiguous task, could be any of {paths}")
+
+        return self.interface.resolve_task(ranked)
+
+    def confirm_delete(self, task: Task) -> bool:
+        # a batch is run as written
+        return self.batch is not None or self.interface.confirm_delete(task)
+
+    def followup(self) -> str:
+        """Ask for more input mid-command, or in a batch, read its next line"""
+        if self.batch is None:
+            return self.query(followup=True)
+
+        try:
+            _, line = next(self.batch)
+        except StopIteration:
+            raise TaskException("The batch ended before the command was finished")
+
+        return line.strip()
 
     def resolve_keyword(self, input_keyword: str) -> Task:
         options = self.manager.search(input_keyword)
@@ -96,20 +354,26 @@ class CommandParser(metaclass=abc.ABCMeta):
         located_task = options[0]
 
         if len(options) > 1:
-            located_task = self.interface.resolve_task(options)
+            located_task = self.resolve_task(options)
 
         return located_task
 
     def query(self, followup: bool = False) -> str:
         raise NotImplementedError
 
+    @timed("parse_input")
     def parse_input(self, input_str: str) -> ParseResult:
-        date_match = self.date_parser.get_last(input_str)
+        with span("parse_input.date"):
+            date_match = self.date_parser.get_last(input_str)
 
         remainder = input_str[: date_match.start] if date_match else input_str
 
         remainder_tokens = remainder.strip().split()
 
+        # only a date, such as "tomorrow"
+        if not remainder_tokens:
+            raise TaskException("A task cannot be empty")
+
         # @ marks a command, everything else is considered a new task to add
         command = None
         if remainder_tokens[0].startswith("@"):
@@ -124,13 +388,18 @@ class CommandParser(metaclass=abc.ABCMeta):
             parent_id = first_slug_match
             remainder_tokens.remove(first_slug_match)
 
-        elif command is not None and remainder_tokens:
+        elif (
+            command is not None
+            and remainder_tokens
+            and resolve_alias(command) not in TEXT_COMMANDS
+        ):
             parent_id = remainder_tokens[0]
 
         return ParseResult(
             input_str, " ".join(remainder_tokens), command, date_match, parent_id
         )
 
+    @timed("resolve_input")
     def resolve_input(self, parse_result: ParseResult):
         _, content, command, date_result, parent_id = parse_result
         logging.debug(parse_result)
@@ -140,7 +409,7 @@ class CommandParser(metaclass=abc.ABCMeta):
 
         else:
             target_task = self.manager.task_from_path(
-                parent_id, resolve_func=self.interface.resolve_task
+                parent_id, resolve_func=self.resolve_task
             )
 
         if target_task is None:
@@ -150,13 +419,13 @@ class CommandParser(metaclass=abc.ABCMeta):
 
         if not command:
             new_task = self.manager.add_task(content, target_task, task_date)
+            self.frecency.visit(target_task)
             date_message = ""
 
             if task_date is not None and task_date != date.today():
                 day_delta = task_date.toordinal() - date.today().toordinal()
                 date_message = f" for {task_date.isoformat()}, in {day_delta} days"
 
-            self.manager.reindex()
             self.interface.alert(f"Added task: {new_task.path_str}{date_message}")
             return
 
@@ -174,17 +443,17 @@ class CommandParser(metaclass=abc.ABCMeta):
                 if target_task == self.manager.root_task:
                     raise TaskException("No task specified to delete")
 
-                self.manager.delete_task(
-                    target_task, warn_func=self.interface.confirm_delete
-                )
+                self.manager.delete_task(target_task, warn_func=self.confirm_delete)
 
             case "quit":
                 sys.exit(0)
 
             case "list":
+                self.frecency.visit(target_task)
                 self.list(root_task=target_task)
 
             case "set":
+                self.frecency.visit(target_task)
                 self.task_env = target_task
                 self.interface.alert(
                     f"Set the current context to {target_task.path_str}"
@@ -194,14 +463,14 @@ class CommandParser(metaclass=abc.ABCMeta):
                 self.interface.alert(
                     f"Enter a new parent task for '{target_task.slug}':"
                 )
-                user_reply = self.parse_input(self.query(followup=True))
+                user_reply = self.parse_input(self.followup())
                 target_id = user_reply.parent_identifier
 
                 try:
                     assert target_id is not None
 
                     new_parent = self.manager.task_from_path(
-                        target_id, resolve_func=self.interface.resolve_task
+                        target_id, resolve_func=self.resolve_task
                     )
 
                     assert new_parent is not None
@@ -210,11 +479,239 @@ class CommandParser(metaclass=abc.ABCMeta):
                     raise TaskException("Invalid selection for move target")
 
                 self.manager.move_task(target_task, new_parent)
+                self.frecency.visit(target_task, new_parent)
                 self.interface.alert(f"Moved {parent_id} to {new_parent.path_str}")
 
+            case "stats":
+                self.show_stats(content, target_task)
+
+            case "done":
+                if target_task == self.manager.root_task:
+                    raise TaskException("No task specified to mark as done")
+
+                path_str = target_task.path_str
+                archive_task(archive_path(self.filepath), target_task)
+
+                # brought back with @restore rather than @undo
+                self.manager.delete_task(target_task, record=False)
+                self.interface.alert(f"Completed {path_str}")
+
+            case "history":
+                self.show_history(content)
+
+            case "restore":
+                self.restore(content)
+
+            case "find":
+                self.find(parse_result, target_task)
+
+            case "undo":
+                self.interface.alert(f"Undid {self.manager.undo()}")
+
+            case "redo":
+                self.interface.alert(f"Redid {self.manager.redo()}")
+
+            case "grep":
+                self.grep(parse_result, target_task)
+
+            case "workspace":
+                if not content:
+                    self.show_workspaces()
+                    return
+
+                self.switch_workspace(content)
+                self.interface.alert(f"Switched to the {content} workspace")
+
+            case "sort":
+                sorted_children = not target_task.sorted_children
+                self.manager.set_sorted(target_task, sorted_children)
+                name = target_task.path_str or "root"
+
+                if sorted_children:
+                    self.interface.alert(f"Sorted the subtasks of {name} by due date")
+                else:
+                    self.interface.alert(
+                        f"Subtasks of {name} are no longer kept sorted"
+                    )
+
+    def show_history(self, search_text: str = ""):
+        entries = load_archive(archive_path(self.filepath))
+        lines = []
+
+        for number, entry in enumerate(entries, start=1):
+            path = "/".join(p for p in (entry["parent_path"], entry["content"]) if p)
+
+            if search_text.lower() not in path.lower():
+                continue
+
+            subtask_count = len(entry.get("subtasks", []))
+            summary = f" ({subtask_count} subtasks)" if subtask_count else ""
+            lines.append(f"{number}. {path}{summary}, done {entry['done_date']}")
+
+        self.interface.alert("\n".join(lines) if lines else "No completed tasks")
+
+    def restore(self, number_str: str):
+        try:
+            number = int(number_str.strip())
+        except ValueError:
+            raise TaskException("Give the number of a task from @history to restore")
+
+        archive_file = archive_path(self.filepath)
+        entries = load_archive(archive_file)
+
+        if not 1 <= number <= len(entries):
+            raise TaskException(f"No archived task numbered {number}")
+
+        entry = entries[number - 1]
+
+        # back where it was, if that still exists
+        parent = self.manager.task_from_path(entry["parent_path"])
+        if parent is None:
+            parent = self.manager.root_task
+
+        restored = self.manager.add_outline([entry], parent, record=False)
+        remove_entry(archive_file, number)
+
+        self.interface.alert(f"Restored {restored[0].path_str}")
+
+    def find(self, parse_result: ParseResult, scope: Task):
+        # the query is read from the original input, since any
+        # date expressions in it were taken out of the content
+        try:
+            terms = shlex.split(parse_result.original_input)[1:]
+        except ValueError as e:
+            raise TaskException(f"Could not read query: {e}")
+
+        if parse_result.parent_identifier in terms:
+            terms.remove(parse_result.parent_identifier)
+
+        query = parse_query(terms, self.date_parser)
+
+        if query.scope is not None:
+            scope = self.manager.task_from_path(
+                query.scope, resolve_func=self.resolve_task
+            )
+
+            if scope is None:
+                raise TaskException(f"'{query.scope}' does not point to a valid task")
+
+        # results are found as they're listed, so both are timed together
+        with span("find"):
+            results = find_tasks(self.manager, query, scope)
+            first_result = next(results, None)
+
+            if first_result is None:
+                self.interface.alert("No matching tasks")
+                return
+
+            self.list_results(chain([first_result], results))
+
+    def grep(self, parse_result: ParseResult, scope: Task):
+        # like @find, the words are read from the original input
+        words = parse_result.original_input.split()[1:]
+
+        if parse_result.parent_identifier in words:
+            words.remove(parse_result.parent_identifier)
+
+        self.manager.load_all()
+        matches = self.manager.search_index.search(" ".join(words))
+
+        if scope is not self.manager.root_task:
+            prefix = scope.path_str + "/"
+            matches = {t for t in matches if t.path_str.startswith(prefix)}
+
+        if not matches:
+            self.interface.alert("No matching tasks")
+            return
+
+        self.list_results(sorted(matches, key=lambda t: t.path_str))
+
+    def show_task_stats(self, task: Task):
+        stats = task.subtree_stats()
+        name = task.path_str or "All tasks"
+        lines = [f"{name}: {stats.count} tasks below, {len(task.subtasks)} directly"]
+
+        if stats.earliest_due is not None:
+            assert stats.latest_due is not None
+            date_format = self.manager.date_format
+            lines.append(
+                f"Due from {stats.earliest_due.strftime(date_format)}"
+                f" to {stats.latest_due.strftime(date_format)}"
+            )
+
+        if stats.overdue:
+            lines.append(f"{stats.overdue} overdue")
+
+        self.interface.alert("\n".join(lines))
+
+    def show_stats(self, topic: str, task: Optional[Task] = None):
+        if topic in ("", "tasks"):
+            self.show_task_stats(task if task is not None else self.task_env)
+            return
+
+        if topic == "sync":
+            if self.sync_manager is None:
+                raise TaskException("No remotes are configured")
+
+            self.interface.alert("\n".join(self.sync_manager.report()))
+            return
+
+        if topic != "timing":
+            raise TaskException(f"No stats available for '{topic}'")
+
+        if not profiling.is_enabled():
+            profiling.enable()
+            self.interface.alert("Timing enabled, use '@stats timing' again to see it")
+            return
+
+        self.interface.alert("\n".join(profiling.report()))
+
     def from_prompt(self, input_prompt: str):
         if not input_prompt:
             return None
 
         result = self.parse_input(input_prompt)
         self.resolve_input(result)
+
+    def import_file(self, filepath: str | Path, import_format: str = "outline"):
+        if import_format not in IMPORTERS:
+            raise TaskException(f"Unknown import format '{import_format}'")
+
+        with open(Path(filepath).expanduser(), "r") as import_file:
+            added = IMPORTERS[import_format](self.manager, import_file, self.task_env)
+
+        self.interface.alert(f"Imported {len(added)} tasks")
+
+    def export(self, fp: TextIO, export_format: str = "jsonl"):
+        if export_format not in EXPORTERS:
+            raise TaskException(f"Unknown export format '{export_format}'")
+
+        export_tasks(self.manager, fp, export_format)
+
+    def from_batch(self, input_lines: Iterable[str]) -> int:
+        """
+        Run each line as a command, reporting errors per line
+        instead of stopping at the first one.
+        Returns the number of lines that failed.
+        """
+        failures = 0
+        self.batch = enumerate(input_lines, start=1)
+
+        try:
+            for line_number, line in self.batch:
+                if not line.strip():
+                    continue
+
+                try:
+                    self.from_prompt(line.strip())
+
+                # anything going wrong on one line shouldn't lose the rest
+                except Exception as e:
+                    failures += 1
+                    message = e if isinstance(e, TaskException) else repr(e)
+                    self.interface.alert(f"Line {line_number}: {message}")
+
+        finally:
+            self.batch = None
+
+        return failures
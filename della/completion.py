@@ -1,6 +1,7 @@
+import re
 from collections import deque
-from functools import reduce
-from typing import Any, Callable, Iterable, Optional, cast
+from itertools import chain
+from typing import Any, Callable, Hashable, Iterable, Mapping, NamedTuple, Optional
 
 from prompt_toolkit.completion import (
     CompleteEvent,
@@ -10,134 +11,241 @@ from prompt_toolkit.completion import (
 )
 from prompt_toolkit.document import Document
 from prompt_toolkit.formatted_text import FormattedText, StyleAndTextTuples
-from prompt_toolkit.layout.processors import (
-    Processor,
-    Transformation,
-    TransformationInput,
-)
+from prompt_toolkit.lexers import Lexer
 
 import dateparse
 
 from .constants import COMMAND_ALIASES
-from .task import Task, TaskManager
+from .task import IndexSnapshot, Task, TaskManager
 
+GREP_COMMANDS = frozenset(f"@{alias}" for alias in COMMAND_ALIASES["grep"])
 
-def style_token(
-    fragments: StyleAndTextTuples,
-    test_func: Callable[[str], tuple[int, int] | None],
-    style_apply: str,
-) -> StyleAndTextTuples:
-    fragments_tuples = cast(list[tuple[str, str]], fragments)
+_WORD_PATTERN = re.compile(r"\S+")
 
-    for i, tup in enumerate(fragments_tuples):
-        style, text = tup
-        if (func_result := test_func(text)) is None:
-            continue
+# how many words before an edit are parsed again for dates, since a date
+# like "a week from next friday" can start well before the word being typed
+_DATE_CONTEXT_WORDS = 5
 
-        start, end = func_result
 
-        split_fragments = [
-            (style, text[:start]),
-            (style_apply, text[start:end]),
-            (style, text[end:]),
-        ]
+class _LexedLine(NamedTuple):
+    text: str
+    # the start, end and style of every word
+    words: list[tuple[int, int, str]]
+    date: Optional[tuple[int, int]]
 
-        fragments_tuples[i] = split_fragments[0]
 
-        fragments_tuples.insert(i + 1, split_fragments[1])
-        fragments_tuples.insert(i + 2, split_fragments[2])
-        break
+def _common_prefix_length(a: str, b: str) -> int:
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
 
-    return cast(StyleAndTextTuples, fragments_tuples)
+    return min(len(a), len(b))
 
 
-class DateProcessor(Processor):
-    def __init__(self, date_parser: dateparse.DateParser, *args, **kwargs) -> None:
-        self.parser = date_parser
-        super().__init__(*args, **kwargs)
+class InputLexer(Lexer):
+    """
+    Highlights commands, task paths and dates in the prompt input,
+    using the highlight_* styles from the config.
+
+    Each line is remembered along with its words and date, so as the user
+    types only the words from the edit onwards are looked at again, and dates
+    are only parsed again from a few words before it. Each distinct word is
+    only classified the first time it's seen, against the manager's
+    snapshot. Everything is forgotten once a new snapshot has a different
+    index, since a path may have started or stopped pointing at a task.
+    """
 
-    def find_date(self, text: str) -> tuple[int, int] | None:
-        parse_result = self.parser.get_last(text)
+    def __init__(
+        self,
+        date_parser: dateparse.DateParser,
+        get_manager: Callable[[], TaskManager],
+    ) -> None:
+        self.date_parser = date_parser
+        self.get_manager = get_manager
 
-        if parse_result is None:
-            return None
+        self.commands: frozenset[str] = frozenset(
+            f"@{alias}" for aliases in COMMAND_ALIASES.values() for alias in aliases
+        )
 
-        return (parse_result.start, parse_result.end)
+        self._word_styles: dict[str, str] = {}
+        self._lines: dict[int, _LexedLine] = {}
 
-    def apply_transformation(
-        self, transformation_input: TransformationInput
-    ) -> Transformation:
-        fragments = style_token(transformation_input.fragments, self.find_date, "red")
+        # the snapshot's index that the words above were looked up in
+        self._tasks: Mapping[str, Task] = {}
 
-        return Transformation(fragments)
+        # the paths of the tasks in it by id and by slug,
+        # built the first time a #word is looked up
+        self._lookups: Optional[tuple[dict[int, str], dict[str, list[str]]]] = None
 
+    def _snapshot_tasks(self) -> Mapping[str, Task]:
+        # the same until the index changes, whatever else does
+        return self.get_manager().snapshot().tasks
 
-class CommandProcessor(Processor):
-    def __init__(self, *args, **kwargs) -> None:
-        self.commands: frozenset[str] = frozenset(
-            reduce(lambda s, n: s | n, COMMAND_ALIASES.values())
-        )
-        super().__init__(*args, **kwargs)
+    def _word_style(self, word: str) -> str:
+        style = self._word_styles.get(word)
 
-    def find_command(self, text: str) -> tuple[int, int] | None:
-        prefix_index = text.find("@")
+        if style is None:
+            style = ""
 
-        if prefix_index < 0:
-            return None
+            if word.lower() in self.commands:
+                style = "class:highlight_command"
 
-        command_token = text[prefix_index:].split()[0]
+            elif word.startswith("#") and len(word) > 1:
+                if self._names_task(word):
+                    style = "class:highlight_task"
 
-        if command_token.strip("@").lower() not in self.commands:
-            return None
+            self._word_styles[word] = style
 
-        end_index = prefix_index + len(command_token)
+        return style
 
-        return (prefix_index, end_index)
+    def _names_task(self, word: str) -> bool:
+        """
+        Whether a #word leads to exactly one task, as task_from_path would
+        find it. Only the snapshot is read, so highlighting never reads
+        a shard in, or sees a change halfway through.
+        """
+        if self._lookups is None:
+            ids: dict[int, str] = {0: ""}
+            slugs: dict[str, list[str]] = {}
 
-    def apply_transformation(
-        self, transformation_input: TransformationInput
-    ) -> Transformation:
-        fragments = style_token(
-            transformation_input.fragments, self.find_command, "orange"
-        )
+            for path, task in self._tasks.items():
+                if task.id is not None:
+                    ids[task.id] = path
 
-        return Transformation(fragments)
+                slugs.setdefault(path.rpartition("/")[2], []).append(path)
 
+            self._lookups = (ids, slugs)
 
-class TaskProcessor(Processor):
-    def __init__(self, manager: TaskManager, *args, **kwargs) -> None:
-        self.manager = manager
-        super().__init__(*args, **kwargs)
+        ids, slugs = self._lookups
+        first, _, rest = word[1:].partition("/")
 
-    def find_task_path(self, text: str) -> tuple[int, int] | None:
-        path = None
+        if first.startswith("id:") and first[3:].isdigit():
+            starts = [ids[int(first[3:])]] if int(first[3:]) in ids else []
+        else:
+            starts = list(slugs.get(first, []))
 
-        for token in text.split():
-            if token.startswith("#"):
-                path = token
-                break
+            if first.isdigit() and (by_id := ids.get(int(first))) is not None:
+                starts = [by_id] + [p for p in starts if p != by_id]
 
-        if path is None:
-            return None
+        if len(starts) != 1:
+            return False
+
+        return not rest or "/".join(p for p in (starts[0], rest) if p) in self._tasks
+
+    def _lex_words(
+        self, text: str, kept: list[tuple[int, int, str]]
+    ) -> list[tuple[int, int, str]]:
+        """Style the words of text after the kept ones, which are unchanged"""
+        words = list(kept)
+        seen_path = any(text[start] == "#" for start, _, _ in kept)
+
+        # only the first word can be a command, and only the first path
+        # is used as the parent, matching how the input is parsed
+        for match in _WORD_PATTERN.finditer(text, kept[-1][1] if kept else 0):
+            word = match.group()
+            style = ""
 
-        result = self.manager.task_from_path(path)
+            if not words and word.startswith("@"):
+                style = self._word_style(word)
 
-        if result is None:
+            elif word.startswith("#") and not seen_path:
+                seen_path = True
+                style = self._word_style(word)
+
+            words.append((match.start(), match.end(), style))
+
+        return words
+
+    def _find_date(self, text: str, start: int = 0) -> Optional[tuple[int, int]]:
+        date_match = self.date_parser.get_last(text[start:])
+
+        if date_match is None:
             return None
 
-        start_index = text.index(path)
-        end_index = start_index + len(path)
+        return (date_match.start + start, date_match.end + start)
 
-        return (start_index, end_index)
+    def _lex(self, text: str, last: Optional[_LexedLine]) -> _LexedLine:
+        if last is None:
+            return _LexedLine(text, self._lex_words(text, []), self._find_date(text))
 
-    def apply_transformation(
-        self, transformation_input: TransformationInput
-    ) -> Transformation:
-        fragments = style_token(
-            transformation_input.fragments, self.find_task_path, "pink"
-        )
+        edited = _common_prefix_length(text, last.text)
+
+        # a word touching the edit may have been extended, so it's redone
+        kept = [w for w in last.words if w[1] < edited]
+        words = self._lex_words(text, kept)
 
-        return Transformation(fragments)
+        context = _DATE_CONTEXT_WORDS
+
+        while True:
+            first = max(0, len(kept) - context)
+            window = words[first][0] if first < len(words) else len(text)
+            date = self._find_date(text, window)
+
+            # a date running up to the window may go on before it
+            if date is None or window == 0 or text[window : date[0]].strip():
+                break
+
+            context *= 2
+
+        if date is None and last.date is not None:
+            # the rightmost date is still the old one, if it's before
+            # the edit, and otherwise might be anywhere before it
+            if last.date[1] <= window:
+                date = last.date
+            elif window > 0:
+                date = self._find_date(text[:window])
+
+        return _LexedLine(text, words, date)
+
+    def lex_line(self, text: str, line_number: int = 0) -> StyleAndTextTuples:
+        if (tasks := self._snapshot_tasks()) is not self._tasks:
+            self._word_styles.clear()
+            self._lines.clear()
+            self._lookups = None
+            self._tasks = tasks
+
+        last = self._lines.get(line_number)
+
+        if last is None or last.text != text:
+            last = self._lines[line_number] = self._lex(text, last)
+
+        spans = [w for w in last.words if w[2]]
+
+        if last.date is not None:
+            date_start, date_end = last.date
+            spans = [s for s in spans if s[1] <= date_start or s[0] >= date_end]
+            spans.append((date_start, date_end, "class:highlight_date"))
+            spans.sort()
+
+        fragments: StyleAndTextTuples = []
+        position = 0
+
+        for start, end, style in spans:
+            if start > position:
+                fragments.append(("", text[position:start]))
+
+            fragments.append((style, text[start:end]))
+            position = end
+
+        if position < len(text):
+            fragments.append(("", text[position:]))
+
+        return fragments
+
+    def lex_document(self, document: Document) -> Callable[[int], StyleAndTextTuples]:
+        lines = document.lines
+
+        def get_line(line_number: int) -> StyleAndTextTuples:
+            try:
+                return self.lex_line(lines[line_number], line_number)
+            except IndexError:
+                return []
+
+        return get_line
+
+    def invalidation_hash(self) -> Hashable:
+        # re-lex when the tasks change, even if the text hasn't
+        return id(self._snapshot_tasks())
 
 
 def null_complete_closure():
@@ -181,7 +289,8 @@ def find_key_path(key_seq: list[str], input_dict: dict[str, Any]):
 
 
 def find_unique_keys(input_dict: dict[str, dict | None]):
-    keys: set[str] = set(k for k, v in input_dict.items() if v is None)
+    # a dict rather than a set, to keep the order keys were found in
+    keys: dict[str, None] = dict.fromkeys(k for k, v in input_dict.items() if v is None)
     dupes = set()
 
     validated_input_dict: dict[str, dict] = {
@@ -198,11 +307,11 @@ def find_unique_keys(input_dict: dict[str, dict | None]):
                 continue
 
             if key in keys:
-                keys.remove(key)
+                del keys[key]
                 dupes.add(key)
                 continue
 
-            keys.add(key)
+            keys[key] = None
 
         dict_queue.extendleft(d for d in current_dict.values() if d)
 
@@ -237,6 +346,7 @@ class TaskCompleter(Completer):
         self,
         completions_dict: dict,
         completions_formatter: Optional[Iterable[str]] = None,
+        word_source: Optional[Callable[[str], Iterable[str]]] = None,
     ) -> None:
         super().__init__()
         # set by the CLI_parser when the user switches focused tasks
@@ -245,6 +355,12 @@ class TaskCompleter(Completer):
         self.compdict = completions_dict
         self.relative_compdict = self.compdict
 
+        # gives words from task content starting with a prefix, for @grep
+        self.word_source = word_source
+
+        # slugs to offer first when completing a bare '#'
+        self.preferred_slugs: list[str] = []
+
         self.null_complete = null_complete_closure()()
 
     @classmethod
@@ -262,9 +378,50 @@ class TaskCompleter(Completer):
         return d
 
     @classmethod
-    def from_tasks(cls, task_root: Task):
+    def from_tasks(
+        cls,
+        task_root: Task,
+        word_source: Optional[Callable[[str], Iterable[str]]] = None,
+    ):
         comp_dict = TaskCompleter._dict_from_tasks(task_root)
-        return TaskCompleter(comp_dict)
+        return TaskCompleter(comp_dict, word_source=word_source)
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        snapshot: IndexSnapshot,
+        word_source: Optional[Callable[[str], Iterable[str]]] = None,
+        rank: Optional[Callable[[Task], float]] = None,
+    ):
+        """
+        Built from a snapshot of the index rather than the task tree,
+        so completing in another thread can't see the tree mid change.
+        With rank, higher ranked tasks are completed first at every level.
+        """
+        comp_dict: dict[str, Any] = {}
+        paths: Iterable[str] = snapshot.tasks
+        ranked: list[str] = []
+
+        if rank is not None:
+            ranks = {p: r for p, t in snapshot.tasks.items() if (r := rank(t)) > 0}
+            ranked = sorted(ranks, key=ranks.__getitem__, reverse=True)
+            paths = chain(ranked, (p for p in snapshot.tasks if p not in ranks))
+
+        for path in paths:
+            *parent_slugs, slug = path.split("/")
+            level = comp_dict
+
+            for parent_slug in parent_slugs:
+                if level.get(parent_slug) is None:
+                    level[parent_slug] = {}
+
+                level = level[parent_slug]
+
+            level.setdefault(slug, None)
+
+        completer = TaskCompleter(comp_dict, word_source=word_source)
+        completer.preferred_slugs = [p.rsplit("/", 1)[-1] for p in ranked]
+        return completer
 
     def completion_gen(
         self,
@@ -296,19 +453,32 @@ class TaskCompleter(Completer):
         tail = input_tokens[-1]
 
         if tail.startswith("@"):
-            for c in self.completion_gen(("delete", "list", "quit", "set")):
+            for c in self.completion_gen(sorted(COMMAND_ALIASES)):
                 yield c
 
         starts_keyword_base = tail.startswith("#")
         starts_relative_base = tail.startswith("/")
 
+        if (
+            self.word_source is not None
+            and len(input_tokens) > 1
+            and input_tokens[0].lower() in GREP_COMMANDS
+            and not (starts_keyword_base or tail == "OR")
+        ):
+            for word in self.word_source(tail):
+                yield Completion(word, start_position=-len(tail))
+            return
+
         if not (starts_relative_base or starts_keyword_base):
             return self.null_complete
 
         if starts_keyword_base and len(tail) == 1:
             uniques = find_unique_keys(self.compdict)
+            unique_set = set(uniques)
+            preferred = [s for s in self.preferred_slugs if s in unique_set]
+            uniques = list(dict.fromkeys(preferred + uniques))
 
-            for c in self.completion_gen(list(uniques)):
+            for c in self.completion_gen(uniques):
                 yield c
 
         task_item_start = document.find_backwards("/")
@@ -14,6 +14,10 @@ REMOTE_PATH: Final = resolve_path("~/della/tasks.toml")
 CONFIG_PATH: Final = resolve_path("~/.config/della/config.toml")
 
 TMP_SYNCFILE: Final = "tmp_tasks.toml"
+DAEMON_SOCKET: Final = "della.sock"
+
+# the workspace whose task file is task_file_local
+DEFAULT_WORKSPACE: Final = "default"
 
 
 _commands = {
@@ -27,8 +31,23 @@ _commands = {
     "quit": ["q", "exit"],
     "move": ["mv"],
     "help": ["h"],
+    "stats": [],
+    "done": ["complete"],
+    "history": [],
+    "restore": [],
+    "find": [],
+    "grep": [],
+    "undo": ["u"],
+    "redo": [],
+    "sort": [],
+    "workspace": ["ws"],
 }
 
+# commands that take free text rather than a task path
+TEXT_COMMANDS: Final = frozenset(
+    ["stats", "history", "restore", "find", "grep", "workspace"]
+)
+
 
 COMMAND_ALIASES: Final = {
     command: frozenset(aliases + [command]) for command, aliases in _commands.items()
@@ -57,6 +76,10 @@ To target a specific task for a command, prefix it with '#'.
 You can also target its subtasks this way, e.g. <ansiyellow>#foo/bar/baz</ansiyellow>
 But you can also just target the subtask directly, e.g. <ansiyellow>#baz</ansiyellow>
 If the task pointed to is ambiguous, you will be prompted to clarify.
+Every task also has a number that never changes, which can be used
+the same way, e.g. <ansiyellow>#42</ansiyellow> or <ansiyellow>#42/baz</ansiyellow>. Set show_ids in the config
+file to see them in listings. If a task is named after a number too, you will be
+asked which one you meant, and <ansiyellow>#id:42</ansiyellow> always means the task numbered 42.
 
 Commands:
     <ansiblue>@set, @cd</ansiblue> <ansiyellow>#task</ansiyellow>
@@ -70,17 +93,75 @@ Commands:
     <ansiblue>@list, @ls</ansiblue>  <ansiyellow>[ #task ]</ansiyellow>
         List the tasks in the current project, or the specified task if given.
         
+    <ansiblue>@sort</ansiblue>  <ansiyellow>[ #task ]</ansiyellow>
+        Keep the subtasks of the current project, or the specified task,
+        in order of due date, with undated ones last. New and moved tasks
+        go straight to their place. Use @sort again to go back to listing
+        them in the order they were added.
+
     <ansiblue>@delete, @del, @rm</ansiblue> <ansiyellow>#task</ansiyellow>
         Remove the specified task.
 
+    <ansiblue>@done, @complete</ansiblue> <ansiyellow>#task</ansiyellow>
+        Mark a task and all its subtasks as done.
+        They are moved to an archive file, which is kept out of the way
+        until you look at it with @history.
+
+    <ansiblue>@history</ansiblue> <ansiyellow>[ text ]</ansiyellow>
+        List completed tasks, most recent first,
+        optionally only those whose path contains the text.
+
+    <ansiblue>@restore</ansiblue> <ansiyellow>number</ansiyellow>
+        Bring back a completed task, using its number from @history.
+
+    <ansiblue>@find</ansiblue> <ansiyellow>[ #task ] query</ansiyellow>
+        List every task matching all the terms of the query, below the
+        current project or the given task. Terms can be:
+            text, word:text         content containing text, or the whole word
+            slug:name               an exact slug
+            due:, before:, after:   a due date, e.g. before:"next friday"
+            depth:2, depth:&lt;3       how far below the project
+            in:path                 only below another task
+            has:subtasks, no:due    and so on
+
+    <ansiblue>@grep</ansiblue> <ansiyellow>[ #task ] words</ansiyellow>
+        List every task below the current project or the given task
+        whose content contains all of the words.
+        Join words with OR to accept either, e.g. <ansiyellow>@grep report OR summary</ansiyellow>,
+        and end a word with * to match anything starting with it.
+
     <ansiblue>@move, @mv</ansiblue> <ansiyellow>#task</ansiyellow>
         Move a task and all its subtasks to a new parent. 
         This will prompt a second time for the new parent.
 
+    <ansiblue>@undo, @u</ansiblue>
+        Take back the last task added, moved or deleted, or the last import.
+        Completing and restoring tasks are undone with @done and @restore instead.
+
+    <ansiblue>@redo</ansiblue>
+        Make a change that was just undone again.
+
+    <ansiblue>@workspace, @ws</ansiblue> <ansiyellow>[ name ]</ansiyellow>
+        Switch to another task file named under [workspaces] in the config,
+        or list them all. The file set by task_file_local is "default".
+        Recently used workspaces stay loaded, so switching back is instant.
+
     <ansiblue>@quit, @q, @exit</ansiblue>
         Exit Della. 
         Your tasks are saved automatically, and synced to a remote server if configured.
 
+    <ansiblue>@stats</ansiblue> <ansiyellow>[ #task ]</ansiyellow>
+        Show how many tasks there are below the current project, or the
+        given task, when they're due, and how many are overdue.
+
+    <ansiblue>@stats timing</ansiblue>
+        Show how long della has spent on loading, saving, syncing, parsing
+        and listing during this session. Timing is switched on the first time
+        this is used, or from the start with <ansiyellow>della --profile</ansiyellow>.
+
+    <ansiblue>@stats sync</ansiblue>
+        Show how each remote host answered the last sync, and how long it took.
+
     <ansiblue>@help</ansiblue>
         Prints this message. 
 """
@@ -0,0 +1,445 @@
+"""
+A resident della process that keeps the task tree in memory
+and serves commands over a unix socket
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import socketserver
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from signal import SIGINT, SIGTERM, signal
+from typing import Any, Iterable, Optional
+
+from getchoice import ChoicePrinter
+from prompt_toolkit import HTML, print_formatted_text
+
+from .cli import (
+    choose_path,
+    format_result_line,
+    format_task_lines,
+    make_cli_interface,
+)
+from .command_parser import CommandParser, CommandsInterface
+from .constants import CONFIG_PATH, DAEMON_SOCKET
+from .init_tasks import DellaConfig
+from . import profiling
+from .profiling import timed
+from .task import Task, TaskException
+
+
+def socket_path(config: DellaConfig) -> Path:
+    return config.task_file_local.parent.joinpath(DAEMON_SOCKET)
+
+
+def _send(wfile, **message: Any):
+    wfile.write((json.dumps(message) + "\n").encode())
+    wfile.flush()
+
+
+def _receive(rfile) -> dict[str, Any]:
+    line = rfile.readline()
+
+    if not line:
+        raise ConnectionError("Connection closed")
+
+    return json.loads(line)
+
+
+class _ExportStream:
+    """Relays exported text to the client, in chunks rather than per task"""
+
+    chunk_size = 1 << 16
+
+    def __init__(self, wfile) -> None:
+        self.wfile = wfile
+        self.buffer: list[str] = []
+        self.buffered = 0
+
+    def write(self, text: str):
+        self.buffer.append(text)
+        self.buffered += len(text)
+
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            _send(self.wfile, export="".join(self.buffer))
+            self.buffer.clear()
+            self.buffered = 0
+
+
+class DaemonParser(CommandParser):
+    """
+    A CommandParser whose output and follow-up questions are relayed
+    to whichever client is currently connected
+    """
+
+    def __init__(self, config: DellaConfig) -> None:
+        self.rfile = None
+        self.wfile = None
+        self.term_width: Optional[int] = None
+
+        # alerts that came up while no client was connected
+        self.held_alerts: deque[str] = deque()
+
+        interface = CommandsInterface(
+            self._relay_alert,
+            self._relay_resolve_task,
+            self._relay_confirm_delete,
+            lambda: True,
+            self._relay_help,
+        )
+
+        super().__init__(interface, config)
+
+    def _ask(self, **message: Any):
+        _send(self.wfile, **message)
+        return _receive(self.rfile).get("reply")
+
+    def _relay_alert(self, message: str) -> None:
+        # such as from a checkpoint, in between clients
+        if self.wfile is None:
+            self.hold_alert(message)
+            return
+
+        _send(self.wfile, alert=message)
+
+    def hold_alert(self, message: str) -> None:
+        self.held_alerts.append(message)
+
+    def send_held_alerts(self):
+        while self.held_alerts:
+            self._relay_alert(self.held_alerts.popleft())
+
+    def _relay_help(self) -> None:
+        _send(self.wfile, help=True)
+
+    def _relay_resolve_task(self, options: list[Task]) -> Task:
+        return options[self._ask(choose=[t.path_str for t in options])]
+
+    def _relay_confirm_delete(self, t: Task) -> bool:
+        return bool(self._ask(confirm=t.path_str, subtasks=len(t.subtasks)))
+
+    @timed("list")
+    def list(self, root_task: Optional[Task] = None):
+        if root_task is None:
+            root_task = self.manager.root_task
+
+        if not root_task.subtasks:
+            _send(self.wfile, list="No Tasks\n")
+            return
+
+        lines = format_task_lines(self.manager, root_task, term_width=self.term_width)
+        _send(self.wfile, list="".join(lines))
+
+    @timed("list")
+    def list_results(self, results: Iterable[Task]):
+        # one message per task, so the client can show them as they're found
+        for t in results:
+            _send(
+                self.wfile,
+                result=format_result_line(self.manager, t, self.term_width),
+            )
+
+    def query(self, followup: bool = False) -> str:
+        return self._ask(query=followup) or ""
+
+    def __exit__(self, *args, **kwargs):
+        # so what was written meanwhile isn't saved over
+        self.merge_if_changed()
+        super().__exit__(*args, **kwargs)
+
+    def handle(self, request: dict[str, Any]):
+        self.term_width = request.get("width")
+
+        try:
+            if "import" in request:
+                self.import_file(request["import"], request["format"])
+                return None
+
+            if "export" in request:
+                stream = _ExportStream(self.wfile)
+                self.export(stream, request["export"])
+                stream.flush()
+                return None
+
+            if "batch" in request:
+                failures = self.from_batch(request["batch"])
+                return f"{failures} lines failed" if failures else None
+
+            self.from_prompt(request.get("command", ""))
+
+        except TaskException as e:
+            return str(e)
+
+        except SystemExit:
+            # '@quit' ends the client's session, not the daemon
+            pass
+
+        return None
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    def __init__(self, parser: DaemonParser, path: Path) -> None:
+        self.parser = parser
+        self.running = True
+        self.last_checkpoint = time.monotonic()
+
+        # wake up regularly even when idle, to notice shutdown requests
+        self.timeout = 1
+
+        super().__init__(path.as_posix(), DaemonRequestHandler)
+
+    def checkpoint(self, force: bool = False):
+        interval = self.parser.config.checkpoint_interval
+        elapsed = time.monotonic() - self.last_checkpoint
+
+        if not (force or elapsed >= interval):
+            return
+
+        # the interactive prompt, or a pull from the remote, may have
+        # written the task file since, and shouldn't be saved over
+        self.parser.merge_if_changed()
+
+        if self.parser.manager.dirty:
+            self.parser.save()
+            self.parser.push_changes()
+
+        self.last_checkpoint = time.monotonic()
+
+    def serve(self):
+        while self.running:
+            self.handle_request()
+            self.checkpoint()
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    server: DaemonServer
+
+    def handle(self):
+        try:
+            request = _receive(self.rfile)
+        except (ConnectionError, json.JSONDecodeError):
+            return
+
+        if request.get("stop"):
+            self.server.running = False
+            _send(self.wfile, done=True, error=None)
+            return
+
+        parser = self.server.parser
+        parser.rfile, parser.wfile = self.rfile, self.wfile
+        profiled = False
+
+        try:
+            # kept out of exports, which may be going straight into a file
+            if "export" not in request:
+                parser.send_held_alerts()
+
+            # timed here and sent back, since the client can't see in,
+            # unless the whole daemon is being profiled already
+            profiled = request.get("profile") and not profiling.is_enabled()
+
+            if profiled:
+                profiling.reset()
+                profiling.enable()
+
+            parser.merge_if_changed()
+            error = parser.handle(request)
+
+            if request.get("profile"):
+                _send(self.wfile, profile=profiling.totals())
+
+            _send(self.wfile, done=True, error=error)
+
+        except (ConnectionError, BrokenPipeError):
+            pass
+
+        finally:
+            parser.rfile = parser.wfile = None
+
+            if profiled:
+                profiling.disable()
+                profiling.reset()
+
+
+def is_running(path: Path) -> bool:
+    if not path.exists():
+        return False
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path.as_posix())
+        return True
+
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+
+
+def serve(config_file: str | Path = CONFIG_PATH):
+    config = DellaConfig.load(config_file)
+    path = socket_path(config)
+
+    if is_running(path):
+        raise TaskException(f"A della daemon is already listening on {path}")
+
+    # left over from a daemon that didn't shut down cleanly
+    path.unlink(missing_ok=True)
+
+    with DaemonParser(config) as parser:
+        server = DaemonServer(parser, path)
+
+        if config.reminders:
+            # there's rarely a client to show them to when they come up
+            parser.start_reminders(parser.hold_alert)
+
+        def stop_handler(signal_received, frame):
+            server.running = False
+
+        signal(SIGTERM, stop_handler)
+        signal(SIGINT, stop_handler)
+
+        try:
+            server.serve()
+        finally:
+            server.server_close()
+            path.unlink(missing_ok=True)
+
+
+def _connect(config_file: str | Path) -> tuple[socket.socket, DellaConfig] | None:
+    config_file = Path(config_file).expanduser().resolve()
+
+    if not config_file.exists():
+        return None
+
+    config = DellaConfig.load(config_file)
+    path = socket_path(config)
+
+    if not path.exists():
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(path.as_posix())
+    except (ConnectionRefusedError, FileNotFoundError):
+        sock.close()
+        return None
+
+    return sock, config
+
+
+def is_listening(config_file: str | Path = CONFIG_PATH) -> bool:
+    connection = _connect(config_file)
+
+    if connection is None:
+        return False
+
+    sock, _ = connection
+    sock.close()
+    return True
+
+
+def stop(config_file: str | Path = CONFIG_PATH) -> bool:
+    connection = _connect(config_file)
+
+    if connection is None:
+        return False
+
+    sock, _ = connection
+
+    with sock, sock.makefile("rb") as rfile, sock.makefile("wb") as wfile:
+        _send(wfile, stop=True)
+        _receive(rfile)
+
+    return True
+
+
+def send_command(
+    command: str, config_file: str | Path = CONFIG_PATH, **request: Any
+) -> int | None:
+    """
+    Run a command through the daemon, if one is listening.
+    Returns None when no daemon is available, or it went away before
+    answering, so the caller can fall back to running the command in-process.
+    Otherwise returns an exit status.
+    """
+
+    connection = _connect(config_file)
+
+    if connection is None:
+        return None
+
+    sock, config = connection
+    # kept out of exports, like the exported tasks' own alerts
+    interface = make_cli_interface(
+        config.style, sys.stderr if "export" in request else None
+    )
+    chooser = ChoicePrinter(style=config.style)
+    width, _ = os.get_terminal_size() if os.isatty(1) else (80, 0)
+
+    answered = False
+
+    try:
+        with sock, sock.makefile("rb") as rfile, sock.makefile("wb") as wfile:
+            _send(wfile, command=command, width=width - 5, **request)
+
+            while True:
+                message = _receive(rfile)
+                answered = True
+
+                if "done" in message:
+                    if message["error"] is not None:
+                        interface.alert(message["error"])
+                        return 1
+                    return 0
+
+                if "alert" in message:
+                    interface.alert(message["alert"])
+
+                elif "list" in message:
+                    print_formatted_text(HTML(message["list"]), style=config.style)
+
+                elif "result" in message:
+                    print_formatted_text(
+                        HTML(message["result"]), style=config.style, end=""
+                    )
+
+                elif "export" in message:
+                    sys.stdout.write(message["export"])
+
+                elif "profile" in message:
+                    profiling.add_totals(message["profile"])
+
+                elif "help" in message:
+                    interface.show_help()
+
+                elif "choose" in message:
+                    _send(wfile, reply=choose_path(chooser, message["choose"]))
+
+                elif "confirm" in message:
+                    delete_message = f"Really delete '{message['confirm']}?'"
+
+                    if message.get("subtasks"):
+                        delete_message += f"\nIt has {message['subtasks']} subtasks"
+
+                    _, chosen = chooser.yes_no(title=delete_message)
+                    _send(wfile, reply=chosen)
+
+                elif "query" in message:
+                    _send(wfile, reply=input(">> "))
+
+    except ConnectionError:
+        # listening, but it died before taking the command
+        if not answered:
+            return None
+
+        interface.alert("The della daemon stopped before finishing")
+        return 1
@@ -14,6 +14,60 @@ start_message = "Type <ansiblue>@help</ansiblue> to see the command list"
 [local]
 task_file_local = "~/.local/della/tasks.toml"
 
+# how tasks are stored: "file" keeps everything in task_file_local,
+# "sharded" gives each top level task its own file in a directory
+# next to it, so saving only rewrites the projects that changed.
+# Switching between the two converts the tasks on the next save
+storage = "file"
+
+# while the interactive prompt is open, pick up changes made to the
+# task file by other processes (one-shot commands, syncs, editors).
+# Changes made at the prompt are then saved as soon as they're made
+watch_task_file = true
+
+# keep the index behind @grep in a file next to the task file,
+# so it's read back rather than rebuilt the first time it's used.
+# Worth turning on for very large task files
+persist_search_index = false
+
+# how many changes @undo can step back through in a session
+undo_limit = 100
+
+# show each task's number in listings. A task can always be
+# pointed to by its number, e.g. #42, even when this is off
+show_ids = false
+
+# how many workspaces to keep loaded at once, so switching back to
+# one is instant. Unsaved changes are written out before one is dropped
+workspace_cache = 3
+
+# other task files to switch to with @workspace, by name.
+# The one set by task_file_local is called "default"
+[workspaces]
+# work = "~/.local/della/work.toml"
+# personal = "~/.local/della/personal.toml"
+
+# options for the background daemon, started with `della --daemon`
+# while it runs, one-shot commands are sent to it instead of
+# loading the task file each time
+[daemon]
+# how often (in seconds) unsaved changes are written to disk, and sent
+# to the remote if it's in use. Changes other processes made to the task
+# file are read in first, and win over any that weren't written yet
+checkpoint_interval = 30
+
+# alerts about tasks as their due dates come up, shown while the
+# interactive prompt is open. The daemon holds on to them and passes
+# them on with the output of the next command it's sent
+[reminders]
+enabled = false
+
+# how many days before the due date to alert, 0 being the day itself
+lead_days = [1, 0]
+
+# what time of day the alerts go out
+time = "09:00"
+
 # remote settings
 # these allow you to connect to a remote server
 # via ssh
@@ -34,6 +88,29 @@ use_remote = false
 # location (on the local machine) to get the ssh key
 # private_key_location = "~/.ssh/della"
 
+# how long (in seconds) to wait for each host before giving up on it
+timeout = 10
+
+# how long (in seconds) to wait for a host to accept the connection.
+# A host that doesn't is left alone for retry_interval seconds, and
+# changes that couldn't be pushed to it are sent once it's back
+connect_timeout = 5
+retry_interval = 60
+
+# when pulling, how long (in seconds) to wait for the other hosts once one
+# has answered, before going with the most recent version among those in
+settle_time = 1
+
+# to sync with several hosts at once, list each one as below.
+# Options left out of a host are taken from those above, and tasks
+# are pulled from whichever host has the most recent version
+# [[remote.hosts]]
+# address = "laptop.local"
+#
+# [[remote.hosts]]
+# address = "backup.example.com"
+# user = "backup"
+
 #edit the appearance of the prompt
 # styling options are: fg for forground color, bg for background
 # extra for bold, italic, underline, etc
@@ -1,9 +1,14 @@
 """Console script for della."""
 
 import argparse
+import cProfile
 import sys
+from pathlib import Path
 
+from . import daemon, profiling
 from .cli import CLI_Parser, start_cli_prompt
+from .exporters import EXPORTERS
+from .importers import IMPORTERS
 
 
 def make_parser():
@@ -17,13 +22,185 @@ def make_parser():
         default=None,
     )
 
+    parser.add_argument(
+        "--batch",
+        nargs="?",
+        type=argparse.FileType("r"),
+        const=sys.stdin,
+        default=None,
+        metavar="FILE",
+        help=(
+            "Run one command per line from FILE (or stdin), saving and syncing once."
+            " Nothing is asked: deletes go ahead, ambiguous tasks fail their"
+            " line, and @mv reads the new parent from the next line"
+        ),
+    )
+
+    parser.add_argument(
+        "--import",
+        dest="import_file",
+        type=Path,
+        default=None,
+        metavar="FILE",
+        help="Add all tasks from FILE in a single step",
+    )
+
+    parser.add_argument(
+        "--import-format",
+        choices=list(IMPORTERS),
+        default=None,
+        help="Format of the --import file (default: guessed from its extension)",
+    )
+
+    parser.add_argument(
+        "--export",
+        dest="export_format",
+        choices=list(EXPORTERS),
+        default=None,
+        help="Write every task to stdout, one record per task",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Print a breakdown of where time was spent when della exits,"
+            " including in a running daemon"
+        ),
+    )
+
+    parser.add_argument(
+        "--profile-dump",
+        type=Path,
+        default=None,
+        metavar="FILE",
+        help="With --profile, also write cProfile stats to FILE (not with a daemon)",
+    )
+
+    parser.add_argument(
+        "--profile-json",
+        type=argparse.FileType("a"),
+        default=None,
+        metavar="FILE",
+        help="With --profile, also append each timing as a JSON line to FILE",
+    )
+
+    daemon_group = parser.add_mutually_exclusive_group()
+
+    daemon_group.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep tasks loaded in the background and serve commands over a socket",
+    )
+
+    daemon_group.add_argument(
+        "--stop-daemon",
+        action="store_true",
+        help="Shut down a running daemon, saving its tasks",
+    )
+
     return parser
 
 
 def run():
     args = make_parser().parse_args()
 
-    if args.command is not None:
+    if not args.profile:
+        return run_args(args)
+
+    profiling.enable(json_out=args.profile_json)
+    profiler = cProfile.Profile() if args.profile_dump is not None else None
+
+    try:
+        if profiler is not None:
+            return profiler.runcall(run_args, args)
+
+        return run_args(args)
+
+    finally:
+        print("\n".join(profiling.report()), file=sys.stderr)
+
+        if profiler is not None:
+            profiler.dump_stats(args.profile_dump)
+
+        if args.profile_json is not None:
+            args.profile_json.close()
+
+
+def run_args(args: argparse.Namespace):
+    # a daemon sends back the timings of what it ran, but cProfile stats
+    # and JSON timings can only be taken in this process
+    use_daemon = not args.profile or (
+        args.profile_dump is None and args.profile_json is None
+    )
+    profile = {"profile": True} if args.profile else {}
+
+    if not (use_daemon or args.daemon or args.stop_daemon) and daemon.is_listening():
+        print(
+            "A della daemon is running, and would save over the changes made here."
+            " Stop it with --stop-daemon to use --profile-dump or --profile-json",
+            file=sys.stderr,
+        )
+        return 1
+
+    if args.daemon:
+        daemon.serve()
+
+    elif args.stop_daemon:
+        if not daemon.stop():
+            print("No della daemon is running", file=sys.stderr)
+            return 1
+
+    elif args.import_file is not None:
+        import_format = args.import_format
+        if import_format is None:
+            is_json = args.import_file.suffix == ".json"
+            import_format = "taskwarrior" if is_json else "outline"
+
+        import_path = args.import_file.expanduser().resolve().as_posix()
+        status = None
+        if use_daemon:
+            status = daemon.send_command(
+                "", format=import_format, **{"import": import_path}, **profile
+            )
+
+        if status is not None:
+            return status
+
+        with CLI_Parser() as cli_parser:
+            cli_parser.import_file(import_path, import_format)
+
+    elif args.export_format is not None:
+        status = None
+        if use_daemon:
+            status = daemon.send_command("", export=args.export_format, **profile)
+
+        if status is not None:
+            return status
+
+        with CLI_Parser(messages=sys.stderr) as cli_parser:
+            cli_parser.export(sys.stdout, args.export_format)
+
+    elif args.batch is not None:
+        lines = args.batch.read().splitlines()
+
+        if args.batch is not sys.stdin:
+            args.batch.close()
+
+        status = daemon.send_command("", batch=lines, **profile) if use_daemon else None
+
+        if status is not None:
+            return status
+
+        with CLI_Parser() as cli_parser:
+            return 1 if cli_parser.from_batch(lines) else 0
+
+    elif args.command is not None:
+        status = daemon.send_command(args.command, **profile) if use_daemon else None
+
+        if status is not None:
+            return status
+
         with CLI_Parser() as cli_parser:
             cli_parser.from_prompt(args.command)
 
@@ -0,0 +1,102 @@
+"""
+Exporters writing one record per task, for reading tasks into other tools.
+
+Tasks are walked one at a time and each record is written as soon as it's
+made, so however many tasks there are, nothing more than the current branch
+is held in memory on top of the tree itself.
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+from datetime import date as DateType
+from typing import Iterator, NamedTuple, Optional, TextIO
+
+from .profiling import timed
+from .task import Task, TaskManager
+
+
+class ExportRecord(NamedTuple):
+    path: str
+    content: str
+    due_date: Optional[DateType]
+    depth: int
+    subtasks: int
+    id: Optional[int]
+
+
+def walk_records(root: Task) -> Iterator[ExportRecord]:
+    """Records for every task below root, depth first in tree order"""
+    # paths are built up here rather than with path_str,
+    # which caches the full path on every task it's used on
+    root_path = root.path_str if root.parent is not None else ""
+    stack = [(iter(root.subtasks), root_path)]
+
+    while stack:
+        subtasks, parent_path = stack[-1]
+        task = next(subtasks, None)
+
+        if task is None:
+            stack.pop()
+            continue
+
+        path = f"{parent_path}/{task.slug}" if parent_path else task.slug
+        yield ExportRecord(
+            path,
+            task.content,
+            task.due_date,
+            len(stack),
+            len(task.subtasks),
+            task.id,
+        )
+
+        if task.subtasks:
+            stack.append((iter(task.subtasks), path))
+
+
+def _due_str(record: ExportRecord) -> str:
+    return record.due_date.isoformat() if record.due_date is not None else ""
+
+
+def export_jsonl(records: Iterator[ExportRecord], fp: TextIO):
+    for record in records:
+        entry = record._asdict()
+        entry["due_date"] = _due_str(record) or None
+        fp.write(json.dumps(entry) + "\n")
+
+
+def export_csv(records: Iterator[ExportRecord], fp: TextIO):
+    writer = csv.writer(fp)
+    writer.writerow(ExportRecord._fields)
+
+    for record in records:
+        writer.writerow(record._replace(due_date=_due_str(record)))
+
+
+def export_outline(records: Iterator[ExportRecord], fp: TextIO, tab_width: int = 4):
+    """The same indented outline that --import reads"""
+    for record in records:
+        indent = " " * (tab_width * (record.depth - 1))
+        due = f" | {_due_str(record)}" if record.due_date is not None else ""
+        fp.write(f"{indent}{record.content}{due}\n")
+
+
+EXPORTERS = {
+    "jsonl": export_jsonl,
+    "csv": export_csv,
+    "outline": export_outline,
+}
+
+
+@timed("export")
+def export_tasks(
+    manager: TaskManager,
+    fp: TextIO,
+    export_format: str = "jsonl",
+    root: Optional[Task] = None,
+):
+    if root is None:
+        root = manager.root_task
+
+    EXPORTERS[export_format](walk_records(root), fp)
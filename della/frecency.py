@@ -0,0 +1,102 @@
+"""
+How often, and how recently, each task has been used.
+
+Every use of a task (listing it, setting it as the project, moving it or
+adding to it) adds one to its score, and scores halve every HALF_LIFE
+seconds, so a task used a lot last month ranks below one used a few times
+today. Only a score and a timestamp are kept per task, by id, in a small
+JSON file next to the task file. That's then used to put the likeliest
+tasks first among completions and ambiguous matches.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from .task import Task
+
+HALF_LIFE = 14 * 24 * 3600
+
+# the least used are dropped past this many, when saving
+MAX_ENTRIES = 1000
+
+
+def frecency_path(task_file: Path) -> Path:
+    return task_file.with_name(f"{task_file.stem}_frecency.json")
+
+
+class Frecency:
+    def __init__(
+        self,
+        save_file: Optional[Path] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.save_file = save_file
+        self.clock = clock
+
+        # task id -> score, and when it was last brought up to date
+        self.scores: dict[int, tuple[float, float]] = {}
+
+        # bumped on every use, so rankings built earlier know they're stale
+        self.version = 0
+        self.changed = False
+
+    @classmethod
+    def load(cls, save_file: Path, **kwargs) -> Frecency:
+        frecency = cls(save_file, **kwargs)
+
+        try:
+            with open(save_file, "r") as infile:
+                saved = json.load(infile)
+        except (OSError, ValueError):
+            return frecency
+
+        frecency.scores = {int(k): (v[0], v[1]) for k, v in saved.items()}
+        return frecency
+
+    def save(self):
+        if self.save_file is None or not self.changed:
+            return
+
+        now = self.clock()
+        kept = sorted(self.scores, key=lambda i: self._score(i, now), reverse=True)
+        saved = {
+            i: [round(self.scores[i][0], 3), int(self.scores[i][1])]
+            for i in kept[:MAX_ENTRIES]
+        }
+
+        with open(self.save_file, "w") as outfile:
+            json.dump(saved, outfile, separators=(",", ":"))
+
+        self.changed = False
+
+    def _score(self, task_id: Optional[int], now: float) -> float:
+        if task_id not in self.scores:
+            return 0.0
+
+        score, updated = self.scores[task_id]
+        return score * 0.5 ** ((now - updated) / HALF_LIFE)
+
+    def score(self, task: Task) -> float:
+        return self._score(task.id, self.clock())
+
+    def visit(self, *tasks: Task):
+        now = self.clock()
+
+        for task in tasks:
+            # the root is always one keystroke away, so it isn't counted
+            if task.id is None or task.parent is None:
+                continue
+
+            self.scores[task.id] = (self._score(task.id, now) + 1, now)
+
+        self.version += 1
+        self.changed = True
+
+    def rank(self, tasks: Iterable[Task]) -> list[Task]:
+        """Most used first, keeping the given order among equals"""
+        now = self.clock()
+        return sorted(tasks, key=lambda t: self._score(t.id, now), reverse=True)
@@ -0,0 +1,143 @@
+"""Bulk importers for tasks kept in other formats"""
+
+from __future__ import annotations
+
+import json
+from datetime import date as DateType
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional, TextIO
+
+from .task import Task, TaskException, TaskManager, cached_slugify
+
+Record = tuple[str, str, Optional[DateType]]
+
+
+def _join_path(parent_path: str, content: str) -> str:
+    slug = cached_slugify(content)
+    return f"{parent_path}/{slug}" if parent_path else slug
+
+
+def outline_records(lines: Iterable[str], tab_width: int = 4) -> Iterator[Record]:
+    """
+    Read an indented plain-text outline, one task per line.
+    Deeper indentation makes a line a subtask of the line above it.
+    Leading '-' or '*' bullets are ignored, and a trailing ' | YYYY-MM-DD'
+    is read as the due date, matching how tasks are printed.
+    """
+    # (indent, slug path) of each task the current line could be nested under
+    stack: list[tuple[int, str]] = []
+
+    for line_number, line in enumerate(lines, start=1):
+        line = line.rstrip().expandtabs(tab_width)
+        content = line.lstrip()
+
+        if not content:
+            continue
+
+        indent = len(line) - len(content)
+
+        if content[:2] in ("- ", "* "):
+            content = content[2:].strip()
+
+        due_date = None
+        text, sep, date_str = content.rpartition(" | ")
+
+        if sep:
+            try:
+                due_date = DateType.fromisoformat(date_str.strip())
+                content = text.strip()
+            except ValueError:
+                pass
+
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+
+        parent_path = stack[-1][1] if stack else ""
+
+        if not content:
+            raise TaskException(f"Line {line_number}: a task cannot be empty")
+
+        yield (parent_path, content, due_date)
+        stack.append((indent, _join_path(parent_path, content)))
+
+
+def _taskwarrior_date(timestamp: str) -> DateType:
+    parsed = datetime.strptime(timestamp, "%Y%m%dT%H%M%SZ")
+    return parsed.replace(tzinfo=timezone.utc).astimezone().date()
+
+
+def taskwarrior_records(
+    exported: Iterable[dict],
+    existing_paths: Iterable[str] = (),
+) -> Iterator[Record]:
+    """
+    Convert tasks from `task export` into records.
+    Dotted projects (e.g. "home.garden") become nested parent tasks,
+    reusing any that are in existing_paths instead of adding them again.
+    Completed and deleted tasks are skipped.
+    """
+    known_paths = set(existing_paths)
+
+    for item in exported:
+        if item.get("status") in ("completed", "deleted"):
+            continue
+
+        parent_path = ""
+
+        for project in filter(None, item.get("project", "").split(".")):
+            project_path = _join_path(parent_path, project)
+
+            if project_path not in known_paths:
+                known_paths.add(project_path)
+                yield (parent_path, project, None)
+
+            parent_path = project_path
+
+        due = item.get("due")
+        yield (
+            parent_path,
+            item["description"],
+            _taskwarrior_date(due) if due else None,
+        )
+
+
+def import_outline(
+    manager: TaskManager, fp: TextIO, parent: Optional[Task] = None
+) -> list[Task]:
+    return manager.add_tasks(outline_records(fp), parent)
+
+
+def import_taskwarrior(
+    manager: TaskManager, fp: TextIO, parent: Optional[Task] = None
+) -> list[Task]:
+    text = fp.read()
+
+    try:
+        exported = json.loads(text)
+
+    except json.JSONDecodeError:
+        # older versions of taskwarrior export one object per line
+        exported = [json.loads(line.rstrip(",")) for line in text.splitlines() if line]
+
+    if parent is None:
+        parent = manager.root_task
+
+    # projects may already be there, in shards that haven't been read yet
+    if parent is manager.root_task:
+        manager.load_all()
+    else:
+        manager.load_path(parent.path_str)
+
+    # paths in tasks_index are absolute, but records are relative to parent
+    prefix = f"{parent.path_str}/" if parent.path_str else ""
+    existing = (
+        p.removeprefix(prefix) for p in manager.tasks_index if p.startswith(prefix)
+    )
+
+    return manager.add_tasks(taskwarrior_records(exported, existing), parent)
+
+
+IMPORTERS = {
+    "outline": import_outline,
+    "taskwarrior": import_taskwarrior,
+}
@@ -1,21 +1,42 @@
+import json
 import os
 import shutil
 import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 from dataclasses import dataclass, field
+from datetime import datetime
+from datetime import time as TimeType
 from itertools import count
 from pathlib import Path
-from typing import Any, Callable, NamedTuple, Optional
+from typing import Any, Callable, Iterable, NamedTuple, Optional, TypeVar
 
 import paramiko
 import toml
 from prompt_toolkit.styles import Style
 
-from .constants import CONFIG_PATH, DEFAULT_CONFIG, TMP_SYNCFILE
+from .constants import CONFIG_PATH, DEFAULT_CONFIG, DEFAULT_WORKSPACE, TMP_SYNCFILE
+from .profiling import span, timed
+from .storage import is_sharded, read_task_file, shard_dir, shard_timestamps
+
+T = TypeVar("T")
+
+# push outcomes after which the remote has the local tasks. Anything else,
+# including keeping a newer remote version, is tried again next session
+PUSH_SETTLED = ("pushed", "already up to date")
+
+
+def _color(value: str) -> str:
+    # hex colors are used as they are, names are taken as ansi colors
+    if value.startswith("#") or value.startswith("ansi"):
+        return value
+
+    return f"ansi{value}"
 
 
 def style_from_dict(style_dict: dict):
-    styles = [f"{k}:ansi{v}" for k, v in style_dict.items() if k in ("fg", "bg")]
+    styles = [f"{k}:{_color(v)}" for k, v in style_dict.items() if k in ("fg", "bg")]
     styles.append(style_dict.get("extra", ""))
     return " ".join(styles)
 
@@ -25,13 +46,26 @@ def iter_style(styles_list: list[dict]):
     return [(f"task_level_{next(c)}", style_from_dict(d)) for d in styles_list]
 
 
+def _flatten_styles(styles_config: dict, prefix: str = ""):
+    """
+    Style tables can be nested, e.g. [style.highlight.date]
+    is the same as [style.highlight_date]
+    """
+    for name, content in styles_config.items():
+        if any(isinstance(v, dict) for v in content.values()):
+            yield from _flatten_styles(content, f"{prefix}{name}_")
+        else:
+            yield f"{prefix}{name}", content
+
+
 def load_styles(styles_config: dict):
-    styles = iter_style(styles_config.pop("tasks_display"))
+    styles_config = dict(styles_config)
+    styles = iter_style(styles_config.pop("tasks_display", []))
 
     styles.extend(
         [
-            (name.strip("choose_"), style_from_dict(content))
-            for name, content in styles_config.items()
+            (name.removeprefix("choose_"), style_from_dict(content))
+            for name, content in _flatten_styles(styles_config)
         ]
     )
 
@@ -45,6 +79,38 @@ class SyncConfig(NamedTuple):
     private_key_location: Path
     use_remote: Optional[bool]
 
+    @classmethod
+    def from_options(cls, options: dict[str, Any]):
+        remote_file = Path(options["task_file_remote"])
+
+        return cls(
+            address=options["address"],
+            user=options["user"],
+            task_file_remote=(
+                remote_file.expanduser().resolve().relative_to(remote_file.home())
+            ),
+            private_key_location=(
+                Path(options["private_key_location"]).expanduser().resolve()
+            ),
+            use_remote=True,
+        )
+
+    @property
+    def connect_args(self):
+        return {
+            "hostname": self.address,
+            "username": self.user,
+            "key_filename": self.private_key_location.as_posix(),
+        }
+
+    def to_options(self) -> dict[str, Any]:
+        return {
+            "address": self.address,
+            "user": self.user,
+            "task_file_remote": self.task_file_remote.as_posix(),
+            "private_key_location": self.private_key_location.as_posix(),
+        }
+
 
 @dataclass
 class DellaConfig:
@@ -54,17 +120,47 @@ class DellaConfig:
     style: Style = field(init=False)
     config_filepath: Path = field(init=False)
     use_remote: bool = field(init=False)
+    checkpoint_interval: int = field(init=False)
+    storage: str = field(init=False)
+    watch_task_file: bool = field(init=False)
+    persist_search_index: bool = field(init=False)
+    undo_limit: int = field(init=False)
+    show_ids: bool = field(init=False)
+    workspaces: dict[str, str] = field(init=False)
+    workspace_cache: int = field(init=False)
+    reminders: bool = field(init=False)
+    reminder_lead_days: list[int] = field(init=False)
+    reminder_time: TimeType = field(init=False)
     start_message: Optional[str] = None
 
     sync_config: Optional[SyncConfig] = None
+    sync_configs: list[SyncConfig] = field(init=False)
+    sync_timeout: float = field(init=False)
+    sync_connect_timeout: float = field(init=False)
+    sync_retry_interval: float = field(init=False)
+    sync_settle_time: float = field(init=False)
 
     def serialize(self):
-        data_dict = {"local": {"tasks_file_local": self.task_file_local.as_posix()}}
+        data_dict = {
+            "local": {
+                "tasks_file_local": self.task_file_local.as_posix(),
+                "storage": self.storage,
+            }
+        }
+
+        remote_options: dict[str, Any] = {
+            "use_remote": self.use_remote,
+            "timeout": self.sync_timeout,
+            "connect_timeout": self.sync_connect_timeout,
+            "retry_interval": self.sync_retry_interval,
+            "settle_time": self.sync_settle_time,
+        }
 
-        remote_options: dict[str, Any] = {"use_remote": self.use_remote}
+        if len(self.sync_configs) > 1:
+            remote_options["hosts"] = [c.to_options() for c in self.sync_configs]
 
-        if self.sync_config is not None:
-            remote_options.update(self.sync_config._asdict())
+        elif self.sync_config is not None:
+            remote_options.update(self.sync_config.to_options())
 
         data_dict.update({"remote": remote_options})
         return data_dict
@@ -74,6 +170,7 @@ class DellaConfig:
         return DellaConfig(DEFAULT_CONFIG, CONFIG_PATH)
 
     @classmethod
+    @timed("config.load")
     def load(cls, filepath: str | Path = CONFIG_PATH):
         config_file = Path(filepath).expanduser().resolve()
 
@@ -107,32 +204,62 @@ class DellaConfig:
         self.config_filepath = Path(self.init_config_filepath).expanduser().resolve()
 
         self.task_file_local = local_options["task_file_local"]
-        self.use_remote = remote_options["use_remote"]
-        self.sync_config = None
+        self.storage = local_options.get("storage", "file")
+        self.watch_task_file = local_options.get("watch_task_file", True)
+        self.persist_search_index = local_options.get("persist_search_index", False)
+        self.undo_limit = local_options.get("undo_limit", 100)
+        self.show_ids = local_options.get("show_ids", False)
+
+        # the default one is always the file that's synced
+        self.workspaces = {DEFAULT_WORKSPACE: self.task_file_local}
+        self.workspaces.update(
+            (name, task_file)
+            for name, task_file in self.init_dict.get("workspaces", {}).items()
+            if name != DEFAULT_WORKSPACE
+        )
+        self.workspace_cache = max(1, local_options.get("workspace_cache", 3))
 
-        if self.use_remote:
-            remote_options["private_key_location"] = (
-                Path(remote_options["private_key_location"]).expanduser().resolve()
-            )
+        daemon_options = self.init_dict.get("daemon", {})
+        self.checkpoint_interval = daemon_options.get("checkpoint_interval", 30)
 
-            remote_file = Path(remote_options["task_file_remote"])
+        reminder_options = self.init_dict.get("reminders", {})
+        self.reminders = reminder_options.get("enabled", False)
+        self.reminder_lead_days = reminder_options.get("lead_days", [1, 0])
+        self.reminder_time = TimeType.fromisoformat(
+            reminder_options.get("time", "09:00")
+        )
 
-            remote_options["task_file_remote"] = (
-                remote_file.expanduser().resolve().relative_to(remote_file.home())
-            )
+        self.use_remote = remote_options["use_remote"]
+        self.sync_timeout = remote_options.get("timeout", 10)
+        self.sync_connect_timeout = min(
+            remote_options.get("connect_timeout", 5), self.sync_timeout
+        )
+        self.sync_retry_interval = remote_options.get("retry_interval", 60)
+        self.sync_settle_time = remote_options.get("settle_time", 1)
+        self.sync_config = None
+        self.sync_configs = []
 
-            self.sync_config = SyncConfig(**remote_options)
+        if self.use_remote:
+            # each of [[remote.hosts]] falls back on the options
+            # set directly under [remote], so shared ones needn't be repeated
+            shared_options = {
+                k: v
+                for k, v in remote_options.items()
+                if k not in ("hosts", "timeout", "connect_timeout", "retry_interval")
+            }
+            hosts = remote_options.get("hosts") or [{}]
+
+            self.sync_configs = [
+                SyncConfig.from_options(shared_options | host) for host in hosts
+            ]
+            self.sync_config = self.sync_configs[0]
 
     @property
     def connect_args(self):
         if self.sync_config is None:
             raise ValueError
 
-        return {
-            "hostname": self.sync_config.address,
-            "username": self.sync_config.user,
-            "key_filename": self.sync_config.private_key_location.as_posix(),
-        }
+        return self.sync_config.connect_args
 
     @property
     def task_file_local(self) -> Path:
@@ -148,46 +275,107 @@ class DellaConfig:
         self._task_file_local = new_path
 
 
+def sync_state_path(task_file: Path) -> Path:
+    return task_file.with_name(f"{task_file.stem}_sync.json")
+
+
 class SyncManager:
+    """Syncs the task file with a single remote host"""
+
     def __init__(
         self,
         config: Optional[DellaConfig] = None,
         resolve_func: Optional[Callable[..., bool]] = None,
+        sync_config: Optional[SyncConfig] = None,
     ):
         if config is None:
             config = DellaConfig.load()
 
         self.config = config
-        sync_config = config.sync_config
+
+        if sync_config is None:
+            sync_config = config.sync_config
 
         assert sync_config is not None
         self.sync_config: SyncConfig = sync_config
 
         self.resolve_func = resolve_func
 
-        self.tmp_syncfile = self.config.task_file_local.parent.joinpath(TMP_SYNCFILE)
+        # one per host, so several can be fetched at once
+        self.tmp_syncfile = self.config.task_file_local.parent.joinpath(
+            f"{sync_config.address}_{TMP_SYNCFILE}"
+        )
+
+        # a host that couldn't be reached isn't tried again until then
+        self.offline_until = 0.0
+
+        # whether there are local changes the host hasn't been sent yet
+        self.push_queued = False
+
+        # the connection in use, so another thread can close it
+        self.client: Optional[paramiko.SSHClient] = None
 
     def ping(self, count: int = 3):
         subprocess.run(
             ["ping", self.sync_config.address, f"-c {count}"]
         ).check_returncode()
 
+    def reachable(self) -> bool:
+        return time.time() >= self.offline_until
+
+    def abort(self):
+        """Close the connection in use, so a sync that was given up on stops"""
+        client = self.client
+
+        if client is not None:
+            client.close()
+
     @contextmanager
     def get_connection(self):
+        if not self.reachable():
+            retry_at = datetime.fromtimestamp(self.offline_until)
+            raise ConnectionError(f"offline, retrying after {retry_at:%H:%M:%S}")
+
+        timeout = self.config.sync_timeout
+        connect_timeout = self.config.sync_connect_timeout
+        connect_client = paramiko.SSHClient()
+        self.client = connect_client
+
         try:
-            connect_client = paramiko.SSHClient()
             connect_client.set_missing_host_key_policy(paramiko.AutoAddPolicy)
-            connect_client.connect(**self.config.connect_args)
-            yield connect_client.open_sftp()
+
+            with span("sync.connect"):
+                try:
+                    connect_client.connect(
+                        **self.sync_config.connect_args,
+                        timeout=connect_timeout,
+                        banner_timeout=connect_timeout,
+                        auth_timeout=timeout,
+                    )
+                except paramiko.AuthenticationException:
+                    raise
+                except (OSError, paramiko.SSHException):
+                    # unreachable, so later syncs shouldn't wait on it again
+                    self.offline_until = time.time() + self.config.sync_retry_interval
+                    raise
+
+                self.offline_until = 0.0
+                sftp_client = connect_client.open_sftp()
+                sftp_client.get_channel().settimeout(timeout)
+
+            yield sftp_client
 
         finally:
+            self.client = None
             connect_client.close()
 
+    @timed("sync.compare")
     def get_most_recent(self):
         return self.compare_file_versions(
             local=self.config.task_file_local, remote=self.tmp_syncfile
         )
 
+    @timed("sync.fetch")
     def fetch_remote(self, connection: paramiko.SFTPClient):
         self.config.task_file_local.parent.mkdir(exist_ok=True, parents=True)
         connection.get(
@@ -195,43 +383,185 @@ class SyncManager:
             localpath=self.tmp_syncfile.as_posix(),
         )
 
+    @staticmethod
+    def put_atomic(connection: paramiko.SFTPClient, local: Path, remote: Path):
+        """
+        Send a file next to where it goes, then move it into place, so the
+        remote never has half of one if the sync is cut off
+        """
+        partial_path = remote.with_name(f"{remote.name}.part").as_posix()
+        connection.put(localpath=local.as_posix(), remotepath=partial_path)
+        connection.posix_rename(partial_path, remote.as_posix())
+
+    @timed("sync.put")
     def push_remote(self, connection: paramiko.SFTPClient) -> None:
-        connection.put(
-            localpath=self.config.task_file_local.as_posix(),
-            remotepath=self.sync_config.task_file_remote.as_posix(),
+        self.put_atomic(
+            connection, self.config.task_file_local, self.sync_config.task_file_remote
         )
 
-    def pull_and_update(self) -> None:
+    @timed("sync.fetch_shards")
+    def fetch_shards(self, connection: paramiko.SFTPClient) -> dict[Path, Path]:
+        """
+        With sharded storage, fetch the shards that differ between
+        the local files and the fetched remote manifest. Each is saved next
+        to the one it replaces, and only moved into place by apply_pull,
+        once they've all arrived. Returns where each one was saved.
+        """
+        remote_manifest = read_task_file(self.tmp_syncfile)
+
+        if not is_sharded(remote_manifest):
+            return {}
+
+        local_manifest = read_task_file(self.config.task_file_local)
+        local_timestamps = shard_timestamps(local_manifest)
+
+        local_dir = shard_dir(self.config.task_file_local)
+        remote_dir = shard_dir(self.sync_config.task_file_remote)
+        local_dir.mkdir(parents=True, exist_ok=True)
+        fetched: dict[Path, Path] = {}
+
+        try:
+            for filename, timestamp in shard_timestamps(remote_manifest).items():
+                local_shard = local_dir.joinpath(filename)
+
+                if local_timestamps.get(filename) == timestamp and local_shard.exists():
+                    continue
+
+                partial_shard = local_shard.with_name(f"{filename}.part")
+                fetched[partial_shard] = local_shard
+
+                connection.get(
+                    remotepath=remote_dir.joinpath(filename).as_posix(),
+                    localpath=partial_shard.as_posix(),
+                )
+        except BaseException:
+            for partial_shard in fetched:
+                partial_shard.unlink(missing_ok=True)
+            raise
+
+        return fetched
+
+    @timed("sync.put_shards")
+    def push_shards(
+        self, connection: paramiko.SFTPClient, remote_timestamps: dict[str, int]
+    ) -> None:
+        """
+        With sharded storage, send the shards that the remote
+        doesn't have the current version of, and remove old ones
+        """
+        local_manifest = read_task_file(self.config.task_file_local)
+
+        if not is_sharded(local_manifest):
+            return
+
+        local_dir = shard_dir(self.config.task_file_local)
+        remote_dir = shard_dir(self.sync_config.task_file_remote)
+
+        try:
+            connection.stat(remote_dir.as_posix())
+        except IOError:
+            connection.mkdir(remote_dir.as_posix())
+
+        local_timestamps = shard_timestamps(local_manifest)
+
+        for filename, timestamp in local_timestamps.items():
+            if remote_timestamps.get(filename) == timestamp:
+                continue
+
+            self.put_atomic(
+                connection, local_dir.joinpath(filename), remote_dir.joinpath(filename)
+            )
+
+        for filename in remote_timestamps.keys() - local_timestamps.keys():
+            connection.remove(remote_dir.joinpath(filename).as_posix())
+
+    def fetch_version(self) -> Optional[int]:
+        """
+        Fetch the remote task file, without replacing the local one yet.
+        Returns its timestamp, or None if the remote has no task file.
+        """
         with self.get_connection() as connection:
-            self.fetch_remote(connection)
+            try:
+                self.fetch_remote(connection)
+            except FileNotFoundError:
+                return None
+
+        return self.get_file_timestamp(self.tmp_syncfile)
+
+    def should_pull(self) -> bool:
+        """Whether the fetched remote task file should replace the local one"""
+        if self.same_tasks():
+            return False
+
+        if self.get_most_recent() != self.config.task_file_local:
+            return True
 
-        if self.get_most_recent() == self.config.task_file_local:
-            overwrite_newest = False
-            if self.resolve_func is not None:
-                overwrite_newest = self.resolve_func("pull")
+        if self.resolve_func is not None:
+            return self.resolve_func("pull")
 
-            if not overwrite_newest:
-                return
+        return False
+
+    def apply_pull(self):
+        """
+        Replace the local task file with the one fetched by fetch_version.
+        If its shards can't all be fetched, the local files are left alone.
+        """
+        fetched: dict[Path, Path] = {}
+
+        if is_sharded(read_task_file(self.tmp_syncfile)):
+            with self.get_connection() as connection:
+                fetched = self.fetch_shards(connection)
+
+        # the manifest goes last, so it never names shards that aren't there
+        for partial_shard, local_shard in fetched.items():
+            os.replace(partial_shard, local_shard)
 
         shutil.move(self.tmp_syncfile, self.config.task_file_local)
 
-    def push_and_update(self) -> None:
+    @timed("sync.pull")
+    def pull_and_update(self) -> bool:
+        """
+        Replace the local task file with the remote one if it's newer.
+        Returns whether the local file was replaced.
+        """
+        if self.fetch_version() is None or not self.should_pull():
+            return False
+
+        self.apply_pull()
+        return True
+
+    @timed("sync.push")
+    def push_and_update(self) -> str:
+        """
+        Send the local task file to the remote, unless the remote one is newer
+        or already has the same tasks. Returns what was done.
+        """
         with self.get_connection() as connection:
             try:
                 self.fetch_remote(connection)
             except FileNotFoundError:
+                self.push_shards(connection, {})
                 self.push_remote(connection)
-                return
+                return "pushed"
+
+            if self.same_tasks():
+                os.remove(self.tmp_syncfile)
+                return "already up to date"
 
             if self.get_most_recent() == self.tmp_syncfile:
                 overwrite_newest = True
                 if self.resolve_func is not None:
                     overwrite_newest = self.resolve_func("push")
                 if not overwrite_newest:
-                    return
+                    return "kept its newer version"
 
+            remote_manifest = read_task_file(self.tmp_syncfile)
+
+            # shards go first, so the remote manifest never names missing ones
+            self.push_shards(connection, shard_timestamps(remote_manifest))
             self.push_remote(connection)
         os.remove(self.tmp_syncfile)
+        return "pushed"
 
     def get_file_timestamp(self, file: Path):
         with open(file, "r") as infile:
@@ -244,6 +574,28 @@ class SyncManager:
 
         return timestamp
 
+    def get_file_hash(self, file: Path) -> Optional[str]:
+        """The hash of every task in the file, which older files don't have"""
+        with open(file, "r") as infile:
+            contents = toml.load(infile)
+
+        return contents.get("meta", {}).get("hash")
+
+    def same_tasks(self) -> bool:
+        """
+        Whether the fetched remote task file holds the same tasks as the local
+        one, however their timestamps differ
+        """
+        local = self.config.task_file_local
+
+        if not local.exists() or not self.tmp_syncfile.exists():
+            return False
+
+        local_hash = self.get_file_hash(local)
+        return local_hash is not None and local_hash == self.get_file_hash(
+            self.tmp_syncfile
+        )
+
     def compare_file_versions(
         self, local: Optional[Path], remote: Optional[Path]
     ) -> Path:
@@ -261,3 +613,252 @@ class SyncManager:
         remote_timestamp = self.get_file_timestamp(remote)
 
         return local if local_timestamp > remote_timestamp else remote
+
+
+class HostResult(NamedTuple):
+    address: str
+    succeeded: bool
+    outcome: str
+    seconds: float
+
+
+class SyncGroup:
+    """
+    Syncs with every configured remote host at once, each in its own thread.
+    A host gets `sync_timeout` seconds to answer; any still going after
+    that are reported as timed out and their connections closed, rather
+    than holding up the rest. When pulling, the rest only get
+    `sync_settle_time` more seconds once one host has answered.
+
+    A host that can't be reached is skipped for `sync_retry_interval`
+    seconds, and a push that doesn't get through is queued, to be sent the
+    next time the host answers. Both are kept in a small JSON file next to
+    the task file, so they carry over to the next session.
+    """
+
+    def __init__(
+        self,
+        config: DellaConfig,
+        resolve_func: Optional[Callable[..., bool]] = None,
+    ):
+        self.config = config
+        self.hosts = [
+            SyncManager(config, resolve_func, sync_config)
+            for sync_config in config.sync_configs
+        ]
+
+        # from the last pull or push
+        self.results: list[HostResult] = []
+
+        self.state_file = sync_state_path(config.task_file_local)
+        self.load_state()
+
+    def load_state(self):
+        try:
+            with open(self.state_file, "r") as infile:
+                saved = json.load(infile)
+        except (OSError, ValueError):
+            return
+
+        for host in self.hosts:
+            host_state = saved.get(host.sync_config.address, {})
+            host.offline_until = host_state.get("offline_until", 0.0)
+            host.push_queued = host_state.get("push_queued", False)
+
+    def save_state(self):
+        saved = {
+            host.sync_config.address: {
+                "offline_until": host.offline_until,
+                "push_queued": host.push_queued,
+            }
+            for host in self.hosts
+            if host.push_queued or not host.reachable()
+        }
+
+        if not saved and not self.state_file.exists():
+            return
+
+        with open(self.state_file, "w") as outfile:
+            json.dump(saved, outfile)
+
+    @staticmethod
+    def _run_timed(func: Callable[[SyncManager], T], host: SyncManager):
+        start = time.perf_counter()
+        return func(host), time.perf_counter() - start
+
+    def _fan_out(
+        self,
+        func: Callable[[SyncManager], T],
+        describe: Callable[[T], str],
+        hosts: Optional[list[SyncManager]] = None,
+        noted_as: Optional[str] = None,
+        settle_time: Optional[float] = None,
+    ) -> dict[SyncManager, T]:
+        """
+        Run func on every host, or just the given ones, returning the results
+        of those that succeeded. What happened replaces the last report,
+        or with noted_as, is added to it.
+        With settle_time, the rest of the hosts only get that much longer
+        once one has succeeded, rather than all of sync_timeout.
+        """
+        hosts = self.hosts if hosts is None else hosts
+
+        if not hosts:
+            return {}
+
+        executor = ThreadPoolExecutor(
+            max_workers=len(hosts), thread_name_prefix="della-sync"
+        )
+        futures = {executor.submit(self._run_timed, func, h): h for h in hosts}
+
+        start = time.monotonic()
+        timed_out_at = deadline = start + self.config.sync_timeout
+        unfinished = set(futures)
+
+        while unfinished and (remaining := deadline - time.monotonic()) > 0:
+            finished, unfinished = wait(
+                unfinished, timeout=remaining, return_when=FIRST_COMPLETED
+            )
+
+            if settle_time is not None and any(f.exception() is None for f in finished):
+                deadline = min(deadline, time.monotonic() + settle_time)
+                settle_time = None
+
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        # so the ones left behind don't hold their connections open
+        for future in unfinished:
+            futures[future].abort()
+
+        values: dict[SyncManager, T] = {}
+        results: dict[SyncManager, HostResult] = {}
+
+        for future, host in futures.items():
+            address = host.sync_config.address
+
+            if future in unfinished and deadline < timed_out_at:
+                # slower than the rest, but not offline
+                results[host] = HostResult(
+                    address, True, "not waited for", deadline - start
+                )
+                continue
+
+            if future in unfinished:
+                host.offline_until = time.time() + self.config.sync_retry_interval
+                results[host] = HostResult(
+                    address, False, "timed out", self.config.sync_timeout
+                )
+                continue
+
+            try:
+                value, seconds = future.result()
+            except Exception as e:
+                # covers refused connections, auth failures and timeouts alike
+                results[host] = HostResult(address, False, f"failed: {e}", 0.0)
+                continue
+
+            values[host] = value
+            results[host] = HostResult(address, True, describe(value), seconds)
+
+        if noted_as is None:
+            self.results = list(results.values())
+        else:
+            for host, result in results.items():
+                self._note(host, f"{noted_as} {result.outcome}")
+
+        return values
+
+    def _note(self, host: SyncManager, note: str, failed: bool = False):
+        for i, result in enumerate(self.results):
+            if result.address == host.sync_config.address:
+                self.results[i] = result._replace(
+                    succeeded=result.succeeded and not failed,
+                    outcome=f"{result.outcome}, {note}",
+                )
+
+    @timed("sync.pull")
+    def pull_and_update(self) -> bool:
+        """
+        Replace the local task file with the freshest version among the
+        hosts that answered in time, if it's newer than the local one.
+        Returns whether the local file was replaced.
+        """
+
+        def describe(timestamp: Optional[int]):
+            if timestamp is None:
+                return "no task file"
+
+            return f"saved {datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M:%S}"
+
+        versions = self._fan_out(
+            lambda host: host.fetch_version(),
+            describe,
+            settle_time=self.config.sync_settle_time,
+        )
+        pulled = self._pull_freshest(versions)
+
+        # only once pulled, so the queued changes aren't sent over newer ones
+        self._send_queued(versions)
+        self.save_state()
+        return pulled
+
+    def _pull_freshest(self, versions: dict[SyncManager, Optional[int]]) -> bool:
+        available = {h: t for h, t in versions.items() if t is not None}
+
+        if not available:
+            return False
+
+        # ties go to the host listed first
+        freshest = max(available, key=lambda h: available[h])
+
+        if not freshest.should_pull():
+            return False
+
+        try:
+            freshest.apply_pull()
+        except Exception as e:
+            self._note(freshest, f"pull failed: {e}", failed=True)
+            return False
+
+        self._note(freshest, "pulled")
+        return True
+
+    def _send_queued(self, answered: Iterable[SyncManager]):
+        """Push to the hosts that answered, if an earlier push didn't get through"""
+        queued = [host for host in answered if host.push_queued]
+        pushed = self._fan_out(
+            lambda host: host.push_and_update(),
+            lambda outcome: outcome,
+            hosts=queued,
+            noted_as="queued push",
+        )
+
+        for host in queued:
+            host.push_queued = pushed.get(host) not in PUSH_SETTLED
+
+    @timed("sync.push")
+    def push_and_update(self) -> None:
+        pushed = self._fan_out(
+            lambda host: host.push_and_update(),
+            lambda outcome: outcome,
+        )
+
+        for host in self.hosts:
+            host.push_queued = pushed.get(host) not in PUSH_SETTLED
+
+            if host.push_queued:
+                self._note(host, "queued for next time")
+
+        self.save_state()
+
+    def report(self) -> list[str]:
+        if not self.results:
+            return ["No syncs yet this session"]
+
+        return [
+            f"{r.address:<24}{r.seconds * 1000:>10.0f} ms  {r.outcome}"
+            for r in self.results
+        ]
+
+    def failures(self) -> list[str]:
+        return [f"{r.address}: {r.outcome}" for r in self.results if not r.succeeded]
@@ -0,0 +1,118 @@
+"""
+Timing spans for finding out where della spends its time.
+While profiling is disabled, a span is a shared no-op context manager.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from contextlib import nullcontext
+from functools import wraps
+from typing import Callable, Optional, TextIO, TypeVar
+
+T = TypeVar("T")
+
+_enabled = False
+_json_out: Optional[TextIO] = None
+
+# span name -> [number of calls, total seconds]
+_totals: dict[str, list] = {}
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+
+        totals = _totals.setdefault(self.name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+
+        if _json_out is not None:
+            record = {"span": self.name, "seconds": elapsed, "time": time.time()}
+            _json_out.write(json.dumps(record) + "\n")
+
+
+def span(name: str):
+    if not _enabled:
+        return _NULL_SPAN
+
+    return _Span(name)
+
+
+def timed(name: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Decorator version of span()"""
+
+    def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            with _Span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(json_out: Optional[TextIO] = None):
+    global _enabled, _json_out
+    _enabled = True
+    _json_out = json_out
+
+
+def disable():
+    global _enabled, _json_out
+    _enabled = False
+    _json_out = None
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    _totals.clear()
+
+
+def totals() -> dict[str, list]:
+    return {name: list(counts) for name, counts in _totals.items()}
+
+
+def add_totals(other: dict[str, list]):
+    """Count timings taken elsewhere, such as in the daemon, as if taken here"""
+    for name, (calls, total) in other.items():
+        counts = _totals.setdefault(name, [0, 0.0])
+        counts[0] += calls
+        counts[1] += total
+
+
+def report() -> list[str]:
+    """
+    One line per span, slowest first.
+    Spans nest, so the times of inner spans are included in their parents'.
+    """
+    if not _totals:
+        return ["No timings recorded"]
+
+    lines = [f"{'span':<28}{'calls':>8}{'total ms':>12}{'mean ms':>12}"]
+
+    for name, (calls, total) in sorted(_totals.items(), key=lambda i: -i[1][1]):
+        lines.append(
+            f"{name:<28}{calls:>8}{total * 1000:>12.2f}{total * 1000 / calls:>12.3f}"
+        )
+
+    return lines
@@ -0,0 +1,358 @@
+"""
+The query language behind @find.
+
+A query is a list of terms, and a task has to match all of them:
+
+    report              the content contains "report"
+    word:report         the content has "report" as a whole word
+    slug:report         the task's slug is exactly "report"
+    due:friday          due on that day
+    before:DATE         due on or before that day
+    after:DATE          due on or after that day
+    depth:2             exactly two levels below the scope
+    depth:<3, depth:>1  fewer or more levels below the scope
+    in:PATH             only look below the task at PATH
+    has:subtasks        also has:due, and no:subtasks / no:due
+
+Quote a term to include spaces, e.g. before:"next friday".
+
+Rather than walking the whole tree for every query, the planner starts
+from whichever index narrows things down the most (slugs, due dates, or the
+sorted task paths under the scope) and only then checks every term.
+Results are produced lazily, so they can be shown as they are found.
+"""
+
+from __future__ import annotations
+
+import heapq
+import re
+import shlex
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from datetime import date as DateType
+from itertools import islice
+from operator import itemgetter
+from typing import Any, Callable, Iterable, Iterator, Optional
+from weakref import WeakKeyDictionary
+
+from dateparse import DateParser
+
+from .profiling import timed
+from .task import Task, TaskException, TaskManager
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+# sorts after any character that can appear in a slug
+_PATH_END = "\U0010ffff"
+
+# up to this many tasks are added to or taken out of the sorted indexes one
+# at a time, and more than that in one pass over the whole index
+_BULK_CHANGE = 64
+
+
+def _depth(task: Task) -> int:
+    # from the cached path, rather than caching full_path on every candidate
+    return 0 if task.parent is None else task.path_str.count("/") + 1
+
+
+@dataclass
+class Query:
+    text: list[str] = field(default_factory=list)
+    words: list[str] = field(default_factory=list)
+    slug: Optional[str] = None
+    due_from: Optional[DateType] = None
+    due_to: Optional[DateType] = None
+    min_depth: int = 1
+    max_depth: Optional[int] = None
+    scope: Optional[str] = None
+    has_subtasks: Optional[bool] = None
+    has_due: Optional[bool] = None
+
+    def matches(self, task: Task, scope: Task) -> bool:
+        depth = _depth(task) - _depth(scope)
+
+        if depth < self.min_depth:
+            return False
+
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+
+        if scope.parent is not None and not task.path_str.startswith(
+            scope.path_str + "/"
+        ):
+            return False
+
+        if self.slug is not None and task.slug != self.slug:
+            return False
+
+        if self.has_due is not None and (task.due_date is not None) != self.has_due:
+            return False
+
+        if self.due_from is not None or self.due_to is not None:
+            if task.due_date is None:
+                return False
+
+            if self.due_from is not None and task.due_date < self.due_from:
+                return False
+
+            if self.due_to is not None and task.due_date > self.due_to:
+                return False
+
+        if self.has_subtasks is not None and bool(task.subtasks) != self.has_subtasks:
+            return False
+
+        content = task.content.lower()
+
+        if not all(t in content for t in self.text):
+            return False
+
+        if self.words:
+            content_words = set(_WORD_PATTERN.findall(content))
+
+            if not all(w in content_words for w in self.words):
+                return False
+
+        return True
+
+
+def _parse_date(date_text: str, date_parser: DateParser) -> DateType:
+    try:
+        return DateType.fromisoformat(date_text)
+    except ValueError:
+        pass
+
+    # read the same way as due dates are when adding tasks
+    try:
+        parsed = date_parser.get_first_date(date_text)
+    except ValueError:
+        parsed = None
+
+    if parsed is None:
+        raise TaskException(f"'{date_text}' is not a date")
+
+    return parsed
+
+
+def _parse_depth(query: Query, depth_text: str):
+    try:
+        if depth_text.startswith("<"):
+            query.max_depth = int(depth_text[1:]) - 1
+        elif depth_text.startswith(">"):
+            query.min_depth = int(depth_text[1:]) + 1
+        else:
+            query.min_depth = query.max_depth = int(depth_text)
+
+    except ValueError:
+        raise TaskException(f"'{depth_text}' is not a depth")
+
+
+def parse_query(query_text: str | list[str], date_parser: DateParser) -> Query:
+    if isinstance(query_text, str):
+        try:
+            query_text = shlex.split(query_text)
+        except ValueError as e:
+            raise TaskException(f"Could not read query: {e}")
+
+    query = Query()
+
+    for term in query_text:
+        key, _, value = term.partition(":")
+
+        if not value:
+            query.text.append(term.lower())
+            continue
+
+        match key.lower():
+            case "word":
+                query.words.append(value.lower())
+            case "slug":
+                query.slug = value
+            case "due":
+                query.due_from = query.due_to = _parse_date(value, date_parser)
+            case "before":
+                query.due_to = _parse_date(value, date_parser)
+            case "after":
+                query.due_from = _parse_date(value, date_parser)
+            case "depth":
+                _parse_depth(query, value)
+            case "in":
+                query.scope = value
+            case "has" | "no" if value in ("subtasks", "due"):
+                setattr(query, f"has_{value}", key == "has")
+            case _:
+                # not a known key, so just text that contains a colon
+                query.text.append(term.lower())
+
+    return query
+
+
+def _insert_sorted(keys: list, tasks: list[Task], new: list[tuple[Any, Task]]):
+    """Add sorted (key, task) pairs to a sorted list of keys and its tasks"""
+    if len(new) <= _BULK_CHANGE:
+        for key, task in new:
+            i = bisect_left(keys, key)
+            keys.insert(i, key)
+            tasks.insert(i, task)
+        return
+
+    merged = list(heapq.merge(zip(keys, tasks), new, key=itemgetter(0)))
+    keys[:] = [key for key, _ in merged]
+    tasks[:] = [task for _, task in merged]
+
+
+def _remove_sorted(keys: list, tasks: list[Task], gone: list[tuple[Any, Task]]):
+    """Take (key, task) pairs out of a sorted list of keys and its tasks"""
+    if len(gone) <= _BULK_CHANGE:
+        for key, _ in gone:
+            i = bisect_left(keys, key)
+            del keys[i]
+            del tasks[i]
+        return
+
+    gone_keys = {key for key, _ in gone}
+    kept = [(key, task) for key, task in zip(keys, tasks) if key not in gone_keys]
+    keys[:] = [key for key, _ in kept]
+    tasks[:] = [task for _, task in kept]
+
+
+class QueryIndexes:
+    """
+    Lookup tables for the planner. They follow the manager's changes as one
+    of its listeners, so adding, moving or deleting tasks only touches the
+    entries for those tasks, rather than sorting everything again.
+    """
+
+    def __init__(self, manager: TaskManager) -> None:
+        self.tasks_reset(manager)
+        manager.listeners.append(self)
+
+    def tasks_reset(self, manager: TaskManager):
+        # where each task was filed, to find it again after it's moved
+        self.entries: dict[Task, tuple[str, Optional[DateType]]] = {}
+
+        self.paths: list[str] = []
+        self.path_tasks: list[Task] = []
+
+        self.due_keys: list[tuple[DateType, str]] = []
+        self.due_tasks: list[Task] = []
+
+        self.tasks_added(manager.tasks_index.values())
+
+    def tasks_added(self, tasks: Iterable[Task]):
+        # a shard being read announces the task it's under again
+        new = [t for t in tasks if t not in self.entries]
+        by_path: list[tuple[str, Task]] = []
+        by_due: list[tuple[tuple[DateType, str], Task]] = []
+
+        for task in new:
+            path = task.path_str
+            self.entries[task] = (path, task.due_date)
+            by_path.append((path, task))
+
+            if task.due_date is not None:
+                by_due.append(((task.due_date, path), task))
+
+        _insert_sorted(self.paths, self.path_tasks, sorted(by_path))
+        _insert_sorted(self.due_keys, self.due_tasks, sorted(by_due))
+
+    def tasks_removed(self, tasks: Iterable[Task]):
+        gone = {t: self.entries.pop(t) for t in tasks if t in self.entries}
+
+        _remove_sorted(
+            self.paths, self.path_tasks, [(path, t) for t, (path, _) in gone.items()]
+        )
+        _remove_sorted(
+            self.due_keys,
+            self.due_tasks,
+            [((due, path), t) for t, (path, due) in gone.items() if due is not None],
+        )
+
+    def due_range(
+        self, due_from: Optional[DateType], due_to: Optional[DateType]
+    ) -> tuple[int, int]:
+        start = 0 if due_from is None else bisect_left(self.due_keys, (due_from,))
+        end = (
+            len(self.due_keys)
+            if due_to is None
+            else bisect_right(self.due_keys, (due_to, _PATH_END))
+        )
+        return start, max(start, end)
+
+    def path_range(self, scope: Task) -> tuple[int, int]:
+        prefix = scope.path_str + "/"
+        start = bisect_left(self.paths, prefix)
+        return start, bisect_right(self.paths, prefix + _PATH_END, lo=start)
+
+
+_indexes: WeakKeyDictionary[TaskManager, QueryIndexes] = WeakKeyDictionary()
+
+
+def get_indexes(manager: TaskManager) -> QueryIndexes:
+    indexes = _indexes.get(manager)
+
+    if indexes is None:
+        indexes = _indexes[manager] = QueryIndexes(manager)
+
+    return indexes
+
+
+# a plan is the name of where candidates come from, how many there
+# are at most, and a function producing them
+Plan = tuple[str, int, Callable[[], Iterable[Task]]]
+
+
+def _walk(scope: Task) -> Iterator[Task]:
+    for subtask in scope.subtasks:
+        yield from subtask
+
+
+def plan_query(manager: TaskManager, query: Query, scope: Task) -> Plan:
+    """Pick the cheapest way to get candidates for a query"""
+    indexes = get_indexes(manager)
+    plans: list[Plan] = [("scan", len(indexes.paths), lambda: _walk(scope))]
+
+    if query.slug is not None:
+        slug_matches = manager.tasks_with_slug(query.slug)
+        plans.append(("slug", len(slug_matches), lambda: slug_matches))
+
+    if query.due_from is not None or query.due_to is not None:
+        due_start, due_end = indexes.due_range(query.due_from, query.due_to)
+        plans.append(
+            (
+                "due",
+                due_end - due_start,
+                lambda: islice(indexes.due_tasks, due_start, due_end),
+            )
+        )
+
+    if scope.parent is not None:
+        path_start, path_end = indexes.path_range(scope)
+        plans.append(
+            (
+                "path",
+                path_end - path_start,
+                lambda: islice(indexes.path_tasks, path_start, path_end),
+            )
+        )
+
+    return min(plans, key=lambda p: p[1])
+
+
+@timed("find.plan")
+def find_tasks(
+    manager: TaskManager, query: Query, scope: Optional[Task] = None
+) -> Iterator[Task]:
+    # only reading shards and planning are timed here, since the
+    # matching happens as the results are taken
+    if scope is None:
+        scope = manager.root_task
+
+    # shards that haven't been read yet can't be searched
+    if scope.parent is None:
+        manager.load_all()
+    else:
+        scope.subtasks
+
+    _, _, candidates = plan_query(manager, query, scope)
+
+    return (t for t in candidates() if query.matches(t, scope))
@@ -0,0 +1,215 @@
+"""
+Alerts about tasks as their due dates come up.
+
+Each reminder is a task, how many days ahead of its due date to alert,
+and when that is. They wait in a heap ordered by time, and a background
+thread sleeps until the earliest one, or until something earlier is added,
+so an idle prompt or daemon never scans the task tree. The heap is kept up
+to date as tasks are added, moved and deleted, through TaskManager.listeners.
+"""
+
+from __future__ import annotations
+
+import heapq
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from datetime import time as TimeType
+from datetime import timedelta
+from itertools import count
+from typing import Callable, Iterable, Optional
+
+from .task import Task, TaskManager
+
+# the thread's sleep doesn't count time spent suspended, so it checks the
+# clock at least this often to not be too late after waking up from one
+_MAX_SLEEP = 3600
+
+
+@dataclass(order=True)
+class Reminder:
+    when: datetime
+    order: int
+    task: Task = field(compare=False)
+    lead_days: int = field(compare=False)
+    cancelled: bool = field(default=False, compare=False)
+
+    def message(self) -> str:
+        match self.lead_days:
+            case 0:
+                due = "today"
+            case 1:
+                due = "tomorrow"
+            case days:
+                due = f"in {days} days"
+
+        return f"Reminder: {self.task.path_str} is due {due}"
+
+
+class ReminderScheduler:
+    def __init__(
+        self,
+        alert: Callable[[str], None],
+        lead_days: Iterable[int] = (1, 0),
+        time_of_day: TimeType = TimeType(9),
+        clock: Callable[[], datetime] = datetime.now,
+    ) -> None:
+        self.alert = alert
+        self.lead_days = sorted(set(lead_days), reverse=True)
+        self.time_of_day = time_of_day
+        self.clock = clock
+
+        self.heap: list[Reminder] = []
+
+        # the reminders waiting for each task, so they can be cancelled.
+        # Cancelled ones are left in the heap and skipped when they come up
+        self.pending: dict[Task, list[Reminder]] = {}
+        self.cancelled_count = 0
+
+        self._order = count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, manager: TaskManager):
+        """Schedule reminders for a manager's tasks, and follow its changes"""
+        # every due date is needed, including those in unread shards
+        manager.load_all()
+
+        # watched again when switching back to its workspace
+        if self not in manager.listeners:
+            manager.listeners.append(self)
+
+        self.tasks_reset(manager)
+
+    def _cancel(self, task: Task):
+        for reminder in self.pending.pop(task, []):
+            reminder.cancelled = True
+            self.cancelled_count += 1
+
+        # drop them all at once when they make up most of the heap
+        if self.cancelled_count > len(self.heap) // 2:
+            self.heap = [r for r in self.heap if not r.cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled_count = 0
+
+    def _schedule(self, task: Task, now: datetime) -> bool:
+        """Add reminders for a task, returning whether any comes first"""
+        self._cancel(task)
+
+        if task.due_date is None:
+            return False
+
+        earliest = self.heap[0].when if self.heap else None
+        reminders = []
+
+        for lead_days in self.lead_days:
+            when = datetime.combine(
+                task.due_date - timedelta(days=lead_days), self.time_of_day
+            )
+
+            # missed while nothing was running, so too late to be useful
+            if when <= now:
+                continue
+
+            reminder = Reminder(when, next(self._order), task, lead_days)
+            heapq.heappush(self.heap, reminder)
+            reminders.append(reminder)
+
+        if reminders:
+            self.pending[task] = reminders
+
+        return bool(reminders) and (earliest is None or reminders[0].when < earliest)
+
+    def tasks_added(self, tasks: Iterable[Task]):
+        with self._condition:
+            now = self.clock()
+
+            # a list rather than a generator, so any() doesn't stop early
+            if any([self._schedule(t, now) for t in tasks]):
+                self._condition.notify()
+
+    def tasks_removed(self, tasks: Iterable[Task]):
+        with self._condition:
+            for task in tasks:
+                self._cancel(task)
+
+    def tasks_reset(self, manager: TaskManager):
+        with self._condition:
+            self.heap = []
+            self.pending = {}
+            self.cancelled_count = 0
+            now = self.clock()
+
+            for task in manager:
+                self._schedule(task, now)
+
+            self._condition.notify()
+
+    def next_reminder(self) -> Optional[Reminder]:
+        with self._condition:
+            while self.heap and self.heap[0].cancelled:
+                heapq.heappop(self.heap)
+                self.cancelled_count -= 1
+
+            return self.heap[0] if self.heap else None
+
+    def pop_due(self) -> list[Reminder]:
+        """Take the reminders that are due from the heap"""
+        due = []
+
+        with self._condition:
+            now = self.clock()
+
+            while self.heap and self.heap[0].when <= now:
+                reminder = heapq.heappop(self.heap)
+
+                if reminder.cancelled:
+                    self.cancelled_count -= 1
+                    continue
+
+                self.pending[reminder.task].remove(reminder)
+
+                if not self.pending[reminder.task]:
+                    del self.pending[reminder.task]
+
+                due.append(reminder)
+
+        return due
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+
+                upcoming = self.next_reminder()
+                delay = _MAX_SLEEP
+
+                if upcoming is not None:
+                    delay = min(delay, (upcoming.when - self.clock()).total_seconds())
+
+                if delay > 0:
+                    # woken early by stop(), or a new earliest reminder
+                    self._condition.wait(delay)
+                    continue
+
+            # alerts go out without holding the lock, so they can't
+            # hold up changes to the task tree
+            for reminder in self.pop_due():
+                self.alert(reminder.message())
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="della-reminders", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
@@ -0,0 +1,151 @@
+"""
+An inverted index from the words in task content to the tasks using them,
+behind @grep and word completion.
+
+A grep query is a list of words, all of which must appear in a task.
+Words joined by OR are alternatives, so `report OR summary draft` finds
+tasks containing draft and either of the other two. A word ending in *
+matches any word starting with it.
+"""
+
+from __future__ import annotations
+
+import re
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    from .task import Task
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+# sorts after any character that can appear in a word
+_WORD_END = "\U0010ffff"
+
+
+def tokenize(content: str) -> set[str]:
+    return set(_TOKEN_PATTERN.findall(content.lower()))
+
+
+class SearchIndex:
+    def __init__(self) -> None:
+        self.postings: dict[str, set[Task]] = {}
+
+        # every indexed word in order, for prefix lookups
+        self.vocabulary: list[str] = []
+
+        # whether there's anything new to save
+        self.changed = False
+
+    @classmethod
+    def build(cls, tasks: Iterable[Task]) -> SearchIndex:
+        index = cls()
+
+        for task in tasks:
+            for token in tokenize(task.content):
+                index.postings.setdefault(token, set()).add(task)
+
+        # sorted once, rather than inserting each new word in place
+        index.vocabulary = sorted(index.postings)
+        index.changed = True
+        return index
+
+    @classmethod
+    def from_positions(
+        cls, tokens: dict[str, list[int]], tasks: list[Task]
+    ) -> SearchIndex:
+        """Rebuild a saved index, given the tasks in the order it was saved"""
+        index = cls()
+        index.postings = {t: {tasks[i] for i in p} for t, p in tokens.items()}
+        index.vocabulary = sorted(index.postings)
+        return index
+
+    def to_positions(self, tasks: Iterable[Task]) -> dict[str, list[int]]:
+        positions = {task: i for i, task in enumerate(tasks)}
+
+        return {
+            token: [positions[t] for t in matches if t in positions]
+            for token, matches in self.postings.items()
+        }
+
+    def add(self, task: Task, content: str | None = None):
+        self.changed = True
+
+        for token in tokenize(task.content if content is None else content):
+            matches = self.postings.get(token)
+
+            if matches is None:
+                self.postings[token] = {task}
+                insort(self.vocabulary, token)
+            else:
+                matches.add(task)
+
+    def remove(self, task: Task, content: str | None = None):
+        """
+        Take a task out of the index. If its content has changed since
+        it was added, pass the old content.
+        """
+        self.changed = True
+
+        for token in tokenize(task.content if content is None else content):
+            matches = self.postings.get(token)
+
+            if matches is None:
+                continue
+
+            matches.discard(task)
+
+            if not matches:
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def complete(self, prefix: str, limit: int | None = None) -> list[str]:
+        """Indexed words starting with prefix, in order"""
+        prefix = prefix.lower()
+        start = bisect_left(self.vocabulary, prefix)
+        end = bisect_left(self.vocabulary, prefix + _WORD_END, lo=start)
+
+        return list(islice(self.vocabulary, start, min(end, start + (limit or end))))
+
+    def lookup(self, word: str) -> set[Task]:
+        word = word.lower()
+
+        if not word.endswith("*"):
+            return self.postings.get(word, set())
+
+        matches: set[Task] = set()
+        for token in self.complete(word[:-1]):
+            matches.update(self.postings[token])
+
+        return matches
+
+    def search(self, query: str) -> set[Task]:
+        # each clause is a list of alternatives, and every clause has to match
+        clauses: list[list[str]] = []
+        join_next = False
+
+        for word in query.split():
+            if word == "OR":
+                join_next = bool(clauses)
+            elif join_next:
+                clauses[-1].append(word)
+                join_next = False
+            else:
+                clauses.append([word])
+
+        if not clauses:
+            return set()
+
+        clause_matches = []
+        for alternatives in clauses:
+            matches = set().union(*(self.lookup(w) for w in alternatives))
+
+            if not matches:
+                return set()
+
+            clause_matches.append(matches)
+
+        # start from the rarest clause so the intersection stays small
+        clause_matches.sort(key=len)
+        return set(clause_matches[0]).intersection(*clause_matches[1:])
@@ -0,0 +1,239 @@
+"""
+Reading and writing task files.
+
+Tasks are either kept in a single file, or sharded: each top level task gets
+its own file in a directory next to the task file, and the task file itself
+becomes a small manifest listing the shards. Only shards that changed are
+rewritten on save, and a shard is only read once its subtasks are needed.
+"""
+
+from __future__ import annotations
+
+import json
+import shutil
+import time
+import zlib
+from datetime import date as DateType
+from functools import partial
+from pathlib import Path
+from typing import Any, Final, Iterable
+
+import toml
+
+from .profiling import span, timed
+from .search_index import SearchIndex
+from .task import LazyTask, Task, TaskManager
+
+FILE_FORMAT: Final = "file"
+SHARDED_FORMAT: Final = "sharded"
+
+STORAGE_FORMATS: Final = (FILE_FORMAT, SHARDED_FORMAT)
+
+
+def shard_dir(task_file: Path) -> Path:
+    return task_file.with_name(f"{task_file.stem}_shards")
+
+
+def shard_filename(task: Task) -> str:
+    return f"{task.slug}.toml"
+
+
+def search_index_path(task_file: Path) -> Path:
+    return task_file.with_name(f"{task_file.stem}_index.json")
+
+
+def read_task_file(filepath: str | Path) -> dict[str, Any]:
+    with span("tasks.deserialize.toml"):
+        with open(Path(filepath).expanduser(), "r") as load_file:
+            return toml.load(load_file)
+
+
+def is_sharded(data_dict: dict[str, Any]) -> bool:
+    return data_dict.get("meta", {}).get("format") == SHARDED_FORMAT
+
+
+def shard_timestamps(data_dict: dict[str, Any]) -> dict[str, int]:
+    """Map each shard file named in a manifest to when it was last written"""
+    return {s["file"]: s.get("timestamp", 0) for s in data_dict.get("shards", [])}
+
+
+def _load_shard(shard_file: Path, manager: TaskManager, task: LazyTask):
+    # filling in the index is a change like any other
+    with manager.write_lock, span("tasks.load_shard"):
+        shard = read_task_file(shard_file).get("task", {})
+
+        for subtask_dict in shard.get("subtasks", []):
+            Task.init_from_dict(task, subtask_dict)
+
+        manager._index_subtree(task)
+
+
+def _content_fingerprint(tasks: Iterable[Task]) -> int:
+    # the saved index refers to tasks by position, so it's only
+    # valid for the same contents in the same order
+    return zlib.crc32("\n".join(t.content for t in tasks).encode())
+
+
+def load_search_index(manager: TaskManager) -> SearchIndex | None:
+    """The saved search index, if it matches the loaded tasks"""
+    try:
+        with open(search_index_path(manager.save_file_path), "r") as infile:
+            saved = json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+    tasks = list(manager)
+
+    if saved.get("fingerprint") != _content_fingerprint(tasks):
+        return None
+
+    return SearchIndex.from_positions(saved["tokens"], tasks)
+
+
+def save_search_index(manager: TaskManager):
+    index = manager._search_index
+
+    # never used, or nothing changed since it was loaded
+    if index is None or not index.changed:
+        return
+
+    tasks = list(manager)
+    saved = {
+        "fingerprint": _content_fingerprint(tasks),
+        "tokens": index.to_positions(tasks),
+    }
+
+    with open(search_index_path(manager.save_file_path), "w") as outfile:
+        json.dump(saved, outfile)
+
+    index.changed = False
+
+
+@timed("tasks.deserialize")
+def load_manager(
+    filepath: str | Path, saved_index: bool = False, **kwargs
+) -> TaskManager:
+    """
+    Load a TaskManager from either storage format.
+    With saved_index, the search index is read from disk when first used,
+    rather than being built from scratch.
+    """
+    manager = TaskManager(save_file=filepath, **kwargs)
+    data_dict = read_task_file(manager.save_file_path)
+
+    if saved_index:
+        manager.search_index_loader = partial(load_search_index, manager)
+
+    if not is_sharded(data_dict):
+        return manager.load_dict(data_dict)
+
+    directory = shard_dir(manager.save_file_path)
+    manager.root_task.sorted_children = data_dict["meta"].get("sorted", False)
+    manager.next_id = data_dict["meta"].get("next_id", 1)
+
+    for entry in data_dict.get("shards", []):
+        try:
+            due_date = DateType.fromisoformat(entry.get("due_date", ""))
+        except ValueError:
+            due_date = None
+
+        stored_hash = entry.get("hash")
+
+        shard_task = LazyTask(
+            entry["content"],
+            manager.root_task,
+            due_date,
+            loader=partial(_load_shard, directory.joinpath(entry["file"])),
+            subtree_hash=bytes.fromhex(stored_hash) if stored_hash else None,
+            manager=manager,
+        )
+        shard_task.sorted_children = entry.get("sorted", False)
+        shard_task.id = entry.get("id")
+
+    manager.reindex()
+    return manager
+
+
+@timed("tasks.serialize")
+def save_manager(
+    manager: TaskManager, storage_format: str = FILE_FORMAT, saved_index: bool = False
+):
+    if saved_index:
+        save_search_index(manager)
+
+    task_file = manager.save_file_path
+    directory = shard_dir(task_file)
+
+    if storage_format == FILE_FORMAT:
+        with open(task_file, "w") as outfile:
+            manager.serialize(outfile)
+
+        # left over from sharded storage, and now out of date
+        if directory.exists():
+            shutil.rmtree(directory)
+
+        return
+
+    if storage_format != SHARDED_FORMAT:
+        raise ValueError(f"Unknown storage format '{storage_format}'")
+
+    previous_timestamps: dict[str, int] = {}
+
+    if task_file.exists():
+        previous = read_task_file(task_file)
+
+        if is_sharded(previous):
+            previous_timestamps = shard_timestamps(previous)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    now = int(time.time())
+    shards = []
+
+    for task in manager.root_task.subtasks:
+        filename = shard_filename(task)
+        timestamp = previous_timestamps.get(filename)
+
+        if (
+            timestamp is None
+            or task in manager.dirty_shards
+            or not directory.joinpath(filename).exists()
+        ):
+            with span("tasks.serialize.toml"):
+                with open(directory.joinpath(filename), "w") as shard_file:
+                    toml.dump({"task": task._to_dict(recurse=True)}, shard_file)
+
+            timestamp = now
+
+        shard_dict = task._to_dict(recurse=False)
+        shard_dict.update(
+            {
+                "file": filename,
+                "timestamp": timestamp,
+                "hash": task.subtree_hash().hex(),
+            }
+        )
+        shards.append(shard_dict)
+
+    manifest = {
+        "meta": {
+            "timestamp": now,
+            "format": SHARDED_FORMAT,
+            "hash": manager.root_task.subtree_hash().hex(),
+            "sorted": manager.root_task.sorted_children,
+            "next_id": manager.next_id,
+        },
+        "shards": shards,
+    }
+
+    with open(task_file, "w") as outfile:
+        toml.dump(manifest, outfile)
+
+    # shards of top level tasks that were deleted or moved
+    referenced = {s["file"] for s in shards}
+
+    for stale_file in directory.glob("*.toml"):
+        if stale_file.name not in referenced:
+            stale_file.unlink()
+
+    manager.dirty = False
+    manager.dirty_shards.clear()
@@ -2,18 +2,27 @@
 
 from __future__ import annotations
 
+import threading
 import time
-import types
+from bisect import bisect_left, insort
 from collections import deque
 from datetime import date as DateType
-from functools import cached_property, partial
+from functools import cached_property, lru_cache, partial, wraps
+from hashlib import blake2b
 from itertools import chain
 from pathlib import Path
-from typing import Callable, Optional, TextIO
+from types import MappingProxyType
+from typing import Callable, Iterable, Mapping, NamedTuple, Optional, Protocol, TextIO
 
 import toml
 from slugify import slugify
 
+from .profiling import span, timed
+from .search_index import SearchIndex
+
+# repeated task names are common (e.g. "email bob"), and slugify is slow
+cached_slugify = lru_cache(maxsize=4096)(slugify)
+
 
 class TaskException(KeyError):
     def __init__(self, message, *args, **kwargs) -> None:
@@ -24,21 +33,54 @@ class TaskException(KeyError):
         return self.message
 
 
+def due_order(task: Task) -> tuple:
+    """Sorts by due date, then content, with undated tasks last"""
+    return (task.due_date is None, task.due_date or DateType.min, task.content)
+
+
+class SubtreeStats(NamedTuple):
+    count: int = 0
+    earliest_due: Optional[DateType] = None
+    latest_due: Optional[DateType] = None
+    overdue: int = 0
+
+
+@lru_cache(maxsize=1)
+def _leaf_stats(today: DateType) -> tuple[DateType, SubtreeStats]:
+    # shared by every task without subtasks, which are most of them
+    return (today, SubtreeStats())
+
+
 class Task:
     def __init__(
         self,
         content: str,
         parent: Optional[Task],
         due_date: Optional[DateType] = None,
+        slug: Optional[str] = None,
     ) -> None:
         if not content:
             raise TaskException("A task cannot be empty")
 
         self.content = content
         self.due_date = due_date
+
+        # digest of this task and its subtasks, see subtree_hash()
+        self._subtree_hash: bytes | None = None
+
+        # totals of its subtasks, and the day they were worked out for
+        self._stats: tuple[DateType, SubtreeStats] | None = None
+
+        # given out by the TaskManager when the task is first indexed
+        self.id: int | None = None
+
+        # keep subtasks in due_order as they're added, rather than in the
+        # order they were added in
+        self.sorted_children = False
+
         self._parent = None
         self.parent = parent
-        self.slug = slugify(self.content)
+        self.slug = slug if slug is not None else cached_slugify(self.content)
         self.subtasks = []
 
     @classmethod
@@ -51,6 +93,8 @@ class Task:
             new_due_date = None
 
         new_task = Task(new_content, task_parent, new_due_date)
+        new_task.sorted_children = task_dict.get("sorted", False)
+        new_task.id = task_dict.get("id")
 
         [
             Task.init_from_dict(new_task, d)
@@ -69,7 +113,19 @@ class Task:
 
     @cached_property
     def path_str(self) -> str:
-        return "/".join(s.slug for s in self.full_path)
+        # built from the parent's rather than from full_path, so the
+        # list of ancestors isn't kept for every task that's indexed
+        if self.parent is None:
+            return ""
+
+        parent_path = self.parent.path_str
+        return f"{parent_path}/{self.slug}" if parent_path else self.slug
+
+    def _invalidate_paths(self):
+        """Drop the cached paths of this task and its subtasks, after a move"""
+        for task in self:
+            task.__dict__.pop("full_path", None)
+            task.__dict__.pop("path_str", None)
 
     @property
     def parent(self):
@@ -79,20 +135,93 @@ class Task:
     def parent(self, new_parent: Task | None):
         if self._parent is not None:
             self._parent.subtasks.remove(self)
+            self._parent.invalidate_caches()
 
         if new_parent is not None:
-            new_parent.subtasks.append(self)
+            if new_parent.sorted_children:
+                insort(new_parent.subtasks, self, key=due_order)
+            else:
+                new_parent.subtasks.append(self)
+
+            new_parent.invalidate_caches()
 
         self._parent = new_parent
 
+    def subtree_hash(self) -> bytes:
+        """
+        A digest of this task's content and due date, and those of all its
+        subtasks in order. Equal for two tasks only if their subtrees are.
+        """
+        if self._subtree_hash is None:
+            digest = blake2b(digest_size=16)
+            digest.update(self.content.encode())
+            digest.update(b"\0" + str(self.due_date).encode())
+            digest.update(b"\0sorted" if self.sorted_children else b"")
+
+            for subtask in self.subtasks:
+                digest.update(subtask.subtree_hash())
+
+            self._subtree_hash = digest.digest()
+
+        return self._subtree_hash
+
+    def subtree_stats(self, today: Optional[DateType] = None) -> SubtreeStats:
+        """Totals for every task below this one, worked out once per change"""
+        if today is None:
+            today = DateType.today()
+
+        if self._stats is not None and self._stats[0] == today:
+            return self._stats[1]
+
+        if not self.subtasks:
+            self._stats = _leaf_stats(today)
+            return self._stats[1]
+
+        count = overdue = 0
+        due_dates = []
+
+        for subtask in self.subtasks:
+            below = subtask.subtree_stats(today)
+            count += 1 + below.count
+            overdue += below.overdue
+
+            if subtask.due_date is not None:
+                due_dates.append(subtask.due_date)
+                overdue += subtask.due_date < today
+
+            if below.earliest_due is not None:
+                due_dates.extend((below.earliest_due, below.latest_due))
+
+        stats = (
+            SubtreeStats(count, min(due_dates), max(due_dates), overdue)
+            if due_dates
+            else SubtreeStats(count)
+        )
+        self._stats = (today, stats)
+        return stats
+
+    def invalidate_caches(self):
+        """
+        Call after changing a task's content, due date or the order of its
+        subtasks. Only it and its ancestors are hashed and totalled again
+        when next asked.
+        """
+        task: Optional[Task] = self
+
+        # a cached hash or total means those of every subtask are cached
+        # too, so there's nothing left to clear above an uncached task
+        while task is not None and (
+            task._subtree_hash is not None or task._stats is not None
+        ):
+            task._subtree_hash = None
+            task._stats = None
+            task = task.parent
+
     def __iter__(self):
         yield self
         if self.subtasks:
             yield from chain.from_iterable(i for i in (s for s in self.subtasks))
 
-    def decompose(self):
-        raise NotImplementedError
-
     def __str__(self):
         return self.content
 
@@ -104,35 +233,237 @@ class Task:
 
     def _define_subtasks(self, s: list[Task]):
         self.subtasks = s
+        self.invalidate_caches()
 
     def _to_dict(self, recurse: bool = True):
-        save_dict: dict[str, str | list] = {
+        save_dict: dict[str, str | int | list] = {
             "content": self.content,
             "due_date": "None" if not self.due_date else self.due_date.isoformat(),
         }
 
+        if self.id is not None:
+            save_dict["id"] = self.id
+
+        if self.sorted_children:
+            save_dict["sorted"] = True
+
         if recurse and self.subtasks:
             save_dict["subtasks"] = [c._to_dict(recurse=True) for c in self.subtasks]
 
         return save_dict
 
 
+class LazyTask(Task):
+    """
+    A task whose subtasks are only read in, by calling `loader`,
+    the first time they're needed
+    """
+
+    def __init__(
+        self,
+        content: str,
+        parent: Optional[Task],
+        due_date: Optional[DateType] = None,
+        slug: Optional[str] = None,
+        loader: Optional[Callable[[TaskManager, LazyTask], None]] = None,
+        subtree_hash: bytes | None = None,
+        manager: Optional[TaskManager] = None,
+    ) -> None:
+        super().__init__(content, parent, due_date, slug=slug)
+        self.loader = loader
+        self.loaded = loader is None
+
+        # the one its subtasks are indexed into once read,
+        # which changes if it's merged into another
+        self.manager = manager
+
+        # saved along with the shard, so it can be compared without reading it
+        self._subtree_hash = subtree_hash
+
+    @property
+    def subtasks(self) -> list[Task]:
+        if not self.loaded:
+            # set first, since the loader adds subtasks through this property
+            self.loaded = True
+            assert self.loader is not None and self.manager is not None
+            self.loader(self.manager, self)
+
+        return self._subtasks
+
+    @subtasks.setter
+    def subtasks(self, new_subtasks: list[Task]):
+        self._subtasks = new_subtasks
+
+    def __iter__(self):
+        # an unloaded task is iterated as a leaf, rather than loading it
+        if self.loaded:
+            yield from super().__iter__()
+        else:
+            yield self
+
+
+class Relocation(NamedTuple):
+    """
+    A task moving from one place in the tree to another.
+    Adding a task moves it from nowhere, and deleting it moves it to nowhere,
+    so undoing any of them is the same relocation in reverse.
+    """
+
+    task: Task
+    old_parent: Optional[Task]
+    old_position: Optional[int]
+    new_parent: Optional[Task]
+    new_position: Optional[int]
+
+    def reversed(self) -> Relocation:
+        return Relocation(
+            self.task,
+            self.new_parent,
+            self.new_position,
+            self.old_parent,
+            self.old_position,
+        )
+
+
+class TreeChange(NamedTuple):
+    """
+    One difference found by TaskManager.diff: a task that was "added",
+    "removed" or "changed", or one whose subtasks were "reordered"
+    """
+
+    kind: str
+    path: str
+
+
+class TaskListener(Protocol):
+    """Told about tasks as they enter and leave a TaskManager's tree"""
+
+    def tasks_added(self, tasks: Iterable[Task]) -> None: ...
+
+    def tasks_removed(self, tasks: Iterable[Task]) -> None: ...
+
+    # the whole tree was reindexed, so anything derived from it should be rebuilt
+    def tasks_reset(self, manager: TaskManager) -> None: ...
+
+
+class SlugIndex:
+    """The tasks with each slug, among those that have been read so far"""
+
+    def __init__(self) -> None:
+        self.by_slug: dict[str, list[Task]] = {}
+
+    def get(self, slug: str) -> list[Task]:
+        return self.by_slug.get(slug, [])
+
+    def tasks_reset(self, manager: TaskManager):
+        self.by_slug = {}
+        self.tasks_added(manager)
+
+    def tasks_added(self, tasks: Iterable[Task]):
+        for task in tasks:
+            same_slug = self.by_slug.setdefault(task.slug, [])
+
+            # a shard being read announces the task it's under again
+            if not any(t is task for t in same_slug):
+                same_slug.append(task)
+
+    def tasks_removed(self, tasks: Iterable[Task]):
+        for task in tasks:
+            same_slug = self.by_slug.get(task.slug, [])
+            remaining = [t for t in same_slug if t is not task]
+
+            if remaining:
+                self.by_slug[task.slug] = remaining
+            else:
+                self.by_slug.pop(task.slug, None)
+
+
+class IndexSnapshot(NamedTuple):
+    """A read only view of tasks_index, as it was after a complete change"""
+
+    generation: int
+    tasks: Mapping[str, Task]
+
+
+def _writes(method):
+    """Run a TaskManager method while holding its write lock"""
+
+    @wraps(method)
+    def locked(self: TaskManager, *args, **kwargs):
+        with self.write_lock:
+            return method(self, *args, **kwargs)
+
+    return locked
+
+
 class TaskManager:
+    """
+    Changes to the task tree are made by one thread at a time, holding
+    write_lock. Other threads (completion, reminders) read from snapshot(),
+    which never waits on a change in progress or shows one half done.
+    """
+
     def __init__(
         self,
         save_file: str | Path = "~/.local/della/tasks.toml",
         show_days_until: bool = True,
         date_format: str = "%a, %b %d",
+        undo_limit: int = 100,
+        show_ids: bool = False,
     ):
         self.date_format = date_format
         self.show_days_until = show_days_until
+        self.show_ids = show_ids
 
         self.save_file_path = save_file
 
         self.root_task = Task("All Tasks", None)
         self.tasks_index: dict[str, Task] = {}
+
+        # ids are never reused, so one always means the same task.
+        # Saved with the tasks, since some of them may be in unread shards
+        self.root_task.id = 0
+        self.next_id = 1
+        self.tasks_by_id: dict[int, Task] = {0: self.root_task}
         self.active_task = self.root_task
 
+        # set on any change to the task tree, cleared once it's written out
+        self.dirty = False
+
+        # top level tasks whose subtrees changed since the last save
+        self.dirty_shards: set[Task] = set()
+
+        # bumped whenever the tree or its index changes, so anything
+        # derived from them (like the @find indexes) knows to rebuild
+        self.generation = 0
+
+        # built on first use, then kept up to date as tasks change
+        self._search_index: SearchIndex | None = None
+
+        # reads a saved copy of the search index, if there is one
+        self.search_index_loader: Optional[Callable[[], SearchIndex | None]] = None
+
+        # each entry is a description and the relocations it made. Deleted
+        # tasks are kept alive only by these, until they fall off the end
+        self.undo_history: deque[tuple[str, tuple[Relocation, ...]]] = deque(
+            maxlen=undo_limit
+        )
+        self.redo_history: deque[tuple[str, tuple[Relocation, ...]]] = deque(
+            maxlen=undo_limit
+        )
+
+        # kept up to date as tasks are added, moved and deleted
+        self.slug_index = SlugIndex()
+        self.listeners: list[TaskListener] = [self.slug_index]
+
+        # reentrant, since changes are often made up of smaller ones
+        self.write_lock = threading.RLock()
+        self._snapshot = IndexSnapshot(-1, MappingProxyType({}))
+
+        # whether the last snapshot is a view of tasks_index itself,
+        # which then has to be copied before it's next changed
+        self._index_shared = False
+
     @property
     def save_file_path(self):
         return self._save_file_path
@@ -144,33 +475,341 @@ class TaskManager:
     def __iter__(self):
         yield from (i for i in self.root_task if i is not self.root_task)
 
-    def _set_task_format(self, target_task: Task):
-        def task_decompose(task: Task):
-            def make_display_date():
-                if task.due_date is None:
-                    return ""
+    def _top_level(self, task: Task) -> Task | None:
+        # walks up the parents rather than using full_path,
+        # which is cached and goes stale when tasks are moved
+        while task.parent is not None and task.parent is not self.root_task:
+            task = task.parent
 
-                display_date = " " + task.due_date.strftime(self.date_format)
+        return task if task.parent is self.root_task else None
 
-                if not self.show_days_until:
-                    return display_date
+    def _mark_dirty(self, *tasks: Task):
+        self.dirty = True
+        self.generation += 1
 
-                days_until_delta = task.due_date - DateType.today()
+        for task in tasks:
+            if (top_level := self._top_level(task)) is not None:
+                self.dirty_shards.add(top_level)
 
-                return f"{display_date} (in {days_until_delta.days} days)"
+    def snapshot(self) -> IndexSnapshot:
+        """
+        The index as of the last complete change. It isn't copied here, but
+        by the next change to the index after it, so changes that leave the
+        index alone and snapshots with no change in between copy nothing.
+        While a change is being made the previous snapshot is returned,
+        rather than waiting for it to finish.
+        """
+        snapshot = self._snapshot
 
-            subtask_summary = (
-                "" if not task.subtasks else f"{len(task.subtasks)} subtasks"
+        if snapshot.generation == self.generation:
+            return snapshot
+
+        if not self.write_lock.acquire(blocking=False):
+            return snapshot
+
+        try:
+            # kept if the index hasn't changed, so anything derived from
+            # it alone can tell it needn't be worked out again
+            tasks = (
+                snapshot.tasks
+                if self._index_shared
+                else MappingProxyType(self.tasks_index)
             )
+            snapshot = IndexSnapshot(self.generation, tasks)
+            self._index_shared = True
+            self._snapshot = snapshot
+        finally:
+            self.write_lock.release()
+
+        return snapshot
+
+    @property
+    def search_index(self) -> SearchIndex:
+        if self._search_index is None:
+            with self.write_lock, span("tasks.search_index"):
+                # it may have been built by another thread in the meantime
+                if self._search_index is None and self.search_index_loader:
+                    self._search_index = self.search_index_loader()
+
+                if self._search_index is None:
+                    self._search_index = SearchIndex.build(self)
+
+        return self._search_index
+
+    def _index_words(self, tasks: Iterable[Task]):
+        if self._search_index is not None:
+            for task in tasks:
+                self._search_index.add(task)
+
+    def _unindex_words(self, tasks: Iterable[Task]):
+        if self._search_index is not None:
+            for task in tasks:
+                self._search_index.remove(task)
+
+    @_writes
+    def load_all(self):
+        """Read any shards that haven't been loaded yet"""
+        for top_level in self.root_task.subtasks:
+            top_level.subtasks
+
+    def load_path(self, path_str: str):
+        """Read the shard a path leads into, if it hasn't been yet"""
+        top_level = self.tasks_index.get(path_str.partition("/")[0])
+
+        if isinstance(top_level, LazyTask) and not top_level.loaded:
+            top_level.subtasks
+
+    def _own_index(self):
+        """Copy tasks_index before changing it, if a snapshot is reading it"""
+        if self._index_shared:
+            self.tasks_index = dict(self.tasks_index)
+            self._index_shared = False
+
+    def _index_ids(self, tasks: Iterable[Task]):
+        for task in tasks:
+            # new, or a copy of one that's already here
+            if task.id is None or self.tasks_by_id.get(task.id, task) is not task:
+                task.id = self.next_id
+
+            self.next_id = max(self.next_id, task.id + 1)
+            self.tasks_by_id[task.id] = task
+
+    def _index_subtree(self, task: Task):
+        self.generation += 1
+        self._index_words(task)
+        self._index_ids(task)
+        self._own_index()
+
+        for subtask in task:
+            path_str = subtask.path_str
+
+            if self.tasks_index.get(path_str, subtask) is not subtask:
+                raise TaskException(f"{path_str} already present")
+
+            self.tasks_index[path_str] = subtask
+
+        for listener in self.listeners:
+            listener.tasks_added(task)
+
+    def _unindex_subtree(self, *tasks: Task):
+        self.generation += 1
+        subtree = list(chain.from_iterable(tasks))
+        self._unindex_words(subtree)
+        self._own_index()
+
+        for subtask in subtree:
+            if self.tasks_index.get(subtask.path_str) is subtask:
+                del self.tasks_index[subtask.path_str]
+
+            if subtask.id is not None and self.tasks_by_id.get(subtask.id) is subtask:
+                del self.tasks_by_id[subtask.id]
+
+        for listener in self.listeners:
+            listener.tasks_removed(subtree)
+
+    def _check_relocation(self, task: Task, new_parent: Optional[Task]):
+        if new_parent is None:
+            return
+
+        # its subtasks aren't in the index until its shard is read
+        new_parent.subtasks
+
+        ancestor: Optional[Task] = new_parent
+        while ancestor is not None:
+            if ancestor is task:
+                raise TaskException(f"Can't move {task.slug} inside itself")
+            ancestor = ancestor.parent
 
-            return (task.content, subtask_summary, make_display_date())
+        if new_parent is not self.root_task and (
+            self.tasks_index.get(new_parent.path_str) is not new_parent
+        ):
+            raise TaskException(f"{new_parent.slug} is no longer in the task tree")
 
-        def task_str(task: Task):
-            return " | ".join([t for t in task_decompose(task) if t])
+        path_str = "/".join(p for p in (new_parent.path_str, task.slug) if p)
 
-        target_task.decompose = types.MethodType(task_decompose, target_task)
-        target_task.__str__ = types.MethodType(task_str, target_task)
+        if self.tasks_index.get(path_str, task) is not task:
+            raise TaskException(f"{path_str} already present")
 
+    def _relocate(
+        self, task: Task, new_parent: Optional[Task], position: Optional[int] = None
+    ) -> Relocation:
+        """
+        Move a task and its subtasks, updating only their part of the index.
+        Returns the relocation that was made.
+        """
+        old_parent = task.parent
+        old_position = None
+
+        if old_parent is not None:
+            old_position = old_parent.subtasks.index(task)
+            self._mark_dirty(task)
+            self._unindex_subtree(task)
+
+        task.parent = new_parent
+        task._invalidate_paths()
+
+        if new_parent is not None:
+            # a sorted parent has already put it in its place
+            if position is not None and not new_parent.sorted_children:
+                new_parent.subtasks.insert(position, new_parent.subtasks.pop())
+                new_parent.invalidate_caches()
+
+            self._index_subtree(task)
+            self._mark_dirty(task)
+
+        if new_parent is None:
+            new_position = None
+        elif new_parent.sorted_children:
+            new_position = bisect_left(
+                new_parent.subtasks, due_order(task), key=due_order
+            )
+        elif position is not None:
+            new_position = position
+        else:
+            new_position = len(new_parent.subtasks) - 1
+
+        return Relocation(task, old_parent, old_position, new_parent, new_position)
+
+    def _remove_all(self, tasks: list[Task]):
+        """
+        Take many tasks out of the tree at once, such as when undoing a bulk
+        add, with one pass over each parent's subtasks rather than one per task
+        """
+        self._mark_dirty(*tasks)
+        self._unindex_subtree(*tasks)
+
+        removed = set(tasks)
+        parents = {task.parent: None for task in tasks if task.parent is not None}
+
+        for parent in parents:
+            parent.subtasks = [t for t in parent.subtasks if t not in removed]
+            parent.invalidate_caches()
+
+        for task in tasks:
+            task._parent = None
+            task._invalidate_paths()
+
+    def _record(self, description: str, *relocations: Relocation):
+        self.undo_history.append((description, relocations))
+        self.redo_history.clear()
+
+    def forget_history(self):
+        """
+        For changes that can't be undone: earlier entries
+        might refer to tasks those changes removed
+        """
+        self.undo_history.clear()
+        self.redo_history.clear()
+
+    def _in_tree(self, task: Task) -> bool:
+        while task.parent is not None:
+            task = task.parent
+
+        return task is self.root_task
+
+    def _still_applies(self, step: Relocation) -> bool:
+        """
+        Whether a task is still where a relocation starts from. It won't be if
+        a change that wasn't recorded, like @done, has moved it since
+        """
+        if step.task.parent is not step.old_parent:
+            return False
+
+        return step.old_parent is None or self._in_tree(step.old_parent)
+
+    def _replay(
+        self,
+        source: deque[tuple[str, tuple[Relocation, ...]]],
+        destination: deque[tuple[str, tuple[Relocation, ...]]],
+        reverse: bool,
+    ) -> str:
+        description, relocations = source.pop()
+        steps = (
+            [r.reversed() for r in reversed(relocations)] if reverse else relocations
+        )
+        steps = [step for step in steps if self._still_applies(step)]
+        verb = "undo" if reverse else "redo"
+
+        # either way the entry is dropped, as it never will apply again
+        if not steps:
+            raise TaskException(f"Can't {verb} {description}, it has changed since")
+
+        try:
+            for step in steps:
+                self._check_relocation(step.task, step.new_parent)
+        except TaskException as e:
+            raise TaskException(f"Can't {verb} {description}: {e}")
+
+        if len(steps) > 1 and all(step.new_parent is None for step in steps):
+            self._remove_all([step.task for step in steps])
+        else:
+            for step in steps:
+                self._relocate(step.task, step.new_parent, step.new_position)
+
+        destination.append((description, relocations))
+        return description
+
+    @_writes
+    def undo(self) -> str:
+        """Reverse the last recorded change, returning its description"""
+        if not self.undo_history:
+            raise TaskException("Nothing to undo")
+
+        return self._replay(self.undo_history, self.redo_history, reverse=True)
+
+    @_writes
+    def redo(self) -> str:
+        if not self.redo_history:
+            raise TaskException("Nothing to redo")
+
+        return self._replay(self.redo_history, self.undo_history, reverse=False)
+
+    @_writes
+    def set_sorted(self, task: Task, sorted_children: bool = True):
+        """
+        Keep a task's subtasks in due date order from now on, or go back to
+        adding new ones at the end
+        """
+        task.sorted_children = sorted_children
+
+        if sorted_children:
+            task.subtasks.sort(key=due_order)
+
+        task.invalidate_caches()
+        self._mark_dirty(task)
+
+    def decompose(self, task: Task) -> tuple[str, str, str]:
+        """A task's content, a summary of its subtasks, and its due date, for display"""
+        subtask_summary = "" if not task.subtasks else f"{len(task.subtasks)} subtasks"
+
+        if task.subtasks:
+            stats = task.subtree_stats()
+
+            if stats.count > len(task.subtasks):
+                subtask_summary += f" ({stats.count} in all)"
+
+            if stats.overdue:
+                subtask_summary += f", {stats.overdue} overdue"
+
+            if stats.earliest_due is not None:
+                subtask_summary += (
+                    f", first due {stats.earliest_due.strftime(self.date_format)}"
+                )
+
+        content = f"#{task.id} {task.content}" if self.show_ids else task.content
+
+        if task.due_date is None:
+            return (content, subtask_summary, "")
+
+        display_date = " " + task.due_date.strftime(self.date_format)
+
+        if self.show_days_until:
+            days_until_delta = task.due_date - DateType.today()
+            display_date += f" (in {days_until_delta.days} days)"
+
+        return (content, subtask_summary, display_date)
+
+    @_writes
     def add_task(
         self,
         content: str,
@@ -180,69 +819,357 @@ class TaskManager:
         if parent is None:
             parent = self.root_task
 
-        new_task = Task(content, parent, due_date)
+        new_task = Task(content, None, due_date)
+        self._check_relocation(new_task, parent)
+
+        relocation = self._relocate(new_task, parent)
+        self._record(f"add {new_task.path_str}", relocation)
+
+        return new_task
+
+    @_writes
+    def add_tasks(
+        self,
+        records: Iterable[tuple[str, str, Optional[DateType]]],
+        parent: Optional[Task] = None,
+        record: bool = True,
+    ) -> list[Task]:
+        """
+        Add many tasks at once. Each record is a tuple of
+        (parent path, content, due date), where the parent path is a slug path
+        relative to `parent` (the root by default), and may name a task added
+        by an earlier record. All records are checked for duplicates before
+        any task is added, and the index is only updated once.
+        Unless `record` is False, they can all be undone in one step.
+        """
+        if parent is None:
+            parent = self.root_task
+
+        base_path = parent.path_str
+        pending: dict[str, tuple[str, str, str, Optional[DateType]]] = {}
 
-        new_task.parent = parent
+        for parent_path, content, due_date in records:
+            if not content:
+                raise TaskException("A task cannot be empty")
 
-        self._set_task_format(new_task)
+            full_parent_path = "/".join(p for p in (base_path, parent_path) if p)
 
-        self.tasks_index[new_task.path_str] = new_task
+            if full_parent_path not in pending:
+                self.load_path(full_parent_path)
 
-        self.reindex()
-        return new_task
+            if full_parent_path and not (
+                full_parent_path in pending or full_parent_path in self.tasks_index
+            ):
+                raise TaskException(f"'{full_parent_path}' is not a valid task")
+
+            slug = cached_slugify(content)
+            path_str = f"{full_parent_path}/{slug}" if full_parent_path else slug
+
+            if path_str in pending or path_str in self.tasks_index:
+                raise TaskException(f"{path_str} already present")
+
+            pending[path_str] = (full_parent_path, content, slug, due_date)
+
+        added: dict[str, Task] = {}
+
+        # only the tasks added to existing parents need recording,
+        # the rest come and go along with them
+        relocations: list[Relocation] = []
 
+        for path_str, (parent_path, content, slug, due_date) in pending.items():
+            if parent_path in added:
+                added[path_str] = Task(content, added[parent_path], due_date, slug=slug)
+                continue
+
+            new_parent = (
+                self.tasks_index[parent_path] if parent_path else self.root_task
+            )
+            new_task = Task(content, new_parent, due_date, slug=slug)
+            added[path_str] = new_task
+
+            # known now, as it's just been appended. Sorted parents
+            # put it back in its place whatever the position
+            position = (
+                None if new_parent.sorted_children else len(new_parent.subtasks) - 1
+            )
+            relocations.append(Relocation(new_task, None, None, new_parent, position))
+
+        self._own_index()
+        self.tasks_index.update(added)
+        self._index_ids(added.values())
+        self._mark_dirty(*added.values())
+        self._index_words(added.values())
+
+        for listener in self.listeners:
+            listener.tasks_added(added.values())
+
+        if record:
+            self._record(f"add {len(added)} tasks", *relocations)
+
+        return list(added.values())
+
+    @_writes
+    def add_outline(
+        self,
+        outline: Iterable[dict],
+        parent: Optional[Task] = None,
+        record: bool = True,
+    ):
+        """
+        Add a nested outline of tasks, given as dicts in the same shape
+        as the task file: {"content": ..., "due_date": ..., "subtasks": [...]}
+        """
+
+        def outline_records(nodes: Iterable[dict], parent_path: str):
+            for node in nodes:
+                due_date = node.get("due_date")
+
+                if isinstance(due_date, str):
+                    try:
+                        due_date = DateType.fromisoformat(due_date)
+                    except ValueError:
+                        due_date = None
+
+                yield (parent_path, node["content"], due_date)
+
+                if subtasks := node.get("subtasks"):
+                    slug = cached_slugify(node["content"])
+                    path_str = f"{parent_path}/{slug}" if parent_path else slug
+                    yield from outline_records(subtasks, path_str)
+
+        return self.add_tasks(outline_records(outline, ""), parent, record=record)
+
+    @_writes
     def move_task(self, target_task: Task, new_parent: Task):
-        self.reindex()
-        target_task.parent = new_parent
-        self.reindex()
+        self._check_relocation(target_task, new_parent)
+
+        old_path = target_task.path_str
+        relocation = self._relocate(target_task, new_parent)
+        self._record(f"move {old_path} to {target_task.path_str}", relocation)
 
     def __repr__(self):
         self.reindex()
         return self.tasks_index.__repr__()
 
+    @_writes
+    def merge(self, other: TaskManager) -> list[str]:
+        """
+        Update this task tree in place to match another one, such as a newer
+        copy read back from disk. Subtrees that are unchanged are left alone,
+        and new ones are moved over from `other` rather than copied. Only the
+        tasks that changed are indexed again.
+        Returns the paths of the tasks that were added, removed or changed.
+        """
+        changed: list[str] = []
+
+        # indexed once everything that's gone has been taken out,
+        # so their paths and ids are free again
+        moved_in: list[Task] = []
+
+        def replace_fields(live_task: Task, task: Task):
+            for listener in self.listeners:
+                listener.tasks_removed([live_task])
+
+            self._unindex_words([live_task])
+            live_task.content = task.content
+            live_task.due_date = task.due_date
+            live_task.sorted_children = task.sorted_children
+            live_task.invalidate_caches()
+            self._index_words([live_task])
+
+            for listener in self.listeners:
+                listener.tasks_added([live_task])
+
+        def merge_subtasks(live: Task, incoming: Task):
+            if live.subtree_hash() == incoming.subtree_hash():
+                return
+
+            # neither has been read, so the new shard can simply be read later
+            if isinstance(live, LazyTask) and isinstance(incoming, LazyTask):
+                if not live.loaded and not incoming.loaded:
+                    live.loader = incoming.loader
+                    live.invalidate_caches()
+                    live._subtree_hash = incoming._subtree_hash
+                    changed.append(live.path_str)
+                    return
+
+            live_subtasks = {t.slug: t for t in live.subtasks}
+            incoming_subtasks = {t.slug: t for t in incoming.subtasks}
+
+            for slug, task in live_subtasks.items():
+                if slug not in incoming_subtasks:
+                    changed.append(task.path_str)
+                    self._unindex_subtree(task)
+                    task.parent = None
+                    task._invalidate_paths()
+
+            for slug, task in incoming_subtasks.items():
+                if slug not in live_subtasks:
+                    task.parent = live
+                    task._invalidate_paths()
+
+                    # read into this manager from now on, not the other one
+                    if isinstance(task, LazyTask):
+                        task.manager = self
+
+                    moved_in.append(task)
+                    changed.append(task.path_str)
+                    continue
+
+                live_task = live_subtasks[slug]
+
+                if (
+                    live_task.content,
+                    live_task.due_date,
+                    live_task.sorted_children,
+                ) != (task.content, task.due_date, task.sorted_children):
+                    replace_fields(live_task, task)
+                    changed.append(live_task.path_str)
+
+                merge_subtasks(live_task, task)
+
+            # keep the order of the incoming tree
+            if list(live_subtasks) != list(incoming_subtasks):
+                order = {slug: i for i, slug in enumerate(incoming_subtasks)}
+                live.subtasks.sort(key=lambda t: order[t.slug])
+                live.invalidate_caches()
+
+        with self.write_lock:
+            if self.root_task.sorted_children != other.root_task.sorted_children:
+                self.root_task.sorted_children = other.root_task.sorted_children
+                self.root_task.invalidate_caches()
+
+            merge_subtasks(self.root_task, other.root_task)
+
+            for task in moved_in:
+                self._index_subtree(task)
+
+            self.next_id = max(self.next_id, other.next_id)
+
+            if changed:
+                self.generation += 1
+                self.forget_history()
+
+        return changed
+
+    @timed("tasks.diff")
+    def diff(self, other: TaskManager) -> list[TreeChange]:
+        """
+        The changes that would turn this task tree into another one.
+        Subtrees with the same hash on both sides are skipped without being
+        walked, so the cost follows the size of the changes, not of the trees.
+        """
+        changes: list[TreeChange] = []
+
+        def diff_subtasks(ours: Task, theirs: Task):
+            if ours.subtree_hash() == theirs.subtree_hash():
+                return
+
+            our_subtasks = {t.slug: t for t in ours.subtasks}
+            their_subtasks = {t.slug: t for t in theirs.subtasks}
+
+            for slug, task in our_subtasks.items():
+                if slug not in their_subtasks:
+                    changes.append(TreeChange("removed", task.path_str))
+
+            for slug, task in their_subtasks.items():
+                if slug not in our_subtasks:
+                    changes.append(TreeChange("added", task.path_str))
+                    continue
+
+                our_task = our_subtasks[slug]
+
+                if (
+                    our_task.content,
+                    our_task.due_date,
+                    our_task.sorted_children,
+                ) != (task.content, task.due_date, task.sorted_children):
+                    changes.append(TreeChange("changed", our_task.path_str))
+
+                diff_subtasks(our_task, task)
+
+            shared = [slug for slug in our_subtasks if slug in their_subtasks]
+
+            if shared != [slug for slug in their_subtasks if slug in our_subtasks]:
+                changes.append(TreeChange("reordered", ours.path_str))
+
+        diff_subtasks(self.root_task, other.root_task)
+        return changes
+
+    @timed("tasks.serialize")
+    @_writes
     def serialize(self, fp: TextIO):
         data_dict = {
-            "meta": {"timestamp": int(time.time())},
+            "meta": {
+                "timestamp": int(time.time()),
+                "hash": self.root_task.subtree_hash().hex(),
+                "next_id": self.next_id,
+            },
             "tasks": self.root_task._to_dict(recurse=True),
         }
 
-        toml.dump(data_dict, fp)
+        with span("tasks.serialize.toml"):
+            toml.dump(data_dict, fp)
+
+        self.dirty = False
+        self.dirty_shards.clear()
 
         return data_dict
 
     @classmethod
+    @timed("tasks.deserialize")
     def deserialize(cls, filepath: str | Path, fp: Optional[TextIO] = None, **kwargs):
         new_manager = TaskManager(save_file=filepath, **kwargs)
         data_dict: dict[str, dict] = {}
 
-        if not fp:
-            with open(new_manager.save_file_path, "r") as load_file:
-                data_dict = toml.load(load_file)
-        else:
-            data_dict = toml.load(fp)
+        with span("tasks.deserialize.toml"):
+            if not fp:
+                with open(new_manager.save_file_path, "r") as load_file:
+                    data_dict = toml.load(load_file)
+            else:
+                data_dict = toml.load(fp)
 
+        return new_manager.load_dict(data_dict)
+
+    @_writes
+    def load_dict(self, data_dict: dict):
+        """Fill an empty TaskManager from the contents of a task file"""
         tasks_dict: dict[str, str | list[dict]] = data_dict.get("tasks", {})
 
         tasks = [v for v in tasks_dict.get("subtasks", []) if isinstance(v, dict)]
-        root_subtasks = list(
-            map(partial(Task.init_from_dict, new_manager.root_task), tasks)
-        )
+        self.root_task.sorted_children = tasks_dict.get("sorted", False)
+        self.next_id = data_dict.get("meta", {}).get("next_id", 1)
+        root_subtasks = list(map(partial(Task.init_from_dict, self.root_task), tasks))
 
-        new_manager.root_task._define_subtasks(root_subtasks)
+        self.root_task._define_subtasks(root_subtasks)
 
-        new_manager.reindex()
-        return new_manager
+        self.reindex()
+        return self
 
+    @timed("tasks.reindex")
+    @_writes
     def reindex(self):
-        self.tasks_index.clear()
+        self.generation += 1
+
+        # built up separately and swapped in whole, so the index is
+        # never seen partly rebuilt
+        tasks_index: dict[str, Task] = {}
+        self._index_shared = False
+        self.tasks_by_id = {0: self.root_task}
+
         for task in self:
             path_str: str = task.path_str
-            if path_str in self.tasks_index and self.tasks_index[path_str] != task:
-                self.delete_task(task)
+            if path_str in tasks_index and tasks_index[path_str] != task:
+                self.tasks_index = tasks_index
+                self.delete_task(task, record=False)
                 raise TaskException(f"{path_str} already present")
-            self.tasks_index[path_str] = task
+            tasks_index[path_str] = task
 
-            self._set_task_format(task)
+        self.tasks_index = tasks_index
+        self._index_ids(tasks_index.values())
+
+        for listener in self.listeners:
+            listener.tasks_reset(self)
 
     def search(
         self,
@@ -274,6 +1201,23 @@ class TaskManager:
 
         return found
 
+    def tasks_with_slug(self, slug: str) -> list[Task]:
+        """
+        Every task with the given slug, among the shards that have been read.
+        Reading the rest for a slug would mean reading all of them.
+        """
+        return list(self.slug_index.get(slug))
+
+    def task_from_id(self, task_id: int) -> Task | None:
+        task = self.tasks_by_id.get(task_id)
+
+        # it may be in a shard that hasn't been read yet
+        if task is None and task_id < self.next_id:
+            self.load_all()
+            task = self.tasks_by_id.get(task_id)
+
+        return task
+
     def task_from_path(
         self, input_str: str, resolve_func: Optional[Callable] = None
     ) -> Task | None:
@@ -288,33 +1232,68 @@ class TaskManager:
 
         initial_token = path_tokens[0]
 
-        if initial_token.startswith("#") and len(initial_token) > 1:
-            task_start_options = self.search(initial_token.strip("#"))
+        # "#id:42" is always the task with that id. So is "#42", unless
+        # a task's slug is "42" too, which makes it ambiguous
+        if initial_token.startswith("#id:") and initial_token[4:].isdigit():
+            by_id = self.task_from_id(int(initial_token[4:]))
+
+            if by_id is None:
+                return None
+
+            task_start = by_id
+            path_tokens = path_tokens[1:]
+
+        elif initial_token.startswith("#") and len(initial_token) > 1:
+            slug = initial_token.strip("#")
+            by_id = self.task_from_id(int(slug)) if slug.isdigit() else None
+
+            task_start_options = self.tasks_with_slug(slug)
+
+            if by_id is not None:
+                task_start_options = [by_id] + [
+                    t for t in task_start_options if t is not by_id
+                ]
 
             if not task_start_options:
                 return None
 
             if len(task_start_options) > 1:
-                if resolve_func is not None:
-                    task_start = resolve_func(task_start_options)
-                else:
+                if resolve_func is None:
                     return None
 
-            task_start = task_start_options[0]
+                task_start = resolve_func(task_start_options)
+
+            else:
+                task_start = task_start_options[0]
 
             path_tokens = path_tokens[1:]
 
+        if not path_tokens:
+            return task_start
+
         resolved_path = "/".join([t.slug for t in task_start.full_path] + path_tokens)
 
-        return task_index.get(resolved_path)
+        if resolved_path in task_index:
+            return task_index[resolved_path]
+
+        # the path may lead into a top level task that hasn't been loaded yet
+        self.load_path(resolved_path)
+        return self.tasks_index.get(resolved_path)
 
+    @_writes
     def delete_task(
-        self, task: Task, warn_func: Optional[Callable[[Task], bool]] = None
+        self,
+        task: Task,
+        warn_func: Optional[Callable[[Task], bool]] = None,
+        record: bool = True,
     ) -> bool:
         if warn_func and not warn_func(task):
             return False
 
-        task.parent = None
-        self.reindex()
+        path_str = task.path_str
+        relocation = self._relocate(task, None)
+
+        if record:
+            self._record(f"delete {path_str}", relocation)
 
         return True
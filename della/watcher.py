@@ -0,0 +1,147 @@
+"""
+Notices when the task file is changed by another process, such as a
+one-shot della command, a sync, or an editor.
+Uses inotify on Linux, and polls the file's status everywhere else.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import os
+import select
+import struct
+import sys
+import threading
+from pathlib import Path
+from typing import Optional
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def file_signature(path: Path) -> Optional[tuple[int, int, int]]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _inotify_watch(path: Path) -> Optional[int]:
+    """
+    Returns an inotify file descriptor watching the directory of path,
+    or None if inotify isn't available
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        # the running process already has libc loaded
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+
+    if fd < 0:
+        return None
+
+    # watching the directory also catches editors that save
+    # by writing a new file and renaming it over the old one
+    watch_mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    if libc.inotify_add_watch(fd, os.fsencode(path.parent), watch_mask) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+class FileWatcher:
+    """
+    Watches a single file from a background thread.
+    `changed` is set whenever the file is modified by someone else;
+    call ignore_current() after writing the file yourself.
+    """
+
+    def __init__(self, path: str | Path, poll_interval: float = 1.0) -> None:
+        self.path = Path(path).expanduser().resolve()
+        self.poll_interval = poll_interval
+
+        self.changed = threading.Event()
+        self._stopped = threading.Event()
+        self._own_signature = file_signature(self.path)
+        self._thread: Optional[threading.Thread] = None
+
+        # written to by stop(), to wake up the inotify thread
+        self._wake_read, self._wake_write = os.pipe()
+
+    def ignore_current(self):
+        """Treat the file as it is now as our own version of it"""
+        self._own_signature = file_signature(self.path)
+        self.changed.clear()
+
+    def _check(self):
+        if file_signature(self.path) != self._own_signature:
+            self.changed.set()
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval):
+            self._check()
+
+    def _watch_inotify(self, fd: int):
+        target_name = os.fsencode(self.path.name)
+
+        try:
+            while not self._stopped.is_set():
+                ready, _, _ = select.select([fd, self._wake_read], [], [])
+
+                if fd not in ready:
+                    continue
+
+                try:
+                    events = os.read(fd, 4096)
+                except BlockingIOError:
+                    continue
+
+                offset = 0
+                while offset < len(events):
+                    _, _, _, name_len = _EVENT_HEADER.unpack_from(events, offset)
+                    offset += _EVENT_HEADER.size
+                    name = events[offset : offset + name_len].rstrip(b"\0")
+                    offset += name_len
+
+                    if name == target_name:
+                        self._check()
+
+        finally:
+            os.close(fd)
+
+    def start(self):
+        # set up before returning, so no change after this call is missed
+        fd = _inotify_watch(self.path)
+
+        if fd is None:
+            self._thread = threading.Thread(target=self._poll, daemon=True)
+        else:
+            self._thread = threading.Thread(
+                target=self._watch_inotify, args=(fd,), daemon=True
+            )
+
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        os.write(self._wake_write, b"\0")
+
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval * 2)
+
+        os.close(self._wake_read)
+        os.close(self._wake_write)
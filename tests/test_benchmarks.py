@@ -0,0 +1,21 @@
+import pytest
+
+from benchmarks.__main__ import compare
+from benchmarks.generators import SHAPES, make_manager
+
+
+@pytest.mark.parametrize("shape", list(SHAPES))
+def test_generators_make_requested_size(shape):
+    manager = make_manager(shape, 500)
+    assert len(manager.tasks_index) == 500
+
+
+def test_compare_flags_regressions():
+    baseline = {"wide/1000/search": 0.010, "wide/1000/serialize": 0.0001}
+    results = {"wide/1000/search": 0.030, "wide/1000/serialize": 0.0003}
+
+    regressions = compare(results, baseline, tolerance=0.5)
+
+    # the serialize slowdown is under the noise floor
+    assert len(regressions) == 1
+    assert regressions[0].startswith("wide/1000/search")
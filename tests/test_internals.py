@@ -1,10 +1,40 @@
+import contextvars
+import json
+import socket
+import threading
+import time
+from contextlib import nullcontext
+from datetime import date, datetime
+from functools import partial
+from io import StringIO
 from pathlib import Path
 from shutil import copy
+from types import SimpleNamespace
 
 import pytest
 import toml
+from dateparse import DateParser
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.output import DummyOutput
 
-from della import cli
+from della import cli, daemon, profiling
+from della.archive import archive_path, archive_task, load_archive, remove_entry
+from della.completion import InputLexer, TaskCompleter
+from della.exporters import export_tasks
+from della.frecency import HALF_LIFE, Frecency, frecency_path
+from della.importers import import_outline
+from della.init_tasks import DellaConfig, SyncGroup
+from della.query import (
+    QueryIndexes,
+    find_tasks,
+    get_indexes,
+    parse_query,
+    plan_query,
+)
+from della.reminders import ReminderScheduler
+from della.storage import load_manager, save_manager, search_index_path, shard_dir
+from della.task import SlugIndex, TaskException, TaskManager, cached_slugify
+from della.watcher import FileWatcher, file_signature
 
 
 @pytest.fixture
@@ -35,3 +65,1123 @@ def test_setup(mock_config_file, capsys):
         c.from_prompt("@ls")
         output = capsys.readouterr()
         assert output.out.strip() == "No Tasks"
+
+
+def test_add_tasks_checks_duplicates_first():
+    manager = TaskManager()
+    manager.add_tasks([("", "work", None), ("work", "report", None)])
+
+    with pytest.raises(TaskException):
+        manager.add_tasks([("work", "email", None), ("work", "report", None)])
+
+    assert list(manager.tasks_index) == ["work", "work/report"]
+
+
+def test_import_outline():
+    outline = StringIO("home\n  - garden | 2030-05-01\n    weed\nwork\n")
+    manager = TaskManager()
+    import_outline(manager, outline)
+
+    assert list(manager.tasks_index) == [
+        "home",
+        "home/garden",
+        "home/garden/weed",
+        "work",
+    ]
+    assert manager.tasks_index["home/garden"].due_date.isoformat() == "2030-05-01"
+
+
+def test_export():
+    manager = TaskManager()
+    import_outline(manager, StringIO("home\n  garden | 2030-05-01\n    weed\nwork\n"))
+
+    outline = StringIO()
+    export_tasks(manager, outline, "outline")
+    assert outline.getvalue() == "home\n    garden | 2030-05-01\n        weed\nwork\n"
+
+    # exported outlines can be imported again
+    reimported = TaskManager()
+    import_outline(reimported, StringIO(outline.getvalue()))
+    assert list(reimported.tasks_index) == list(manager.tasks_index)
+
+    lines = StringIO()
+    export_tasks(manager, lines, "jsonl")
+    records = [json.loads(line) for line in lines.getvalue().splitlines()]
+    assert records[1] == {
+        "path": "home/garden",
+        "content": "garden",
+        "due_date": "2030-05-01",
+        "depth": 2,
+        "subtasks": 1,
+        "id": 2,
+    }
+
+    table = StringIO()
+    export_tasks(manager, table, "csv")
+    rows = table.getvalue().splitlines()
+    assert rows[0] == "path,content,due_date,depth,subtasks,id"
+    assert rows[3] == "home/garden/weed,weed,,3,0,3"
+
+
+def test_profiling_spans(mock_config_file):
+    with profiling.span("unrecorded"):
+        pass
+
+    profiling.enable()
+    try:
+        manager = TaskManager()
+        manager.add_task("a task")
+        manager.serialize(StringIO())
+    finally:
+        profiling.disable()
+
+    report = "\n".join(profiling.report())
+    profiling.reset()
+
+    assert "tasks.serialize" in report
+    assert "unrecorded" not in report
+
+    # @find is timed while its results are taken, not only while planning
+    profiling.enable()
+    try:
+        with cli.CLI_Parser(config_file=mock_config_file) as c:
+            c.manager.add_task("a task")
+            c.list_results = lambda results: [time.sleep(0.05) for _ in results]
+            c.from_prompt("@find task")
+    finally:
+        profiling.disable()
+
+    totals = profiling.totals()
+    profiling.reset()
+
+    assert totals["find"][1] >= 0.05 > totals["find.plan"][1]
+
+
+def test_sharded_storage(mock_task_file):
+    manager = TaskManager(save_file=mock_task_file)
+    manager.add_tasks(
+        [("", "work", None), ("work", "report", None), ("", "home", None)]
+    )
+    save_manager(manager, "sharded")
+
+    loaded = load_manager(mock_task_file)
+    assert not any(t.loaded for t in loaded.root_task.subtasks)
+
+    # duplicates are caught in shards that haven't been read yet
+    with pytest.raises(TaskException):
+        loaded.add_tasks([("work", "report", None)])
+
+    lazy = load_manager(mock_task_file)
+    with pytest.raises(TaskException):
+        lazy.add_task("report", lazy.tasks_index["work"])
+    assert sorted(lazy.tasks_index) == ["home", "work", "work/report"]
+
+    report = loaded.task_from_path("work/report")
+    assert report is not None
+
+    # found among the shards read so far, without reading the rest
+    assert loaded.task_from_path("#report") is report
+    assert not loaded.tasks_index["home"].loaded
+
+    loaded.add_task("draft", report)
+    home_shard = shard_dir(mock_task_file).joinpath("home.toml")
+    home_shard.unlink()
+    save_manager(loaded, "sharded")
+
+    # only the changed shard, and the missing one, were written
+    assert home_shard.exists()
+    assert load_manager(mock_task_file).task_from_path("work/report/draft")
+
+    save_manager(load_manager(mock_task_file), "file")
+    assert not shard_dir(mock_task_file).exists()
+    assert len(load_manager(mock_task_file).tasks_index) == 4
+
+
+def test_merge_external_changes(mock_task_file):
+    live = TaskManager(save_file=mock_task_file)
+    live.add_tasks([("", "work", None), ("work", "report", None), ("", "home", None)])
+    home = live.tasks_index["home"]
+
+    with open(mock_task_file, "w") as outfile:
+        live.serialize(outfile)
+
+    watcher = FileWatcher(mock_task_file, poll_interval=0.05)
+    watcher.start()
+
+    try:
+        external = TaskManager.deserialize(mock_task_file)
+        external.delete_task(external.tasks_index["work/report"])
+        external.add_task("slides", external.tasks_index["work"])
+
+        with open(mock_task_file, "w") as outfile:
+            external.serialize(outfile)
+
+        assert watcher.changed.wait(timeout=2)
+
+    finally:
+        watcher.stop()
+
+    changed = live.merge(TaskManager.deserialize(mock_task_file))
+
+    assert sorted(changed) == ["work/report", "work/slides"]
+    assert sorted(live.tasks_index) == ["home", "work", "work/slides"]
+    assert live.tasks_index["home"] is home
+
+
+def test_merge_sharded_changes(mock_task_file):
+    manager = TaskManager(save_file=mock_task_file)
+    manager.add_tasks(
+        [("", "work", None), ("work", "report", None), ("", "home", None)]
+    )
+    save_manager(manager, "sharded")
+    live = load_manager(mock_task_file)
+
+    external = load_manager(mock_task_file)
+    external.add_tasks(
+        [("work", "slides", None), ("", "garden", None), ("garden", "weed", None)]
+    )
+    save_manager(external, "sharded")
+
+    incoming = load_manager(mock_task_file)
+    assert sorted(live.merge(incoming)) == ["garden", "work"]
+
+    # the changed shards are read when needed, and into the live manager
+    assert not any(t.loaded for t in live.root_task.subtasks)
+    assert live.task_from_path("garden/weed") is not None
+    assert live.task_from_path("work/slides") is not None
+    assert "garden/weed" not in incoming.tasks_index
+
+
+def test_subtree_hashes_and_diff(mock_task_file):
+    ours = TaskManager(save_file=mock_task_file)
+    ours.add_tasks(
+        [
+            ("", "work", None),
+            ("work", "report", None),
+            ("work", "slides", None),
+            ("", "home", None),
+        ]
+    )
+    save_manager(ours, "sharded")
+    theirs = load_manager(mock_task_file)
+
+    assert ours.root_task.subtree_hash() == theirs.root_task.subtree_hash()
+    assert ours.diff(theirs) == []
+
+    # compared from the hashes saved in the manifest, without reading shards
+    assert not any(t.loaded for t in theirs.root_task.subtasks)
+
+    home_hash = theirs.tasks_index["home"].subtree_hash()
+    theirs.add_task("draft", theirs.task_from_path("work/report"))
+    theirs.move_task(theirs.tasks_index["work/report"], theirs.root_task)
+    theirs.move_task(theirs.tasks_index["report"], theirs.tasks_index["work"])
+
+    assert theirs.tasks_index["home"].subtree_hash() == home_hash
+    assert ours.diff(theirs) == [
+        ("added", "work/report/draft"),
+        ("reordered", "work"),
+    ]
+
+    theirs.undo()
+    theirs.undo()
+    theirs.delete_task(theirs.tasks_index["work/report/draft"])
+
+    assert ours.root_task.subtree_hash() == theirs.root_task.subtree_hash()
+
+
+def test_sorted_subtasks(mock_task_file):
+    manager = TaskManager(save_file=mock_task_file)
+    manager.add_tasks(
+        [
+            ("", "work", None),
+            ("work", "slides", None),
+            ("work", "report", date(2030, 5, 3)),
+            ("work", "email", date(2030, 5, 1)),
+            ("", "call", date(2030, 5, 2)),
+        ]
+    )
+    work = manager.tasks_index["work"]
+    manager.set_sorted(work)
+
+    assert [t.slug for t in work.subtasks] == ["email", "report", "slides"]
+
+    manager.move_task(manager.tasks_index["call"], work)
+    manager.add_task("budget", work, date(2030, 5, 1))
+    assert [t.slug for t in work.subtasks] == [
+        "budget",
+        "email",
+        "call",
+        "report",
+        "slides",
+    ]
+
+    manager.undo()
+    manager.undo()
+    assert [t.slug for t in work.subtasks] == ["email", "report", "slides"]
+
+    save_manager(manager, "sharded")
+    loaded = load_manager(mock_task_file)
+    loaded.add_task("draft", loaded.tasks_index["work"], date(2030, 5, 2))
+
+    assert [t.slug for t in loaded.tasks_index["work"].subtasks] == [
+        "email",
+        "draft",
+        "report",
+        "slides",
+    ]
+
+
+def test_subtree_stats():
+    manager = TaskManager()
+    manager.add_tasks(
+        [
+            ("", "work", None),
+            ("work", "report", date(2030, 5, 3)),
+            ("work/report", "draft", date(2030, 5, 1)),
+            ("work", "email", None),
+            ("", "home", date(2030, 6, 1)),
+        ]
+    )
+    today = date(2030, 5, 2)
+    work = manager.tasks_index["work"]
+
+    assert work.subtree_stats(today) == (3, date(2030, 5, 1), date(2030, 5, 3), 1)
+    assert manager.root_task.subtree_stats(today).latest_due == date(2030, 6, 1)
+
+    manager.move_task(manager.tasks_index["work/report/draft"], manager.root_task)
+    assert work.subtree_stats(today) == (2, date(2030, 5, 3), date(2030, 5, 3), 0)
+
+    manager.delete_task(manager.tasks_index["work/report"], record=False)
+    assert work.subtree_stats(today) == (1, None, None, 0)
+    assert manager.root_task.subtree_stats(today) == (
+        4,
+        date(2030, 5, 1),
+        date(2030, 6, 1),
+        1,
+    )
+
+
+def test_task_ids(mock_task_file):
+    manager = TaskManager(save_file=mock_task_file)
+    manager.add_tasks(
+        [
+            ("", "work", None),
+            ("work", "notes", None),
+            ("", "home", None),
+            ("home", "notes", None),
+        ]
+    )
+    home_notes = manager.tasks_index["home/notes"]
+
+    # no need to choose between the two "notes"
+    assert manager.task_from_path(f"#{home_notes.id}") is home_notes
+    assert manager.task_from_path("#0") is manager.root_task
+
+    manager.delete_task(home_notes)
+    assert manager.task_from_id(home_notes.id) is None
+    assert manager.add_task("notes", manager.tasks_index["home"]).id == 5
+
+    manager.undo()
+    manager.undo()
+    assert manager.task_from_path(f"#{home_notes.id}") is home_notes
+
+    save_manager(manager, "sharded")
+    loaded = load_manager(mock_task_file)
+
+    # slugs are only looked up among the shards already read
+    assert loaded.task_from_path("#notes") is None
+    assert loaded.task_from_path("#1").path_str == "work"
+    assert not any(t.loaded for t in loaded.root_task.subtasks)
+
+    # read from its shard when asked for
+    assert loaded.task_from_path("#4").path_str == "home/notes"
+    assert loaded.task_from_path("#1/notes").path_str == "work/notes"
+    assert loaded.add_task("slides", loaded.tasks_index["work"]).id == 6
+
+    # a task named after a number makes that number ambiguous, but
+    # either can still be picked, and "#id:" is only ever the id
+    manager.add_task("1")
+    work, one = manager.tasks_index["work"], manager.tasks_index["1"]
+    assert manager.task_from_path("#1") is None
+    assert manager.task_from_path("#1", resolve_func=lambda o: o[1]) is one
+    assert manager.task_from_path("#1", resolve_func=lambda o: o[0]) is work
+    assert manager.task_from_path("#id:1") is work
+    assert manager.task_from_path("#id:1/notes").path_str == "work/notes"
+
+
+def test_frecency(mock_task_file):
+    manager = TaskManager()
+    manager.add_tasks(
+        [
+            ("", "work", None),
+            ("work", "notes", None),
+            ("", "home", None),
+            ("home", "notes", None),
+        ]
+    )
+    work_notes = manager.tasks_index["work/notes"]
+    home_notes = manager.tasks_index["home/notes"]
+    now = [1_000_000.0]
+    frecency = Frecency(frecency_path(mock_task_file), clock=lambda: now[0])
+
+    frecency.visit(work_notes)
+    frecency.visit(work_notes)
+    now[0] += HALF_LIFE
+    frecency.visit(home_notes)
+
+    # two uses a half life ago count as much as one just now
+    assert frecency.score(work_notes) == frecency.score(home_notes) == 1
+    frecency.visit(home_notes)
+    assert frecency.rank([work_notes, home_notes]) == [home_notes, work_notes]
+
+    frecency.save()
+    loaded = Frecency.load(frecency.save_file, clock=lambda: now[0])
+    assert loaded.score(home_notes) == 2
+
+    completer = TaskCompleter.from_snapshot(manager.snapshot(), rank=loaded.score)
+    assert list(completer.compdict) == ["home", "work"]
+
+
+def test_workspaces(mock_config_file, tmp_path):
+    with open(mock_config_file, "r+") as config_file:
+        config_contents = toml.load(config_file)
+        config_contents["local"]["workspace_cache"] = 2
+        config_contents["workspaces"] = {
+            "work": tmp_path.joinpath("work.toml").as_posix(),
+            "oncall": tmp_path.joinpath("oncall.toml").as_posix(),
+        }
+
+        config_file.seek(0)
+        toml.dump(config_contents, config_file)
+        config_file.truncate()
+
+    # alerts go nowhere, rather than to a stream captured by an earlier test
+    with (
+        create_app_session(output=DummyOutput()),
+        cli.CLI_Parser(config_file=mock_config_file) as c,
+    ):
+        c.from_prompt("groceries")
+        default_manager = c.manager
+
+        c.from_prompt("@workspace work")
+        c.from_prompt("report")
+        work_manager = c.manager
+        assert list(work_manager.tasks_index) == ["report"]
+
+        # kept loaded, rather than read back
+        c.from_prompt("@ws default")
+        assert c.manager is default_manager
+
+        # only two fit, so work is written out and dropped
+        c.from_prompt("@ws oncall")
+        assert list(c.inactive_workspaces) == ["default"]
+        assert not work_manager.dirty
+
+        c.from_prompt("@ws work")
+        assert c.manager is not work_manager
+        assert list(c.manager.tasks_index) == ["report"]
+
+        # changes made by another process while it wasn't in use are kept
+        work_manager = c.manager
+        c.from_prompt("@ws default")
+        external = load_manager(tmp_path.joinpath("work.toml"))
+        external.add_task("slides")
+        save_manager(external)
+
+        c.from_prompt("@ws work")
+        assert c.manager is work_manager
+        assert list(c.manager.tasks_index) == ["report", "slides"]
+
+        with pytest.raises(TaskException):
+            c.from_prompt("@ws personal")
+
+    assert "groceries" in mock_config_file.with_name("tasks.toml").read_text()
+
+
+def test_daemon(mock_config_file, mock_task_file, monkeypatch):
+    config = DellaConfig.load(mock_config_file)
+    path = daemon.socket_path(config)
+
+    # nothing listening, so the command is run in-process instead
+    assert daemon.send_command("work", mock_config_file) is None
+
+    # and the same for a daemon that dies before answering, or is
+    # gone and has left its socket behind
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path.as_posix())
+    listener.listen(1)
+    dying = threading.Thread(target=lambda: listener.accept()[0].close())
+    dying.start()
+    assert daemon.send_command("work", mock_config_file) is None
+    dying.join()
+
+    listener.close()
+    assert daemon.send_command("work", mock_config_file) is None
+    path.unlink()
+
+    with (
+        create_app_session(output=DummyOutput()),
+        daemon.DaemonParser(config) as parser,
+    ):
+        server = daemon.DaemonServer(parser, path)
+
+        def send(command: str, **request):
+            status = []
+
+            def run_client():
+                status.append(daemon.send_command(command, mock_config_file, **request))
+
+            # answered here, one request at a time
+            client = threading.Thread(
+                target=contextvars.copy_context().run, args=(run_client,)
+            )
+            client.start()
+            server.handle_request()
+            client.join()
+            return status[0]
+
+        try:
+            assert send("work") == 0
+            server.checkpoint(force=True)
+            assert list(load_manager(mock_task_file).tasks_index) == ["work"]
+
+            # another process writes the file, and isn't saved over
+            outside = load_manager(mock_task_file)
+            outside.add_task("home")
+            save_manager(outside)
+
+            assert send("report #work") == 0
+            assert sorted(parser.manager.tasks_index) == ["home", "work", "work/report"]
+
+            # timed in the daemon, and sent back to the client to report
+            timings = []
+            monkeypatch.setattr(profiling, "add_totals", timings.append)
+            assert send("@ls", profile=True) == 0
+            assert "list" in timings[0] and not profiling.is_enabled()
+
+            outside = load_manager(mock_task_file)
+            outside.add_task("errands")
+            save_manager(outside)
+            server.checkpoint(force=True)
+
+        finally:
+            server.server_close()
+
+    saved = load_manager(mock_task_file)
+    assert sorted(saved.tasks_index) == ["errands", "home", "work"]
+    assert len({t.id for t in saved}) == len(saved.tasks_index)
+    assert any(a.startswith("The task file was changed") for a in parser.held_alerts)
+
+
+def test_batch(mock_config_file):
+    alerts = []
+    lines = [
+        "work",
+        "tomorrow",
+        "home",
+        "report #work",
+        "report",
+        "@mv #report",
+        "@mv work/report",
+        "#home",
+        "@rm work",
+    ]
+
+    with (
+        create_app_session(output=DummyOutput()),
+        cli.CLI_Parser(config_file=mock_config_file) as c,
+    ):
+        # nothing is asked, so there's no need to answer
+        c.interface = c.interface._replace(
+            alert=alerts.append, resolve_task=None, confirm_delete=None
+        )
+
+        # and a bad line doesn't stop the rest
+        assert c.from_batch(lines) == 2
+        assert "Line 2: A task cannot be empty" in alerts
+        assert any(a.startswith("Line 6: Ambiguous task") for a in alerts)
+        assert sorted(c.manager.tasks_index) == ["home", "home/report", "report"]
+        assert c.batch is None
+
+
+def test_read_only_session(mock_config_file, mock_task_file):
+    with (
+        create_app_session(output=DummyOutput()),
+        cli.CLI_Parser(config_file=mock_config_file) as c,
+    ):
+        c.from_prompt("work")
+
+    signature = file_signature(mock_task_file)
+    exported = StringIO()
+    messages = StringIO()
+
+    with cli.CLI_Parser(config_file=mock_config_file, messages=messages) as c:
+        c.export(exported, "jsonl")
+        c.interface.alert("Exported")
+
+    # nothing changed, so nothing was written, and alerts stay out of it
+    assert file_signature(mock_task_file) == signature
+    assert "work" in exported.getvalue()
+    assert "Exported" not in exported.getvalue()
+    assert "Exported" in messages.getvalue()
+
+
+def test_archive(mock_task_file):
+    manager = TaskManager()
+    manager.add_tasks(
+        [("", "work", None), ("work", "report", None), ("", "home", None)]
+    )
+    archive_file = archive_path(mock_task_file)
+
+    archive_task(archive_file, manager.tasks_index["work/report"])
+    archive_task(archive_file, manager.tasks_index["home"])
+
+    assert [e["content"] for e in load_archive(archive_file)] == ["home", "report"]
+
+    removed = remove_entry(archive_file, 2)
+    assert removed["parent_path"] == "work"
+    assert [e["content"] for e in load_archive(archive_file)] == ["home"]
+
+
+def test_done_keeps_undo_history(mock_config_file):
+    alerts = []
+
+    with (
+        create_app_session(output=DummyOutput()),
+        cli.CLI_Parser(config_file=mock_config_file) as c,
+    ):
+        c.interface = c.interface._replace(alert=alerts.append)
+        c.from_prompt("work")
+        c.from_prompt("report")
+        c.manager.move_task(
+            c.manager.tasks_index["report"], c.manager.tasks_index["work"]
+        )
+        c.from_prompt("@done work/report")
+        assert alerts[-1] == "Completed work/report"
+
+        # nothing about report applies any more, but adding work can still be undone
+        for _ in range(2):
+            with pytest.raises(TaskException):
+                c.from_prompt("@undo")
+
+        c.from_prompt("@undo")
+        assert alerts[-1] == "Undid add work"
+        assert list(c.manager.tasks_index) == []
+
+        c.from_prompt("@restore 1")
+        assert list(c.manager.tasks_index) == ["report"]
+        c.from_prompt("@redo")
+        assert sorted(c.manager.tasks_index) == ["report", "work"]
+
+
+def test_slugs_on_load(mock_task_file):
+    manager = TaskManager(save_file=mock_task_file)
+    manager.add_tasks(
+        [
+            ("", "Work!", None),
+            ("work", "report", None),
+            ("", "home", None),
+            ("home", "report", None),
+        ]
+    )
+
+    with open(mock_task_file, "w") as outfile:
+        manager.serialize(outfile)
+
+    # worked out again on load, which is cheaper than reading them back
+    saved = toml.load(mock_task_file)
+    assert "slug" not in saved["tasks"]["subtasks"][0]
+
+    # but only once for each name
+    cached_slugify.cache_clear()
+    loaded = load_manager(mock_task_file)
+    assert list(loaded.tasks_index) == ["work", "work/report", "home", "home/report"]
+    assert cached_slugify.cache_info().hits == 1
+
+
+def test_find_query():
+    manager = TaskManager()
+    manager.add_tasks(
+        [
+            ("", "work", None),
+            ("work", "Write report", date(2030, 5, 2)),
+            ("work/write-report", "draft", date(2030, 5, 1)),
+            ("work", "email bob", date(2030, 6, 1)),
+            ("", "home", None),
+            ("home", "report taxes", None),
+        ]
+    )
+    date_parser = DateParser()
+
+    def find(query_text: str):
+        query = parse_query(query_text, date_parser)
+        scope = manager.root_task
+        if query.scope is not None:
+            scope = manager.tasks_index[query.scope]
+
+        plan_name, _, _ = plan_query(manager, query, scope)
+        return plan_name, [t.path_str for t in find_tasks(manager, query, scope)]
+
+    assert find("report") == ("scan", ["work/write-report", "home/report-taxes"])
+    assert find("before:2030-05-31") == (
+        "due",
+        ["work/write-report/draft", "work/write-report"],
+    )
+    assert find("in:work depth:1 has:due") == (
+        "path",
+        ["work/email-bob", "work/write-report"],
+    )
+    assert find("slug:draft") == ("slug", ["work/write-report/draft"])
+
+    # the indexes follow changes to the tree
+    manager.add_task("report draft", manager.tasks_index["home"])
+    assert find("word:draft")[1] == ["work/write-report/draft", "home/report-draft"]
+
+    # by changing only their entries, ending up as if built from scratch
+    manager.move_task(
+        manager.tasks_index["work/write-report"], manager.tasks_index["home"]
+    )
+    manager.delete_task(manager.tasks_index["home/report-draft"])
+    indexes, fresh = get_indexes(manager), QueryIndexes(manager)
+    assert indexes.paths == fresh.paths and indexes.due_keys == fresh.due_keys
+    fresh_slugs = SlugIndex()
+    fresh_slugs.tasks_reset(manager)
+    assert {s: set(t) for s, t in manager.slug_index.by_slug.items()} == {
+        s: set(t) for s, t in fresh_slugs.by_slug.items()
+    }
+    assert find("before:2030-05-31")[1] == [
+        "home/write-report/draft",
+        "home/write-report",
+    ]
+
+
+def test_search_index(mock_task_file):
+    manager = TaskManager(save_file=mock_task_file)
+    manager.add_tasks(
+        [("", "work", None), ("work", "Write report", None), ("", "report taxes", None)]
+    )
+
+    def grep(query: str):
+        return sorted(t.path_str for t in manager.search_index.search(query))
+
+    assert grep("report") == ["report-taxes", "work/write-report"]
+    assert grep("report write") == ["work/write-report"]
+    assert grep("write OR taxes report") == ["report-taxes", "work/write-report"]
+    assert grep("rep*") == ["report-taxes", "work/write-report"]
+
+    # kept up to date as tasks are added and removed
+    manager.delete_task(manager.tasks_index["report-taxes"])
+    manager.add_task("Review", manager.tasks_index["work"])
+    assert grep("re*") == ["work/review", "work/write-report"]
+    assert manager.search_index.complete("ta") == []
+
+    save_manager(manager, saved_index=True)
+    assert search_index_path(mock_task_file).exists()
+
+    loaded = load_manager(mock_task_file, saved_index=True)
+    assert not loaded.search_index.changed
+    assert sorted(t.path_str for t in loaded.search_index.search("review")) == [
+        "work/review"
+    ]
+
+
+def test_undo_redo():
+    manager = TaskManager()
+    manager.add_tasks(
+        [("", "work", None), ("work", "report", None), ("", "home", None)]
+    )
+    report = manager.tasks_index["work/report"]
+
+    manager.move_task(report, manager.tasks_index["home"])
+    assert sorted(manager.tasks_index) == ["home", "home/report", "work"]
+    assert report.path_str == "home/report"
+
+    manager.delete_task(manager.tasks_index["work"])
+    manager.add_task("garden", manager.tasks_index["home"])
+
+    assert manager.undo() == "add home/garden"
+    assert manager.undo() == "delete work"
+    assert manager.undo() == "move work/report to home/report"
+    assert sorted(manager.tasks_index) == ["home", "work", "work/report"]
+    assert [t.slug for t in manager.root_task.subtasks] == ["work", "home"]
+    assert manager.tasks_index["work"].subtasks == [report]
+
+    assert manager.redo() == "move work/report to home/report"
+    assert report.path_str == "home/report"
+
+    # a new change can't be redone over
+    manager.add_task("office")
+    with pytest.raises(TaskException):
+        manager.redo()
+
+    # the whole import goes in one step
+    assert manager.undo() == "add office"
+    assert manager.undo() == "move work/report to home/report"
+    assert manager.undo() == "add 3 tasks"
+    assert list(manager.tasks_index) == []
+
+    with pytest.raises(TaskException):
+        manager.undo()
+
+    # tasks added in bulk next to existing ones come out, and go back, in order
+    manager.add_task("keep")
+    manager.add_tasks([("", "a", None), ("keep", "b", None), ("", "c", None)])
+    manager.undo()
+    assert list(manager.tasks_index) == ["keep"]
+
+    manager.redo()
+    assert [t.slug for t in manager.root_task.subtasks] == ["keep", "a", "c"]
+    assert manager.tasks_index["keep/b"].parent is manager.tasks_index["keep"]
+
+
+def test_reminders():
+    now = datetime(2026, 1, 10, 12)
+    manager = TaskManager()
+    work = manager.add_task("work")
+    report = manager.add_task("report", work, date(2026, 1, 13))
+
+    scheduler = ReminderScheduler(print, clock=lambda: now)
+    scheduler.watch(manager)
+
+    # the day before was already this morning
+    email = manager.add_task("email", work, date(2026, 1, 11))
+    assert len(scheduler.pending[email]) == 1
+    assert scheduler.next_reminder().task is email
+
+    manager.delete_task(email)
+    assert scheduler.next_reminder().task is report
+
+    imported = manager.add_tasks([("work", "taxes", date(2026, 1, 11))])
+    assert scheduler.next_reminder().task is imported[0]
+    manager.undo()
+
+    # moving a task keeps its reminders
+    manager.move_task(report, manager.root_task)
+    assert len(scheduler.pending[report]) == 2
+
+    now = datetime(2026, 1, 12, 9)
+    assert [r.message() for r in scheduler.pop_due()] == [
+        "Reminder: report is due tomorrow"
+    ]
+
+    manager.undo()
+    now = datetime(2026, 1, 13, 9)
+    assert [r.message() for r in scheduler.pop_due()] == [
+        "Reminder: work/report is due today"
+    ]
+    assert scheduler.next_reminder() is None
+
+
+def test_snapshots_skip_changes_in_progress():
+    manager = TaskManager()
+    work = manager.add_task("work")
+    manager.add_task("report", work)
+    before = manager.snapshot()
+
+    seen = []
+
+    def read():
+        seen.append(manager.snapshot())
+
+    with manager.write_lock:
+        manager.delete_task(work)
+        manager.add_task("home")
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join()
+
+    # another thread gets the last complete state rather than waiting
+    assert seen == [before]
+    assert sorted(before.tasks) == ["work", "work/report"]
+    assert list(manager.snapshot().tasks) == ["home"]
+
+    # taking a snapshot copies nothing, and the index is only copied when
+    # it's next changed, so changes that leave it alone don't copy it
+    shared, index = manager.snapshot(), manager.tasks_index
+    manager.set_sorted(index["home"], True)
+    assert manager.snapshot() is not shared
+    assert manager.snapshot().tasks is shared.tasks
+    assert manager.tasks_index is index
+    manager.add_task("work")
+    assert manager.tasks_index is not index
+    assert sorted(shared.tasks) == ["home"]
+    assert sorted(manager.snapshot().tasks) == ["home", "work"]
+
+    # the index is replaced rather than cleared, so held copies stay whole
+    index = manager.tasks_index
+    manager.reindex()
+    assert manager.tasks_index is not index
+    assert sorted(index) == ["home", "work"]
+
+
+def test_sync_group_picks_freshest(mock_task_file):
+    config = DellaConfig(
+        {
+            "local": {"task_file_local": mock_task_file.as_posix()},
+            "remote": {
+                "use_remote": True,
+                "user": "me",
+                "task_file_remote": "~/della/tasks.toml",
+                "private_key_location": "~/.ssh/della",
+                "timeout": 0.5,
+                "hosts": [
+                    {"address": "old"},
+                    {"address": "new"},
+                    {"address": "down"},
+                    {"address": "slow"},
+                ],
+            },
+            "style": {"tasks_display": []},
+        },
+        "config.toml",
+    )
+    group = SyncGroup(config)
+    pulled = []
+
+    def fetch_version(host):
+        match host.sync_config.address:
+            case "down":
+                raise ConnectionRefusedError("refused")
+            case "slow":
+                time.sleep(2)
+
+        return {"old": 100, "new": 200}.get(host.sync_config.address)
+
+    for host in group.hosts:
+        host.fetch_version = partial(fetch_version, host)
+        host.should_pull = lambda: True
+        host.apply_pull = partial(pulled.append, host.sync_config.address)
+
+    start = time.perf_counter()
+    assert group.pull_and_update()
+    assert time.perf_counter() - start < 1.5
+
+    assert pulled == ["new"]
+    assert [(r.address, r.succeeded) for r in group.results] == [
+        ("old", True),
+        ("new", True),
+        ("down", False),
+        ("slow", False),
+    ]
+    assert group.failures() == ["down: failed: refused", "slow: timed out"]
+
+    # once one has answered the rest aren't waited on for long, and
+    # the connections of those left behind are closed
+    config.sync_settle_time = 0.1
+    closed = []
+
+    for host in group.hosts:
+        host.offline_until = 0.0
+        host.abort = partial(closed.append, host.sync_config.address)
+
+    start = time.perf_counter()
+    assert group.pull_and_update()
+    assert time.perf_counter() - start < 0.4
+    assert closed == ["slow"]
+    assert group.failures() == ["down: failed: refused"]
+    assert group.hosts[3].reachable()
+
+    # a pull that fails partway is reported rather than raised
+    def lose_connection():
+        raise OSError("connection lost")
+
+    group.hosts[1].apply_pull = lose_connection
+    assert not group.pull_and_update()
+    assert group.failures()[0].endswith("pull failed: connection lost")
+
+
+def test_sync_pull_keeps_shards_whole(mock_task_file, tmp_path):
+    config = DellaConfig(
+        {
+            "local": {"task_file_local": mock_task_file.as_posix()},
+            "remote": {
+                "use_remote": True,
+                "user": "me",
+                "address": "remote",
+                "task_file_remote": "~/della/tasks.toml",
+                "private_key_location": "~/.ssh/della",
+            },
+            "style": {"tasks_display": []},
+        },
+        "config.toml",
+    )
+    host = SyncGroup(config).hosts[0]
+    remote_root = tmp_path.joinpath("remote")
+    remote_file = remote_root.joinpath(host.sync_config.task_file_remote)
+    remote_file.parent.mkdir(parents=True)
+
+    manager = TaskManager(save_file=mock_task_file)
+    manager.add_tasks([("", "work", None), ("", "home", None)])
+    save_manager(manager, "sharded")
+    local_shards = {p.name: p.read_text() for p in shard_dir(mock_task_file).iterdir()}
+
+    remote = TaskManager(save_file=remote_file)
+    remote.add_tasks([("", "work", None), ("work", "report", None), ("", "home", None)])
+    remote.add_task("chores", remote.tasks_index["home"])
+    save_manager(remote, "sharded")
+
+    # newer than the local shards, even if saved within the same second
+    manifest = toml.loads(remote_file.read_text())
+    for shard in manifest["shards"]:
+        shard["timestamp"] += 1
+    remote_file.write_text(toml.dumps(manifest))
+    copy(remote_file, host.tmp_syncfile)
+
+    failing = ["home.toml"]
+
+    class Connection:
+        def get(self, remotepath: str, localpath: str):
+            if Path(remotepath).name in failing:
+                raise OSError("connection lost")
+
+            copy(remote_root.joinpath(remotepath), localpath)
+
+    host.get_connection = lambda: nullcontext(Connection())
+
+    # nothing is replaced unless every shard arrives
+    with pytest.raises(OSError):
+        host.apply_pull()
+
+    assert {
+        p.name: p.read_text() for p in shard_dir(mock_task_file).iterdir()
+    } == local_shards
+
+    failing.clear()
+    host.apply_pull()
+    pulled = load_manager(mock_task_file)
+    pulled.load_all()
+    assert sorted(pulled.tasks_index) == [
+        "home",
+        "home/chores",
+        "work",
+        "work/report",
+    ]
+
+
+def test_sync_offline_queue(mock_task_file):
+    config = DellaConfig(
+        {
+            "local": {"task_file_local": mock_task_file.as_posix()},
+            "remote": {
+                "use_remote": True,
+                "user": "me",
+                "task_file_remote": "~/della/tasks.toml",
+                "private_key_location": "~/.ssh/della",
+                "hosts": [{"address": "up"}, {"address": "away"}],
+            },
+            "style": {"tasks_display": []},
+        },
+        "config.toml",
+    )
+    pushed = []
+
+    def push_and_update(host):
+        if host.sync_config.address == "away" and not host.reachable():
+            raise ConnectionRefusedError("refused")
+
+        pushed.append(host.sync_config.address)
+        return "pushed"
+
+    def mock_group():
+        group = SyncGroup(config)
+
+        for host in group.hosts:
+            host.push_and_update = partial(push_and_update, host)
+            host.fetch_version = lambda: 100
+            host.should_pull = lambda: False
+
+        return group
+
+    group = mock_group()
+    up, away = group.hosts
+    away.offline_until = time.time() + 60
+    group.push_and_update()
+
+    assert pushed == ["up"]
+    assert group.failures() == ["away: failed: refused, queued for next time"]
+
+    # skipped straight away while offline, without trying to connect
+    with pytest.raises(ConnectionError):
+        with away.get_connection():
+            pass
+
+    # carried over to the next session, and sent once the host is back
+    group = mock_group()
+    up, away = group.hosts
+    assert away.push_queued and not away.reachable() and not up.push_queued
+
+    away.offline_until = 0.0
+    assert not group.pull_and_update()
+    assert pushed == ["up", "away"]
+    assert not away.push_queued
+    assert "queued push pushed" in group.report()[1]
+    assert json.loads(group.state_file.read_text()) == {}
+
+    # only sent once the remote actually takes it
+    away.push_queued = True
+    away.push_and_update = lambda: "kept its newer version"
+    group.pull_and_update()
+    assert away.push_queued
+
+    group.push_and_update()
+    assert away.push_queued and not up.push_queued
+
+
+def test_input_lexer(mock_task_file):
+    manager = TaskManager(save_file=mock_task_file)
+    manager.add_tasks([("", "work", None), ("work", "report", None)])
+    lexer = InputLexer(DateParser(), lambda: manager)
+
+    assert lexer.lex_line("@mv #report #work friday") == [
+        ("class:highlight_command", "@mv"),
+        ("", " "),
+        ("class:highlight_task", "#report"),
+        ("", " #work"),
+        ("class:highlight_date", " friday"),
+    ]
+
+    # unknown tasks and commands aren't highlighted
+    assert lexer.lex_line("@nope #home") == [("", "@nope #home")]
+
+    # until the tree changes
+    manager.add_task("home")
+    assert lexer.lex_line("@nope #home")[-1] == ("class:highlight_task", "#home")
+
+    # ids and paths are looked up as task_from_path would, but only
+    # among the shards already read, rather than reading one in
+    save_manager(manager, "sharded")
+    manager = load_manager(mock_task_file)
+
+    def highlighted(word: str) -> bool:
+        return lexer.lex_line(f"@ls {word}")[-1][0] == "class:highlight_task"
+
+    assert highlighted("#work") and highlighted("#id:1") and highlighted("#0")
+    assert not highlighted("#work/report") and not highlighted("#2")
+    assert not manager.tasks_index["work"].loaded
+
+    manager.tasks_index["work"].subtasks
+    assert highlighted("#work/report") and highlighted("#2")
+    assert highlighted("#report") and not highlighted("#id:9")
+
+    # words are only looked up again once the index changes
+    lookups = lexer._lookups
+    manager.set_sorted(manager.tasks_index["work"])
+    assert highlighted("#report") and lexer._lookups is lookups
+    manager.add_task("garden")
+    assert highlighted("#garden") and lexer._lookups is not lookups
+
+    # as the user types, dates are only parsed from near the edit
+    parsed = []
+    date_parser = DateParser()
+    typed_lexer = InputLexer(date_parser, lambda: manager)
+    typed_lexer.date_parser = SimpleNamespace(
+        get_last=lambda text: parsed.append(text) or date_parser.get_last(text)
+    )
+    line = "#report write up notes about the new plan for the team by friday"
+
+    for end in range(1, len(line) + 1):
+        typed_lexer.lex_line(line[:end])
+
+    assert typed_lexer.lex_line(line) == lexer.lex_line(line)
+    assert parsed[-1] == "plan for the team by friday"
@@ -0,0 +1,110 @@
+"""
+Memory budgets for large task trees, measured with tracemalloc.
+
+Tracing makes reading TOML very slow (minutes for 100k tasks), so only a
+small tree is checked by default. Set DELLA_MEMORY_TESTS=1 to also check
+100k tasks, or DELLA_MEMORY_TESTS=large for 1M as well. Peak memory is
+printed for each, which pytest shows with -s.
+"""
+
+import gc
+import os
+import tracemalloc
+from contextlib import contextmanager
+from io import StringIO
+from itertools import islice
+
+import pytest
+
+from benchmarks.generators import make_manager
+from della.cli import format_task_lines
+from della.completion import TaskCompleter
+from della.frecency import Frecency
+from della.task import TaskManager
+
+# kept by a loaded task: the Task itself, its content and slug, its
+# cached path, and its entries in tasks_index and the completer
+BYTES_PER_TASK = 1024
+
+# the most in use at once while loading, saving or listing
+PEAK_BYTES_PER_TASK = {"load": 6144, "serialize": 1536, "list": 512}
+
+SIZES = [2_000]
+
+if os.environ.get("DELLA_MEMORY_TESTS"):
+    SIZES.append(100_000)
+
+if os.environ.get("DELLA_MEMORY_TESTS") == "large":
+    SIZES.append(1_000_000)
+
+
+@contextmanager
+def traced():
+    """Yields a dict that's given the memory kept and the peak, in bytes"""
+    gc.collect()
+    tracemalloc.start()
+    usage = {}
+
+    try:
+        yield usage
+        gc.collect()
+        usage["kept"], usage["peak"] = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: f"{size}_tasks")
+def task_file_text(request):
+    buffer = StringIO()
+    make_manager("realistic", request.param).serialize(buffer)
+    return request.param, buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def loaded(task_file_text):
+    size, text = task_file_text
+
+    with traced() as usage:
+        manager = TaskManager.deserialize("tasks.toml", fp=StringIO(text))
+
+        # built the way the prompt builds it, ranked by recent use
+        frecency = Frecency()
+        frecency.visit(*islice(manager, 0, size, 100))
+        completer = TaskCompleter.from_snapshot(manager.snapshot(), rank=frecency.score)
+
+    return size, manager, completer, usage
+
+
+def test_loaded_tree_budget(loaded):
+    size, manager, completer, usage = loaded
+
+    print(
+        f"\n{size} tasks: {usage['kept'] / size:.0f} bytes kept per task, "
+        f"{usage['peak'] / size:.0f} at peak while loading"
+    )
+
+    assert len(manager.tasks_index) == size
+    assert completer.compdict
+    assert usage["kept"] / size < BYTES_PER_TASK
+    assert usage["peak"] / size < PEAK_BYTES_PER_TASK["load"]
+
+
+def test_serialize_peak(loaded):
+    size, manager, _, _ = loaded
+
+    with open(os.devnull, "w") as devnull, traced() as usage:
+        manager.serialize(devnull)
+
+    print(f"\n{size} tasks: {usage['peak'] / size:.0f} bytes per task saving")
+    assert usage["peak"] / size < PEAK_BYTES_PER_TASK["serialize"]
+
+
+def test_list_peak(loaded):
+    size, manager, _, _ = loaded
+
+    with traced() as usage:
+        lines = format_task_lines(manager, manager.root_task, term_width=120)
+
+    print(f"\n{size} tasks: {usage['peak'] / size:.0f} bytes per task listing")
+    assert len(lines) == size
+    assert usage["peak"] / size < PEAK_BYTES_PER_TASK["list"]